@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'pdf_processing.middleware.ServerTimingMiddleware', # Server-Timing header + latency histograms
+    'pdf_processing.middleware.ProfilingMiddleware', # Opt-in cProfile capture, see pdf_processing/profiling.py
 ]
 
 ROOT_URLCONF = 'pdf_price_editor.urls'
@@ -74,12 +77,52 @@ WSGI_APPLICATION = 'pdf_price_editor.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# The backend is selected through environment variables so that production
+# deployments can run on PostgreSQL while local development keeps SQLite.
+#   DB_ENGINE        'sqlite' (default) or 'postgresql'
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT   PostgreSQL connection
+#   DB_CONN_MAX_AGE  seconds to keep persistent connections open (default 60)
+#   DB_POOL          '1' to use psycopg's connection pool instead of
+#                    persistent connections (requires psycopg[pool])
+#   DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE   pool bounds
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'pdf_price_editor'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Pooled connections and persistent connections are mutually exclusive.
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if DB_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # WAL lets readers proceed while a status update is being written,
+                # and IMMEDIATE transactions avoid lock upgrade deadlocks between workers.
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -122,6 +165,141 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# File storage for uploads and modified PDFs: PDF_STORAGE=local (MEDIA_ROOT) or
+# s3 for any S3-compatible object store (AWS S3, MinIO, ...), which needs the
+# optional django-storages[s3] package. Set S3_ENDPOINT_URL for non-AWS stores.
+PDF_STORAGE = os.environ.get('PDF_STORAGE', 'local')
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+if PDF_STORAGE == 's3':
+    STORAGES['default'] = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': os.environ.get('S3_BUCKET', 'pdf-price-editor'),
+            'endpoint_url': os.environ.get('S3_ENDPOINT_URL') or None, # e.g. http://minio:9000
+            'access_key': os.environ.get('S3_ACCESS_KEY'),
+            'secret_key': os.environ.get('S3_SECRET_KEY'),
+            'region_name': os.environ.get('S3_REGION') or None,
+            'file_overwrite': False, # Stored names are never reused, see pdf_processing/storage.py
+        },
+    }
+
+# Node-local read-through cache for documents of a remote storage
+PDF_STORAGE_CACHE_DIR = os.environ.get('PDF_STORAGE_CACHE_DIR', str(BASE_DIR / 'cache' / 'documents'))
+PDF_STORAGE_CACHE_MAX_BYTES = int(os.environ.get('PDF_STORAGE_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+
+# Node-local cache of pipeline artifacts (page text, span index, price hits, edit plans; see pdf_processing/pipeline.py)
+PDF_PIPELINE_CACHE_DIR = os.environ.get('PDF_PIPELINE_CACHE_DIR', str(BASE_DIR / 'cache' / 'pipeline'))
+PDF_PIPELINE_CACHE_MAX_BYTES = int(os.environ.get('PDF_PIPELINE_CACHE_MAX_BYTES', str(512 * 1024 ** 2)))
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            'format': 'time=%(asctime)s level=%(levelname)s logger=%(name)s msg="%(message)s"',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'pdf_processing': {
+            'handlers': ['console'],
+            'level': os.environ.get('PDF_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Expose per-endpoint and per-phase latency histograms at /api/pdf/metrics
+# (Prometheus text format). Histograms are kept per worker process.
+PDF_METRICS_ENABLED = os.environ.get('PDF_METRICS_ENABLED', '0') == '1'
+
+# Profiling of slow PDF operations (pdf_processing/profiling.py).
+# Captures and the digest of the offending document are written to PDF_PROFILE_DIR.
+# Staff users can request a full profile with the header "X-PDF-Profile: 1";
+# ProfilingSwitch rows in the admin enable it per user or globally. Operations
+# running longer than PDF_PROFILE_SLOW_THRESHOLD seconds are stack-sampled automatically.
+PDF_PROFILE_DIR = os.environ.get('PDF_PROFILE_DIR', BASE_DIR / 'profiles')
+PDF_PROFILE_HEADER = 'X-PDF-Profile'
+PDF_PROFILE_SLOW_THRESHOLD = float(os.environ['PDF_PROFILE_SLOW_THRESHOLD']) if os.environ.get('PDF_PROFILE_SLOW_THRESHOLD') else 30.0
+
+# How modified PDFs are saved unless the request or the user's profile picks
+# another one: 'fast' (incremental), 'balanced' or 'compact' (smallest files)
+PDF_DEFAULT_SAVE_PROFILE = os.environ.get('PDF_SAVE_PROFILE', 'balanced')
+
+# Images in optimized PDFs (replace with "optimize": true, or the optimize
+# endpoint) that are displayed above this resolution are downsampled to it
+PDF_OPTIMIZE_TARGET_DPI = int(os.environ.get('PDF_OPTIMIZE_TARGET_DPI', '150'))
+
+# Modified-file revisions kept per document by `manage.py collect_media_garbage`
+PDF_KEEP_REVISIONS = int(os.environ.get('PDF_KEEP_REVISIONS', '5'))
+
+# Worker processes for the CPU-bound PDF work of the async views (0 = one per core),
+# and how many calls may be running or queued before requests get a 503 with Retry-After
+# (0 = four per worker). Serve the project with an ASGI server, e.g.
+# `uvicorn pdf_price_editor.asgi:application`, to benefit from the async views.
+PDF_WORKER_PROCESSES = int(os.environ.get('PDF_WORKER_PROCESSES', '0'))
+PDF_WORKER_MAX_PENDING = int(os.environ.get('PDF_WORKER_MAX_PENDING', '0'))
+PDF_WORKER_RETRY_AFTER = 5 # Seconds
+
+# Warm up at boot (pdf_processing/apps.py): the web process imports PyMuPDF,
+# Pillow and pytesseract, which pdf_processing loads lazily otherwise, and
+# starts and warms every pool worker, so the first PDF request after a deploy
+# is not a cold one. Off by default, as it slows down boot and tests.
+PDF_WARM_UP = os.environ.get('PDF_WARM_UP', '0') == '1'
+
+# Long-running, pre-warmed worker daemon (python manage.py run_pdf_workers): a
+# Unix socket path or host:port. When set, the views send their PDF work to it
+# instead of starting a pool per web process; set PDF_WORKER_PROCESSES to the
+# daemon's process count so admission control matches it.
+PDF_WORKER_DAEMON_ADDRESS = os.environ.get('PDF_WORKER_DAEMON_ADDRESS', '')
+PDF_WORKER_DAEMON_AUTHKEY = os.environ.get('PDF_WORKER_DAEMON_AUTHKEY', '') # Derived from SECRET_KEY if empty
+PDF_WORKER_DAEMON_TIMEOUT = int(os.environ.get('PDF_WORKER_DAEMON_TIMEOUT', '600')) # Seconds a call may take
+
+# OCR languages: UserProfile.preferred_language -> Tesseract language; the
+# worker daemon warms all of them at startup. Documents' languages are detected
+# among these at extraction (pdf_processing/languages.py)
+PDF_OCR_LANGUAGES = {'uk': 'ukr', 'it': 'ita', 'en': 'eng'}
+
+# Admission control in front of the worker pool (see pdf_processing/admission.py):
+# concurrent heavy operations overall (0 = one per worker process) and per user,
+# how many may wait per user, the longest wait before answering 429 with
+# Retry-After, and the fair-queuing weight of staff users (others have 1)
+PDF_ADMISSION_GLOBAL_SLOTS = int(os.environ.get('PDF_ADMISSION_GLOBAL_SLOTS', '0'))
+PDF_ADMISSION_USER_SLOTS = int(os.environ.get('PDF_ADMISSION_USER_SLOTS', '2'))
+PDF_ADMISSION_USER_QUEUE = int(os.environ.get('PDF_ADMISSION_USER_QUEUE', '8'))
+PDF_ADMISSION_MAX_WAIT = float(os.environ.get('PDF_ADMISSION_MAX_WAIT', '10'))
+PDF_ADMISSION_STAFF_WEIGHT = 2
+
+# Most before/after crops rendered by a reprice-diff preview (overflowing prices first)
+PDF_PREVIEW_MAX_CROPS = 200
+
+# Documents per batch (see pdf_processing/batches.py)
+# A document's 'processing' claim (PdfDocument.start_processing) expires after this
+# long, so a request or batch that was interrupted does not block the document for good
+PDF_PROCESSING_LEASE_SECONDS = int(os.environ.get('PDF_PROCESSING_LEASE_SECONDS', '3600'))
+
+PDF_BATCH_MAX_DOCUMENTS = int(os.environ.get('PDF_BATCH_MAX_DOCUMENTS', '200'))
+# Batch runners touch their batch's heartbeat this often; batches whose heartbeat
+# stopped for PDF_BATCH_STALE_SECONDS are taken for interrupted (by a restart or
+# deploy) and their unfinished documents are failed at startup
+PDF_BATCH_HEARTBEAT_SECONDS = int(os.environ.get('PDF_BATCH_HEARTBEAT_SECONDS', '30'))
+PDF_BATCH_STALE_SECONDS = int(os.environ.get('PDF_BATCH_STALE_SECONDS', '300'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
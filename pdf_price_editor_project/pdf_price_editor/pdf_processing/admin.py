@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PdfDocument
+from .models import PdfBatch, PdfBatchItem, PdfDocument, PdfRevision, PriceOccurrence, ProfilingSwitch
 
 @admin.register(PdfDocument)
 class PdfDocumentAdmin(admin.ModelAdmin):
@@ -7,3 +7,34 @@ class PdfDocumentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'user', 'upload_date')
     search_fields = ('file_name', 'user__username', 'user__email')
     readonly_fields = ('upload_date',)
+
+@admin.register(PdfRevision)
+class PdfRevisionAdmin(admin.ModelAdmin):
+    list_display = ('file', 'document', 'size_bytes', 'save_profile', 'created')
+    raw_id_fields = ('document',)
+
+class PdfBatchItemInline(admin.TabularInline):
+    model = PdfBatchItem
+    raw_id_fields = ('document',)
+    readonly_fields = ('stage', 'prices_found', 'prices_changed', 'error', 'updated')
+    extra = 0
+
+@admin.register(PdfBatch)
+class PdfBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'optimize', 'created', 'finished')
+    list_filter = ('status',)
+    raw_id_fields = ('user',)
+    inlines = [PdfBatchItemInline]
+
+@admin.register(PriceOccurrence)
+class PriceOccurrenceAdmin(admin.ModelAdmin):
+    list_display = ('raw_text', 'value', 'currency', 'page_number', 'document')
+    list_filter = ('currency',)
+    search_fields = ('raw_text', 'document__file_name')
+    raw_id_fields = ('document',)
+
+@admin.register(ProfilingSwitch)
+class ProfilingSwitchAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'enabled', 'user', 'note', 'created')
+    list_editable = ('enabled',)
+    raw_id_fields = ('user',)
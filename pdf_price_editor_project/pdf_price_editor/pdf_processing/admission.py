@@ -0,0 +1,265 @@
+"""
+Admission control for the heavy PDF endpoints.
+
+The worker pool (workers.py) bounds how much work runs at once, but not who
+gets it: one user firing hundreds of OCR requests would fill the pool and its
+queue and starve everyone else. The views therefore take a slot here before
+handing work to the pool:
+
+* At most PDF_ADMISSION_GLOBAL_SLOTS operations hold a slot at once (one per
+  worker process by default), and at most PDF_ADMISSION_USER_SLOTS per user.
+* Waiting operations are served by weighted fair queuing: each one is tagged
+  with a virtual finish time of start + estimated cost / user weight, where the
+  start is the later of the scheduler's virtual time and the user's previous
+  finish tag. The waiting operation with the smallest tag whose user has a
+  free slot goes next, so a user with a long backlog only delays their own
+  requests. Staff users get PDF_ADMISSION_STAFF_WEIGHT.
+* The cost of an operation is a moving average of how long its slots were
+  held. If the estimated wait of a new operation exceeds
+  PDF_ADMISSION_MAX_WAIT seconds, or the user already has
+  PDF_ADMISSION_USER_QUEUE operations waiting, it is rejected straight away
+  with AdmissionRejected, which the views turn into a 429 with Retry-After.
+  Operations still waiting after PDF_ADMISSION_MAX_WAIT are rejected as well.
+
+Queue depth, running operations, wait times and rejections are exported with
+the other metrics (see metrics_view).
+
+Requests may be served from several event loops (one per thread under WSGI or
+the test client), so the scheduler state is guarded by a thread lock and
+waiters are woken through their own loop.
+"""
+from contextlib import asynccontextmanager
+from collections import defaultdict, deque
+from django.conf import settings
+import asyncio
+import itertools
+import math
+import threading
+import time
+
+from .instrumentation import registry
+
+
+DEFAULT_OPERATION_SECONDS = 1.0 # Cost estimate of an operation before any was measured
+COST_SMOOTHING = 0.2 # Weight of the newest hold time in the moving average
+
+
+class AdmissionRejected(Exception):
+    """Raised when an operation would wait too long for a slot."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _Ticket:
+    __slots__ = ('user_key', 'operation', 'start', 'finish', 'sequence', 'loop', 'future', 'granted', 'enqueued', 'admitted')
+
+    def __init__(self, user_key, operation, start, finish, sequence, loop):
+        self.user_key = user_key
+        self.operation = operation
+        self.start = start
+        self.finish = finish
+        self.sequence = sequence # Breaks ties between equal finish tags in arrival order
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+        self.enqueued = time.monotonic()
+        self.admitted = None
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """Per-user and global concurrency slots handed out by weighted fair queuing."""
+
+    def __init__(self, global_slots, user_slots, max_wait, user_queue):
+        self.configuration = (global_slots, user_slots, max_wait, user_queue)
+        self.global_slots = global_slots
+        self.user_slots = user_slots
+        self.max_wait = max_wait
+        self.user_queue = user_queue
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._queues = {} # user key -> deque of waiting tickets, in finish tag order
+        self._running = defaultdict(int) # user key -> slots held
+        self._running_total = 0
+        self._last_finish = {} # user key -> finish tag of the user's latest ticket
+        self._virtual_time = 0.0
+        self._costs = {} # operation -> moving average of hold seconds
+
+    def cost(self, operation):
+        return self._costs.get(operation, DEFAULT_OPERATION_SECONDS)
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _estimated_wait(self, ticket):
+        # Work queued ahead of the ticket, spread over the global slots, and the
+        # user's own backlog, spread over the user's slots; whichever is longer
+        ahead = sum(
+            self.cost(other.operation)
+            for queue in self._queues.values() for other in queue
+            if (other.finish, other.sequence) < (ticket.finish, ticket.sequence)
+        )
+        own = sum(self.cost(other.operation) for other in self._queues.get(ticket.user_key, ()))
+        cost = self.cost(ticket.operation)
+        return max((ahead + cost) / self.global_slots, (own + cost) / self.user_slots)
+
+    def _dispatch(self):
+        # Called with the lock held: grants free slots to the smallest finish tags
+        while self._running_total < self.global_slots:
+            best = None
+            for user_key, queue in self._queues.items():
+                if self._running.get(user_key, 0) < self.user_slots:
+                    head = queue[0]
+                    if best is None or (head.finish, head.sequence) < (best.finish, best.sequence):
+                        best = head
+            if best is None:
+                return
+            queue = self._queues[best.user_key]
+            queue.popleft()
+            if not queue:
+                del self._queues[best.user_key]
+            self._grant(best)
+            best.loop.call_soon_threadsafe(_wake, best.future)
+
+    def _grant(self, ticket):
+        ticket.granted = True
+        ticket.admitted = time.monotonic()
+        self._running[ticket.user_key] += 1
+        self._running_total += 1
+        self._virtual_time = max(self._virtual_time, ticket.start)
+
+    def _update_gauges(self):
+        registry.set_gauge('pdf_admission_queue_depth', {}, sum(len(queue) for queue in self._queues.values()))
+        registry.set_gauge('pdf_admission_running', {}, self._running_total)
+
+    def _reject(self, ticket, reason, retry_after):
+        registry.increment('pdf_admission_rejected_total', {'operation': ticket.operation, 'reason': reason})
+        return AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, user_key, operation, weight=1):
+        """
+        Waits for a slot for one operation of the user.
+
+        Returns:
+            _Ticket: To be passed to release().
+
+        Raises:
+            AdmissionRejected: If the wait would be, or became, too long.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            start = max(self._virtual_time, self._last_finish.get(user_key, 0.0))
+            ticket = _Ticket(user_key, operation, start, start + self.cost(operation) / weight, next(self._sequence), loop)
+
+            if not self._queues and self._running_total < self.global_slots and \
+               self._running.get(user_key, 0) < self.user_slots:
+                self._last_finish[user_key] = ticket.finish
+                self._grant(ticket)
+                self._update_gauges()
+                registry.observe('pdf_admission_wait_seconds', {'operation': operation}, 0.0)
+                return ticket
+
+            waiting = len(self._queues.get(user_key, ()))
+            if waiting >= self.user_queue:
+                raise self._reject(ticket, 'user_queue_full', self._estimated_wait(ticket))
+            estimate = self._estimated_wait(ticket)
+            if estimate > self.max_wait:
+                raise self._reject(ticket, 'estimated_wait', estimate)
+
+            self._last_finish[user_key] = ticket.finish
+            queue = self._queues.setdefault(user_key, deque())
+            queue.append(ticket) # A user's tags only grow, so the deque stays sorted
+            self._dispatch()
+            self._update_gauges()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if not ticket.granted:
+                    queue = self._queues.get(user_key)
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[user_key]
+                        if not self._running.get(user_key):
+                            self._last_finish.pop(user_key, None)
+                    self._update_gauges()
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                    raise self._reject(ticket, 'timeout', self._estimated_wait(ticket))
+            # Granted just as the wait ended: keep the slot unless the request went away
+            if isinstance(e, asyncio.CancelledError):
+                self.release(ticket)
+                raise
+        registry.observe('pdf_admission_wait_seconds', {'operation': operation}, ticket.admitted - ticket.enqueued)
+        return ticket
+
+    def release(self, ticket):
+        """Frees the ticket's slot and feeds its hold time into the operation's cost estimate."""
+        held = time.monotonic() - ticket.admitted
+        with self._lock:
+            previous = self._costs.get(ticket.operation)
+            self._costs[ticket.operation] = held if previous is None else \
+                previous + COST_SMOOTHING * (held - previous)
+            self._running[ticket.user_key] -= 1
+            self._running_total -= 1
+            if not self._running[ticket.user_key]:
+                del self._running[ticket.user_key]
+                if ticket.user_key not in self._queues:
+                    # Idle users start again from the virtual time
+                    self._last_finish.pop(ticket.user_key, None)
+            self._dispatch()
+            self._update_gauges()
+
+
+_controller_lock = threading.Lock()
+_controller = None
+
+
+def _configuration():
+    from .workers import worker_count
+
+    return (
+        settings.PDF_ADMISSION_GLOBAL_SLOTS or worker_count(),
+        settings.PDF_ADMISSION_USER_SLOTS,
+        settings.PDF_ADMISSION_MAX_WAIT,
+        settings.PDF_ADMISSION_USER_QUEUE,
+    )
+
+
+def get_controller():
+    """The process-wide controller, rebuilt if the settings changed (e.g. in tests)."""
+    global _controller
+    configuration = _configuration()
+    with _controller_lock:
+        if _controller is None or _controller.configuration != configuration:
+            _controller = AdmissionController(*configuration)
+        return _controller
+
+
+def user_weight(user):
+    return settings.PDF_ADMISSION_STAFF_WEIGHT if user.is_staff else 1
+
+
+@asynccontextmanager
+async def admitted(user, operation):
+    """
+    Holds an admission slot of the user for operation while the block runs.
+
+    Raises:
+        AdmissionRejected: If the user should retry later.
+    """
+    controller = get_controller()
+    ticket = await controller.acquire(user.pk, operation, weight=user_weight(user))
+    try:
+        yield
+    finally:
+        controller.release(ticket)
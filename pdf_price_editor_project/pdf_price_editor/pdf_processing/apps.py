@@ -1,6 +1,67 @@
 from django.apps import AppConfig
+import logging
+import os
+import sys
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def _serves_requests():
+    """
+    Whether this process serves requests: an ASGI/WSGI server, or runserver's
+    serving process (not its autoreloader), as opposed to other management
+    commands and the PDF worker processes.
+    """
+    from .workers import _worker_process
+
+    if _worker_process:
+        return False
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program in ('manage.py', 'django-admin', '__main__.py'):
+        command = sys.argv[1] if len(sys.argv) > 1 else ''
+        return command == 'runserver' and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv)
+    return True
+
+
+def _warm_up():
+    from .workers import warm_up
+
+    try:
+        warm_up()
+    except Exception:
+        logger.exception("PDF warm-up failed; the first requests will warm up instead")
+
+
+def _fail_stale_batches():
+    from django.db import connections
+    from .batches import fail_stale_batches
+
+    try:
+        fail_stale_batches()
+    except Exception:
+        logger.exception("Could not fail the batches interrupted by the last restart")
+    finally:
+        connections.close_all() # The thread's own connections
 
 
 class PdfProcessingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pdf_processing'
+
+    def ready(self):
+        from django.conf import settings
+        from . import profiling
+
+        profiling.configure(
+            output_dir=getattr(settings, 'PDF_PROFILE_DIR', None),
+            slow_threshold=getattr(settings, 'PDF_PROFILE_SLOW_THRESHOLD', None),
+        )
+
+        if not _serves_requests():
+            return
+        # In the background, so the server starts taking requests right away
+        threading.Thread(target=_fail_stale_batches, name='pdf-batch-recovery', daemon=True).start()
+        if getattr(settings, 'PDF_WARM_UP', False):
+            threading.Thread(target=_warm_up, name='pdf-warm-up', daemon=True).start()
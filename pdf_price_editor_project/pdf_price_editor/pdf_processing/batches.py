@@ -0,0 +1,337 @@
+"""
+Multi-document batches: the extract -> identify -> reprice -> optimize pipeline
+over a set of documents.
+
+start_batch() runs a batch in a background thread with its own event loop.
+Each document goes through the stages in order, and up to
+PDF_ADMISSION_USER_SLOTS documents of a batch are in flight at once. Their
+CPU-bound work runs in the worker pool behind the owner's admission slots
+(admission.py), so a 200-document batch shares the pool fairly with
+interactive requests. When admission control or the pool turn work away, the
+batch waits for the Retry-After time and tries again instead of failing the
+document.
+
+Extraction and repricing run as pipeline.PDF_PIPELINE, whose intermediate
+artifacts are cached by content, so running a batch again with other rules
+only recomputes the edit plan and the output.
+
+Every stage change is written to the document's PdfBatchItem, which the batch
+status endpoint reports. iter_zip() streams the outputs as a ZIP archive
+that is never staged in memory or on disk (aiter_zip() for async views).
+
+A batch's runner lives in the web process that started it, so a restart or
+deploy stops it mid-way, and nothing resumes it. The runner records itself
+on the batch (host:pid) and touches its heartbeat every
+PDF_BATCH_HEARTBEAT_SECONDS, however long a stage or an admission wait takes.
+fail_stale_batches(), run at startup (see apps.py), fails the unfinished items
+of batches whose heartbeat stopped for PDF_BATCH_STALE_SECONDS, and releases
+their documents, so they can be submitted again. Batches still running in a
+sibling process keep their heartbeat and are left alone.
+"""
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from datetime import datetime, timedelta
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import zipfile
+
+from .admission import AdmissionRejected, admitted
+from .models import PdfBatch, PdfBatchItem
+from .pipeline import run_pdf_pipeline
+from .repricing import RuleSet
+from .storage import document_path, scratch_path, store_file
+from .workers import WorkerPoolBusy, run_in_worker
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItemFailed(Exception):
+    """A document cannot go through the pipeline; the message is shown in the batch status."""
+
+
+def start_batch(batch_id):
+    """Runs the batch in a background thread; returns the thread."""
+    thread = threading.Thread(target=_run_batch_thread, args=(batch_id,), name=f'pdf-batch-{batch_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_batch_thread(batch_id):
+    try:
+        async_to_sync(run_batch)(batch_id)
+    except Exception:
+        logger.exception("PDF batch %s stopped", batch_id)
+    finally:
+        connections.close_all() # The thread's own connections
+
+
+async def _run(user, operation, func, *args, **kwargs):
+    """run_in_worker() behind the user's admission slot, waiting out rejections instead of failing."""
+    while True:
+        try:
+            async with admitted(user, operation):
+                return await run_in_worker(func, *args, **kwargs)
+        except AdmissionRejected as rejection:
+            await asyncio.sleep(rejection.retry_after)
+        except WorkerPoolBusy:
+            await asyncio.sleep(settings.PDF_WORKER_RETRY_AFTER)
+
+
+def _set_stage(item, stage, **fields):
+    item.stage = stage
+    for field_name, value in fields.items():
+        setattr(item, field_name, value)
+    item.save(update_fields=['stage', 'updated', *fields])
+
+
+def _store_pages(document, pages):
+    document.store_extraction(pages)
+    document.transition('processing', extracted_text="".join(page['text'] for page in pages))
+
+
+def _store_output(document, output_pdf_path, save_profile):
+    base_filename = os.path.basename(document.uploaded_file.name)
+    name, ext = os.path.splitext(base_filename)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    stored_name = store_file(f'user_{document.user_id}/pdfs/modified/{name}_mod_{timestamp}{ext}', output_pdf_path)
+    document.transition('processing', modified_file=stored_name)
+    document.record_revision(stored_name, size_bytes=os.path.getsize(output_pdf_path), save_profile=save_profile)
+
+
+async def run_batch(batch_id):
+    """Runs every queued item of the batch through the pipeline."""
+    batch = await PdfBatch.objects.select_related('user').aget(pk=batch_id)
+    rule_set = RuleSet.from_dict(batch.rules) if batch.rules is not None else None
+    await PdfBatch.objects.filter(pk=batch_id).aupdate(status='running', runner=f"{socket.gethostname()}:{os.getpid()}",
+                                                       heartbeat=timezone.now())
+    heartbeat = asyncio.create_task(_heartbeat(batch_id))
+
+    items = [item async for item in batch.items.select_related('document').filter(stage='queued')]
+    in_flight = asyncio.Semaphore(settings.PDF_ADMISSION_USER_SLOTS)
+
+    async def process(item):
+        async with in_flight:
+            try:
+                await _process_item(batch, item, rule_set)
+            except BatchItemFailed as e:
+                await sync_to_async(_set_stage)(item, 'failed', error=str(e)[:255])
+            except Exception:
+                logger.exception("PDF batch %s failed on document %s", batch_id, item.document_id)
+                await sync_to_async(_set_stage)(item, 'failed', error='Unexpected error while processing the document.')
+
+    try:
+        await asyncio.gather(*(process(item) for item in items))
+    finally:
+        heartbeat.cancel()
+    await PdfBatch.objects.filter(pk=batch_id, status='running').aupdate(status='completed', finished=timezone.now())
+
+
+async def _heartbeat(batch_id):
+    # Tells fail_stale_batches() in other processes that this runner is alive
+    while True:
+        await asyncio.sleep(settings.PDF_BATCH_HEARTBEAT_SECONDS)
+        await PdfBatch.objects.filter(pk=batch_id, status='running').aupdate(heartbeat=timezone.now())
+
+
+async def _run_pipeline(user, operation, pdf_path, params, targets):
+    result = await _run(user, operation, run_pdf_pipeline, pdf_path, params, targets)
+    if result is None:
+        raise BatchItemFailed(f'Failed to {operation} the PDF.')
+    return result[0]
+
+
+async def _process_item(batch, item, rule_set):
+    from .utils import optimize_pdf
+
+    document = item.document
+    user = batch.user
+    await sync_to_async(_set_stage)(item, 'extract')
+    pdf_path = await sync_to_async(document_path, thread_sensitive=False)(document.uploaded_file)
+    if pdf_path is None:
+        raise BatchItemFailed('File not found on server.')
+    if not await sync_to_async(document.start_processing)():
+        raise BatchItemFailed('Document is being processed by another request.')
+
+    scratch_files = []
+    try:
+        # Stages are cached by content (see pipeline.py): running a batch again
+        # with other rules only recomputes the edit plan and the output
+        known_pages = await sync_to_async(document.known_page_hashes)()
+        results = await _run_pipeline(user, 'extract', pdf_path, {'known_pages': known_pages}, ['extraction'])
+        await sync_to_async(_store_pages)(document, results['extraction'])
+
+        # Prices were detected and the document's price formats learned while storing the index
+        await sync_to_async(_set_stage)(item, 'identify', prices_found=await document.price_occurrences.acount())
+
+        current_path = pdf_path
+        if rule_set is not None:
+            await sync_to_async(_set_stage)(item, 'reprice')
+            output_pdf_path = scratch_path()
+            scratch_files.append(output_pdf_path)
+            results = await _run_pipeline(user, 'reprice', pdf_path, {
+                'rules': batch.rules, 'output_path': output_pdf_path, 'save_profile': batch.save_profile,
+            }, ['edit_plan', 'output'])
+            if results['edit_plan']:
+                if not results['output']:
+                    raise BatchItemFailed('Failed to replace prices in PDF.')
+                current_path = output_pdf_path
+            await sync_to_async(_set_stage)(item, 'reprice', prices_changed=len(results['edit_plan']))
+
+        if batch.optimize:
+            await sync_to_async(_set_stage)(item, 'optimize')
+            output_pdf_path = scratch_path()
+            scratch_files.append(output_pdf_path)
+            stats = await _run(user, 'optimize', optimize_pdf, current_path, output_pdf_path,
+                               target_dpi=settings.PDF_OPTIMIZE_TARGET_DPI)
+            if stats is None:
+                raise BatchItemFailed('Failed to optimize PDF.')
+            current_path = output_pdf_path
+
+        if current_path != pdf_path:
+            await sync_to_async(_store_output)(document, current_path, batch.save_profile)
+            # Keep the text/price index in step with the output, as the replace endpoint does
+            known_pages = await sync_to_async(document.known_page_hashes)()
+            results = await _run_pipeline(user, 'extract', current_path, {'known_pages': known_pages}, ['extraction'])
+            await sync_to_async(_store_pages)(document, results['extraction'])
+        await sync_to_async(document.mark_completed)(expected_status='processing')
+        await sync_to_async(_set_stage)(item, 'done')
+    except BaseException:
+        await sync_to_async(document.mark_failed)(expected_status='processing')
+        raise
+    finally:
+        for path in scratch_files:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def fail_stale_batches(stale_after=None):
+    """
+    Fails the unfinished work of batches whose runner is gone: running batches
+    whose heartbeat is older than stale_after seconds
+    (settings.PDF_BATCH_STALE_SECONDS), and queued batches that no runner took
+    up in that time. Their unfinished items are failed, the documents they were
+    processing are released as failed, and the batches are completed.
+
+    Returns:
+        list[int]: The ids of the batches failed.
+    """
+    stale_after = settings.PDF_BATCH_STALE_SECONDS if stale_after is None else stale_after
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    unfinished = ['queued', 'extract', 'identify', 'reprice', 'optimize']
+    failed = []
+    stale = Q(heartbeat__lt=cutoff) | Q(heartbeat=None, created__lt=cutoff)
+    for batch in PdfBatch.objects.filter(stale, status__in=['queued', 'running']):
+        # Only one process fails a batch, and not if its runner beat in the meantime
+        if not PdfBatch.objects.filter(stale, pk=batch.pk, status=batch.status).update(status='completed',
+                                                                                       finished=timezone.now()):
+            continue
+        for item in PdfBatchItem.objects.select_related('document').filter(batch=batch, stage__in=unfinished):
+            if item.stage != 'queued':
+                item.document.mark_failed(expected_status='processing')
+            _set_stage(item, 'failed', error='The batch was interrupted by a server restart.')
+        logger.warning("PDF batch %s was interrupted (runner %s); its unfinished documents were failed",
+                       batch.pk, batch.runner or 'none')
+        failed.append(batch.pk)
+    return failed
+
+
+def batch_summary(batch):
+    """The batch status reported by the API (and written into its ZIP archive)."""
+    items = list(batch.items.select_related('document').order_by('id'))
+    stages = {}
+    for item in items:
+        stages[item.stage] = stages.get(item.stage, 0) + 1
+    return {
+        'batch_id': batch.id,
+        'status': batch.status,
+        'created': batch.created.isoformat(),
+        'finished': batch.finished.isoformat() if batch.finished else None,
+        'progress': round(sum(item.progress for item in items) / len(items), 3) if items else 1.0,
+        'stages': stages,
+        'documents': [
+            {
+                'document_id': item.document_id,
+                'file_name': item.document.file_name,
+                'stage': item.stage,
+                'progress': round(item.progress, 3),
+                'prices_found': item.prices_found,
+                'prices_changed': item.prices_changed,
+                'error': item.error or None,
+            }
+            for item in items
+        ],
+    }
+
+
+class _ZipSink:
+    """
+    Write-only file object for zipfile: collects what is written until the
+    streaming generator takes it. Having no seek(), it makes zipfile write data
+    descriptors instead of going back to patch headers.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_zip(batch, chunk_size=256 * 1024):
+    """
+    Yields a ZIP archive of the batch's outputs (each document's latest file)
+    and a batch.json summary, chunk by chunk. Entries are stored, not
+    deflated: PDF streams are compressed already.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr('batch.json', json.dumps(batch_summary(batch), indent=2))
+        yield sink.drain()
+        for item in batch.items.select_related('document').filter(stage='done').order_by('id'):
+            field_file = item.document.modified_file or item.document.uploaded_file
+            arcname = f"{item.document_id}-{os.path.basename(field_file.name)}"
+            with field_file.storage.open(field_file.name, 'rb') as source, \
+                 archive.open(arcname, 'w', force_zip64=True) as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+async def aiter_zip(batch, chunk_size=256 * 1024):
+    """
+    iter_zip() for async views. Under ASGI, Django reads a sync iterator into
+    memory before it sends anything, so each chunk is built in a thread instead.
+    """
+    chunks = iter_zip(batch, chunk_size)
+    done = object()
+    try:
+        # The generator queries the database, so it stays on the one thread-sensitive thread
+        while (chunk := await sync_to_async(next)(chunks, done)) is not done:
+            if chunk:
+                yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
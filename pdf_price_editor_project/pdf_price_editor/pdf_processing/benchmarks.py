@@ -0,0 +1,576 @@
+"""
+Benchmark harness for the pdf_processing hot paths.
+
+Synthetic catalogs are generated with PyMuPDF (varied fonts, currencies and a
+share of scanned, image-only pages), and every case runs in a fresh child
+process so that its peak RSS can be measured in isolation. Results can be saved
+as a baseline and later runs compared against it.
+
+This module only depends on utils.py, not on Django, so child processes start
+quickly. Use it through `python manage.py benchmark_pdf`.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+
+import fitz # PyMuPDF
+
+
+CATALOG_FONTS = ['helv', 'hebo', 'tiro', 'tibo', 'tiit', 'cour', 'cobo']
+CATALOG_CURRENCIES = ['${value}', '{value} USD', '£{value}', '{value} EUR', '{value} UAH', '{value}']
+ITEM_NAMES = ['Chair', 'Table', 'Lamp', 'Sofa', 'Shelf', 'Desk', 'Rug', 'Mirror', 'Bench', 'Stool']
+SCANNED_PAGE_EVERY = 10 # Every 10th page is an image-only "scan"
+ROWS_PER_PAGE = 30
+REPLACEMENTS_PER_BULK_RUN = 10
+
+# Scanned lines per language for the OCR language cases, with their ground truth
+OCR_SAMPLES = {
+    'ukr': [
+        "Стілець дубовий, ціна 1 250,00 грн",
+        "Стіл обідній розкладний 4 800,00 грн",
+        "Знижка на всі товари цього тижня",
+        "Полиця настінна біла 640,00 грн",
+    ],
+    'ita': [
+        "Sedia in legno di quercia, prezzo 125,00 EUR",
+        "Tavolo da pranzo allungabile 480,00 EUR",
+        "Sconto del venti per cento più IVA",
+        "Mensola bianca da parete 64,00 EUR",
+    ],
+    'eng': [
+        "Oak wood chair, price $125.00",
+        "Extendable dining table $480.00",
+        "Twenty percent off all items this week",
+        "White wall shelf $64.00",
+    ],
+}
+# Language settings compared by the OCR cases; 'auto' is the language detected per document
+OCR_LANGUAGE_CASES = {
+    'ocr_lang_eng': 'eng',
+    'ocr_lang_ukr': 'ukr',
+    'ocr_lang_ita': 'ita',
+    'ocr_lang_combined': 'ukr+ita+eng',
+    'ocr_lang_auto': 'auto',
+}
+# Price columns of the detection corpus: header and price format; the integer one only has its header to go by
+TABLE_PRICE_COLUMNS = [('Price', '${value}'), ('Prezzo', '{value} €'), ('Ціна, грн', '{integer}'), ('Total', '{value}')]
+TABLE_ROWS_PER_PAGE = 24
+# Price detection on the table corpus: the patterns alone vs only counting bare integers in price columns
+PRICE_DETECTION_CASES = ('price_detection_patterns', 'price_detection_layout')
+# Startup cases run in a fresh interpreter (python -X importtime) with the project's settings:
+# the import audit of a web process's boot and first PDF request, and the first
+# request's latency without and with the boot warm-up (PDF_WARM_UP, see apps.py)
+STARTUP_CASES = ('import_audit', 'cold_start', 'cold_start_warmed')
+AUDITED_MODULES = ('django', 'pdf_processing.views', 'pdf_processing.utils', 'fitz', 'PIL.Image', 'pytesseract')
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+os.environ.pop('PYTHONPROFILEIMPORTTIME', None) # The audit covers this process, not the workers it spawns
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import resolve
+resolve('/api/pdf/upload') # Loads the URLconf and the views, as the first request would
+booted = time.perf_counter()
+warmed = booted
+if {warm!r}:
+    # PDF_WARM_UP is set: wait for the warm-up that AppConfig.ready() started
+    import threading
+    for thread in threading.enumerate():
+        if thread.name == 'pdf-warm-up':
+            thread.join()
+    warmed = time.perf_counter()
+from asgiref.sync import async_to_sync
+from pdf_processing.utils import extract_pages_from_pdf # The views' local import
+from pdf_processing.workers import run_in_worker, shutdown
+timings = []
+for _ in range(2):
+    request_started = time.perf_counter()
+    async_to_sync(run_in_worker)(extract_pages_from_pdf, {pdf_path!r})
+    timings.append(time.perf_counter() - request_started)
+shutdown()
+print(json.dumps({{'boot': booted - started, 'warm_up': warmed - booted, 'first': timings[0], 'second': timings[1]}}))
+'''
+# OCR of catalog price regions: the plain render vs preprocessing with single-line, whitelisted OCR
+OCR_PRICE_CASES = {
+    'ocr_price_raw': {'mode': 'text', 'preprocessed': False},
+    'ocr_price_preprocessed': {'mode': 'price', 'preprocessed': True},
+}
+
+
+def generate_catalog(path, page_count, seed=0):
+    """
+    Writes a synthetic price catalog to path.
+
+    Each text page holds a table of ROWS_PER_PAGE items (name, SKU, price) with a
+    font and currency format that vary per row. Every SCANNED_PAGE_EVERY-th page
+    is rendered to an image and embedded instead, like a scanned supplier page.
+
+    Returns:
+        list[dict]: Price regions (page_number, bbox, text) usable for the region-based cases.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    regions = []
+    for page_number in range(page_count):
+        page = doc.new_page()
+        for row in range(ROWS_PER_PAGE):
+            y = 60 + row * 24
+            font = rng.choice(CATALOG_FONTS)
+            value = f"{rng.randint(1, 9999)}.{rng.randint(0, 99):02d}"
+            price_text = rng.choice(CATALOG_CURRENCIES).format(value=value)
+            page.insert_text((50, y), f"{rng.choice(ITEM_NAMES)} {row + 1}", fontname=font, fontsize=10)
+            page.insert_text((220, y), f"SKU {rng.randint(10000, 99999)}", fontname='cour', fontsize=9)
+            page.insert_text((400, y), price_text, fontname=font, fontsize=11)
+            regions.append({
+                'page_number': page_number,
+                'bbox': (398, y - 12, 540, y + 4),
+                'text': price_text,
+            })
+
+        if page_number % SCANNED_PAGE_EVERY == SCANNED_PAGE_EVERY - 1:
+            pix = page.get_pixmap(dpi=150)
+            doc.delete_page(page_number)
+            scanned = doc.new_page(pno=page_number)
+            scanned.insert_image(scanned.rect, pixmap=pix)
+
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return regions
+
+
+def generate_ocr_samples(path):
+    """
+    Writes one scanned (image-only) page per language of OCR_SAMPLES to path.
+
+    Returns:
+        list[dict]: Line regions (language, page_number, bbox, text).
+    """
+    font = fitz.Font('helv') # Has the Cyrillic and accented glyphs the base14 encodings lack
+    doc = fitz.open()
+    regions = []
+    for page_number, (language, lines) in enumerate(OCR_SAMPLES.items()):
+        page = doc.new_page()
+        writer = fitz.TextWriter(page.rect)
+        for row, line in enumerate(lines):
+            y = 80 + row * 40
+            writer.append((50, y), line, font=font, fontsize=14)
+            regions.append({'language': language, 'page_number': page_number, 'bbox': (40, y - 18, 560, y + 8), 'text': line})
+        writer.write_text(page)
+        pix = page.get_pixmap(dpi=150)
+        doc.delete_page(page_number)
+        scanned = doc.new_page(pno=page_number)
+        scanned.insert_image(scanned.rect, pixmap=pix)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return regions
+
+
+def generate_table_corpus(path, page_count, seed=0):
+    """
+    Writes catalog pages whose tables hold numbers that are not prices next to
+    the prices: SKUs, years and quantities, a paragraph that mentions a year and
+    a page number.
+
+    Returns:
+        list[dict]: The prices (page_number, bbox, text): the ground truth of the detection cases.
+    """
+    rng = random.Random(seed)
+    font = fitz.Font('helv') # Embedded, for the Cyrillic and € the base14 encodings lack
+    doc = fitz.open()
+    prices = []
+    for page_number in range(page_count):
+        page = doc.new_page()
+        header, price_format = TABLE_PRICE_COLUMNS[page_number % len(TABLE_PRICE_COLUMNS)]
+        page.insert_font(fontname='F0', fontbuffer=font.buffer)
+        page.insert_text((50, 40), f"Collection {rng.randint(2015, 2025)}: prices valid for 30 days", fontsize=9)
+        for x, title in ((50, 'Item'), (200, 'SKU'), (290, 'Year'), (350, 'Qty'), (420, header)):
+            page.insert_text((x, 70), title, fontname='F0', fontsize=10)
+        for row in range(TABLE_ROWS_PER_PAGE):
+            y = 92 + row * 24
+            value = f"{rng.randint(1, 2999)}.{rng.randint(0, 99):02d}"
+            price_text = price_format.format(value=value, integer=rng.randint(10, 9999))
+            page.insert_text((50, y), f"{rng.choice(ITEM_NAMES)} {row + 1}", fontsize=10)
+            page.insert_text((200, y), str(rng.randint(10000, 999999)), fontname='cour', fontsize=9)
+            page.insert_text((290, y), str(rng.randint(2015, 2025)), fontsize=10)
+            page.insert_text((350, y), str(rng.randint(1, 250)), fontsize=10)
+            page.insert_text((420, y), price_text, fontname='F0', fontsize=10)
+            prices.append({'page_number': page_number, 'bbox': (418, y - 12, 540, y + 4), 'text': price_text})
+        page.insert_text((290, 810), str(page_number + 1), fontsize=9)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return prices
+
+
+def _detection_scores(found, expected):
+    """Precision and recall of detected prices against the ground truth."""
+    truth = {}
+    for price in expected:
+        truth.setdefault(price['page_number'], []).append(price)
+    correct = 0
+    for hit in found:
+        x = (hit['bbox'][0] + hit['bbox'][2]) / 2
+        y = (hit['bbox'][1] + hit['bbox'][3]) / 2
+        correct += any(
+            price['bbox'][0] <= x <= price['bbox'][2] and price['bbox'][1] <= y <= price['bbox'][3] and
+            hit['raw_text'] == price['text']
+            for price in truth.get(hit['page_number'], [])
+        )
+    return {
+        'precision': round(correct / len(found), 4) if found else 0.0,
+        'recall': round(correct / len(expected), 4) if expected else 0.0,
+    }
+
+
+def parse_importtime(stderr):
+    """
+    Parses the report of python -X importtime.
+
+    Returns:
+        dict: module -> (self, cumulative) import time in seconds, for every module imported.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        imports.setdefault(module.strip(), (int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return imports
+
+
+def _run_startup_case(case, pdf_path):
+    import subprocess
+
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PDF_WORKER_PROCESSES=os.environ.get('PDF_WORKER_PROCESSES') or '2')
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'pdf_price_editor.settings')
+    env['PDF_WARM_UP'] = '1' if case == 'cold_start_warmed' else '0'
+    script = STARTUP_SCRIPT.format(warm=case == 'cold_start_warmed', pdf_path=os.path.abspath(pdf_path))
+    env['PYTHONPROFILEIMPORTTIME'] = '1' # Like -X importtime, which spawned workers would inherit
+    process = subprocess.run([sys.executable, '-c', script], cwd=project_dir, env=env,
+                             capture_output=True, text=True, check=True)
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    if case == 'import_audit':
+        # Imports of the web process: Django, the URLconf and views, and the first request
+        imports = parse_importtime(process.stderr)
+        extra = {f'import_ms:{module}': round(imports.get(module, (0, 0))[1] * 1000, 1) for module in AUDITED_MODULES}
+        heaviest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:8]
+        extra['heaviest_self_ms'] = {module: round(self_seconds * 1000, 1) for module, (self_seconds, _) in heaviest}
+        return sum(self_seconds for self_seconds, _ in imports.values()), len(imports), extra
+    extra = {f'{phase}_ms': round(timings[phase] * 1000, 1) for phase in ('boot', 'warm_up', 'second')}
+    return timings['first'], 1, extra
+
+
+def _text_similarity(expected, actual):
+    import difflib
+    return difflib.SequenceMatcher(None, " ".join(expected.split()), " ".join((actual or "").split())).ratio()
+
+
+def _peak_rss_kb():
+    # On Linux ru_maxrss survives the fork+exec that starts the child, so it would
+    # include the parent's peak; VmHWM belongs to the child's own address space.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _run_case(case, pdf_path, regions, workdir):
+    """Runs one benchmark case; returns (seconds, units of work done, extra metrics)."""
+    from . import utils
+
+    extra = {}
+    if case in STARTUP_CASES:
+        return _run_startup_case(case, pdf_path)
+    if case in OCR_LANGUAGE_CASES:
+        # Every scanned line at one language setting: latency and accuracy (similarity to the ground truth)
+        from .languages import detect_language
+
+        samples_path = os.path.join(workdir, f'ocr_samples_{os.getpid()}.pdf')
+        samples = generate_ocr_samples(samples_path)
+        setting = OCR_LANGUAGE_CASES[case]
+        started = time.perf_counter()
+        scores = []
+        for language, lines in OCR_SAMPLES.items():
+            # 'auto' stands for the language detected from the document's text at extraction
+            used = (detect_language("\n".join(lines)) or 'eng') if setting == 'auto' else setting
+            for region in (r for r in samples if r['language'] == language):
+                text = utils.extract_text_from_region_ocr(samples_path, region['page_number'], *region['bbox'],
+                                                          language=used)
+                scores.append(_text_similarity(region['text'], text))
+        seconds = time.perf_counter() - started
+        os.remove(samples_path)
+        return seconds, len(scores), {'accuracy': round(sum(scores) / len(scores), 4)}
+
+    regions = [r for r in regions if r['page_number'] % SCANNED_PAGE_EVERY != SCANNED_PAGE_EVERY - 1]
+    sample = regions[:REPLACEMENTS_PER_BULK_RUN]
+    started = time.perf_counter()
+
+    if case == 'extract_text_from_pdf':
+        text = utils.extract_text_from_pdf(pdf_path)
+        with fitz.open(pdf_path) as doc:
+            units = doc.page_count if text is not None else 0
+    elif case == 'identify_prices_in_text':
+        text = utils.extract_text_from_pdf(pdf_path)
+        started = time.perf_counter() # Only time the detection
+        units = len(utils.identify_prices_in_text(text))
+    elif case == 'get_text_style_in_region':
+        for region in sample:
+            utils.get_text_style_in_region(pdf_path, region['page_number'], *region['bbox'])
+        units = len(sample)
+    elif case == 'extract_text_from_region_ocr':
+        for region in sample:
+            utils.extract_text_from_region_ocr(pdf_path, region['page_number'], *region['bbox'])
+        units = len(sample)
+    elif case in PRICE_DETECTION_CASES:
+        corpus_path = os.path.join(workdir, f'tables_{os.getpid()}.pdf')
+        with fitz.open(pdf_path) as doc:
+            expected = generate_table_corpus(corpus_path, doc.page_count, seed=doc.page_count)
+        started = time.perf_counter()
+        found = []
+        with fitz.open(corpus_path) as doc:
+            for page in doc:
+                spans = utils.page_spans(page)
+                if case == 'price_detection_layout':
+                    found.extend(utils.find_prices_in_spans(spans, page.number))
+                    continue
+                for span in spans: # Every pattern everywhere, as before layout analysis
+                    for start, end in utils.find_price_spans(span['text']):
+                        boxes = span['chars'][start:end]
+                        found.append({
+                            'page_number': page.number,
+                            'raw_text': span['text'][start:end].strip(),
+                            'bbox': (boxes[0][0], min(b[1] for b in boxes), boxes[-1][2], max(b[3] for b in boxes)),
+                        })
+        seconds = time.perf_counter() - started
+        os.remove(corpus_path)
+        return seconds, len(found), _detection_scores(found, expected)
+    elif case in OCR_PRICE_CASES:
+        scores = [
+            _text_similarity(region['text'], utils.extract_text_from_region_ocr(
+                pdf_path, region['page_number'], *region['bbox'], **OCR_PRICE_CASES[case]))
+            for region in sample
+        ]
+        units = len(sample)
+        extra['accuracy'] = round(sum(scores) / len(scores), 4)
+    elif case in ('load_document_bytes', 'load_document_mapped'):
+        # Open the document and read one page, the way the region endpoints do.
+        # Reading the file into bytes makes peak RSS grow with the file size;
+        # map_document() should keep it flat.
+        if case == 'load_document_bytes':
+            with open(pdf_path, 'rb') as f:
+                source = f.read()
+        else:
+            source = utils.map_document(pdf_path)
+        with utils.open_document(source) as doc:
+            doc[sample[0]['page_number']].get_text()
+        units = 1
+    elif case == 'reprice_formatted':
+        # Learn the catalog's price formats once, then reprice every price with Decimal math
+        from decimal import Decimal
+        from . import pricing
+
+        texts = [region['text'] for region in regions]
+        pricing.reprice(texts, Decimal('1.1'), pricing.learn_price_formats(texts))
+        units = len(texts)
+    elif case == 'evaluate_rule_set':
+        # A seasonal rule set over every price of the catalog, as reprice-preview runs it
+        from . import pricing, repricing
+
+        texts = [region['text'] for region in regions]
+        prices = [{'page_number': region['page_number'], 'raw_text': region['text'],
+                   'value': pricing.parse_price(region['text']), 'currency': utils.detect_currency(region['text'])}
+                  for region in regions]
+        rule_set = repricing.RuleSet.from_dict({
+            'multiplier': {'USD': 1.1, 'EUR': 1.05, '*': 1.08}, 'markup': {'UAH': 20}, 'min': 1,
+            'rounding': '99', 'overrides': [{'page_range': [0, 4], 'multiplier': 1.2}],
+        })
+        started = time.perf_counter() # Only time the evaluation
+        rule_set.evaluate(prices, pricing.learn_price_formats(texts))
+        units = len(prices)
+    elif case == 'preview_replacements':
+        # A reprice-diff dry run over every price: overflow checks for all, crops for the first 200
+        replacements = [{'page_number': region['page_number'], 'bbox': region['bbox'], 'new_text': '$1,234.99',
+                         'style_info': {'font': 'Helvetica', 'size': 11}} for region in regions]
+        utils.preview_replacements(pdf_path, replacements, max_crops=200)
+        units = len(replacements)
+    elif case in ('pipeline_cold', 'pipeline_rerun'):
+        # Extraction plus an edit plan; the rerun changes the rules, so only the
+        # edit plan is computed again (see pipeline.py)
+        from .pipeline import PDF_PIPELINE, ArtifactCache
+
+        cache = ArtifactCache()
+        targets = ['extraction', 'edit_plan']
+        if case == 'pipeline_rerun':
+            PDF_PIPELINE.run(pdf_path, {'rules': {'multiplier': 1.1}}, targets, cache)
+            started = time.perf_counter() # Only time the rerun
+        run = PDF_PIPELINE.run(pdf_path, {'rules': {'multiplier': 1.2}}, targets, cache)
+        units = len(run.results['extraction'])
+    elif case in ('replace_text_in_pdf_region', 'replace_text_in_pdf_region_bulk'):
+        targets = sample[:1] if case == 'replace_text_in_pdf_region' else sample
+        for i, region in enumerate(targets):
+            output = os.path.join(workdir, f'replaced_{os.getpid()}_{i}.pdf')
+            utils.replace_text_in_pdf_region(
+                pdf_path, region['page_number'], *region['bbox'], '$1.00',
+                'Helvetica', 11.0, '#000000', False, False, output,
+            )
+            os.remove(output)
+        units = len(targets)
+    else:
+        raise ValueError(f"Unknown benchmark case: {case}")
+
+    return time.perf_counter() - started, units, extra
+
+
+def _child(queue, case, pdf_path, regions, workdir):
+    try:
+        seconds, units, extra = _run_case(case, pdf_path, regions, workdir)
+        queue.put({'seconds': seconds, 'units': units, 'peak_rss_kb': _peak_rss_kb(), **extra})
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(case, pdf_path, regions, workdir):
+    """Runs a case in a fresh process so that peak RSS is attributable to it alone."""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, case, pdf_path, regions, workdir))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def tesseract_available():
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+BENCHMARK_CASES = [
+    'extract_text_from_pdf',
+    'identify_prices_in_text',
+    'get_text_style_in_region',
+    'extract_text_from_region_ocr',
+    'replace_text_in_pdf_region',
+    'replace_text_in_pdf_region_bulk',
+    'load_document_bytes',
+    'load_document_mapped',
+    'reprice_formatted',
+    'evaluate_rule_set',
+    'preview_replacements',
+    'pipeline_cold',
+    'pipeline_rerun',
+    *OCR_LANGUAGE_CASES,
+    *OCR_PRICE_CASES,
+    *PRICE_DETECTION_CASES,
+    *STARTUP_CASES,
+]
+
+
+RUN_KEYS = ('seconds', 'units', 'peak_rss_kb')
+QUALITY_METRICS = ('accuracy', 'precision', 'recall') # Reported by some cases besides time and memory
+OCR_CASES = {'extract_text_from_region_ocr', *OCR_LANGUAGE_CASES, *OCR_PRICE_CASES} # Skipped without tesseract
+
+
+def run_benchmarks(sizes, workdir, repeat=3, cases=None, log=print):
+    """
+    Generates one catalog per size and times every case on it.
+
+    Returns:
+        dict: {'environment': {...}, 'results': {'<case>@<pages>': {...}}} where each
+              result has median_seconds, throughput (units/s), units and peak_rss_kb.
+    """
+    cases = cases or BENCHMARK_CASES
+    has_tesseract = tesseract_available()
+    results = {}
+    for size in sizes:
+        pdf_path = os.path.join(workdir, f'catalog_{size}.pdf')
+        regions = generate_catalog(pdf_path, size, seed=size)
+        log(f"Generated {size}-page catalog ({os.path.getsize(pdf_path) // 1024} KiB)")
+
+        for case in cases:
+            key = f'{case}@{size}'
+            if case in OCR_CASES and not has_tesseract:
+                results[key] = {'skipped': 'tesseract not installed'}
+                log(f"  {key}: skipped (tesseract not installed)")
+                continue
+
+            runs = [run_isolated(case, pdf_path, regions, workdir) for _ in range(repeat)]
+            errors = [run['error'] for run in runs if 'error' in run]
+            if errors:
+                results[key] = {'error': errors[0]}
+                log(f"  {key}: error {errors[0]}")
+                continue
+
+            median = statistics.median(run['seconds'] for run in runs)
+            units = runs[0]['units']
+            results[key] = {
+                'median_seconds': round(median, 4),
+                'units': units,
+                'throughput': round(units / median, 2) if median > 0 else None,
+                'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+            }
+            quality = [metric for metric in QUALITY_METRICS if metric in runs[0]]
+            for metric in quality:
+                results[key][metric] = round(statistics.median(run[metric] for run in runs), 4)
+            details = [metric for metric in runs[0] if metric not in RUN_KEYS + QUALITY_METRICS]
+            for metric in details:
+                values = [run[metric] for run in runs]
+                results[key][metric] = statistics.median(values) if isinstance(values[0], (int, float)) else values[0]
+            log(f"  {key}: {median * 1000:.1f} ms, {results[key]['throughput']} units/s, "
+                f"peak RSS {results[key]['peak_rss_kb'] // 1024} MiB"
+                + "".join(f", {metric} {results[key][metric]:.1%}" for metric in quality)
+                + "".join(f", {metric} {results[key][metric]}" for metric in details))
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """
+    Returns a list of human-readable regressions: cases whose median time or peak
+    RSS grew by more than tolerance (a fraction, e.g. 0.2 for 20%) over the baseline.
+    """
+    regressions = []
+    for key, current in report['results'].items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous or 'median_seconds' not in previous or 'median_seconds' not in current:
+            continue
+        for metric in ('median_seconds', 'peak_rss_kb'):
+            before, after = previous[metric], current[metric]
+            if before and after > before * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,370 @@
+"""
+Long-running PDF worker daemon: `python manage.py run_pdf_workers`.
+
+The pool in workers.py is started by the first request of each web process.
+Cold requests after a deploy or a worker recycle therefore pay for Django
+setup, for importing PyMuPDF, Pillow and pytesseract, and for Tesseract's
+first model load. The daemon starts its worker processes once, up front, and
+warms each of them before it takes jobs (see warm_up()):
+
+* the heavy modules are imported;
+* MuPDF extracts and renders a page;
+* Tesseract runs once per configured language (settings.PDF_OCR_LANGUAGES,
+  which follows UserProfile.preferred_language), so missing traineddata
+  files show up in the log at startup rather than on a user's request.
+
+Web processes use the daemon when settings.PDF_WORKER_DAEMON_ADDRESS is set
+(a Unix socket path or host:port). workers.run_in_worker() then sends each
+call over a multiprocessing connection authenticated with
+PDF_WORKER_DAEMON_AUTHKEY. The daemon's main process does not unpickle the
+calls. It keeps them in a backlog and hands each one to an idle worker over
+that worker's own multiprocessing queue, so it always knows which worker holds
+which job, and routes each result, which comes back over the worker's own pipe,
+to its connection. A worker that dies
+is replaced, and the call it held fails with BrokenProcessPool, as it would
+with the in-process pool, even if it died before it started on the call.
+Callers also give up with BrokenProcessPool after
+settings.PDF_WORKER_DAEMON_TIMEOUT seconds without an answer.
+
+Each worker's startup time (spawn to warm) and first-job latency are logged
+and reported by `run_pdf_workers --stats`.
+"""
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from multiprocessing.connection import Client, Listener, wait
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import threading
+import time
+
+from .workers import WorkerPoolBusy
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """'host:port' -> (host, port); anything else is a Unix socket path."""
+    if not address.startswith('/') and ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def daemon_authkey():
+    key = settings.PDF_WORKER_DAEMON_AUTHKEY or \
+        hashlib.sha256(f"pdf-workers:{settings.SECRET_KEY}".encode()).hexdigest()
+    return key.encode()
+
+
+def warm_languages():
+    """Tesseract languages to warm: those of PDF_OCR_LANGUAGES."""
+    return sorted(set(settings.PDF_OCR_LANGUAGES.values()))
+
+
+def warm_up(languages):
+    """
+    Imports and exercises the heavy libraries in this process.
+
+    Returns:
+        dict: import_seconds, mupdf_seconds and languages (see utils.warm_up_ocr()).
+    """
+    started = time.perf_counter()
+    # utils.py and preprocessing.py load these on first use (see lazy.py)
+    import fitz
+    from PIL import Image, ImageChops, ImageFilter # noqa: F401
+    import pytesseract # noqa: F401
+    from . import pipeline, pricing, repricing, utils # noqa: F401 (imported to be warm)
+    imported = time.perf_counter()
+
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((50, 60), "Warm-up $1.00", fontsize=10)
+    utils.find_prices_on_page(page)
+    page.get_pixmap(matrix=fitz.Matrix(2, 2))
+    doc.close()
+    rendered = time.perf_counter()
+
+    return {
+        'import_seconds': round(imported - started, 4),
+        'mupdf_seconds': round(rendered - imported, 4),
+        'languages': utils.warm_up_ocr(languages),
+    }
+
+
+def _worker_main(jobs, results, languages):
+    # Runs in each spawned worker process
+    started = time.perf_counter()
+    from . import workers
+    workers._worker_process = True
+    import django
+    django.setup()
+    from .workers import _timed_call
+
+    warm = warm_up(languages)
+    pid = os.getpid()
+    results.send(('ready', pid, None, {'startup_seconds': round(time.perf_counter() - started, 4), **warm}))
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, payload, enqueued = job
+        results.send(('started', pid, job_id, time.time() - enqueued))
+        try:
+            func, args, kwargs = pickle.loads(payload)
+            reply = ('ok', _timed_call(func, args, kwargs))
+        except BaseException as e:
+            reply = ('error', e)
+        try:
+            data = pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = pickle.dumps(('error', RuntimeError(f"Unpicklable result: {e!r}")))
+        results.send(('done', pid, job_id, data))
+
+
+class WorkerDaemon:
+    """The daemon's main process: the listener, the job backlog and the worker processes."""
+
+    def __init__(self, address, authkey, processes, languages):
+        self.address = parse_address(address)
+        self.processes = processes
+        self.languages = list(languages)
+        self.started = time.time()
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._processes = {} # pid -> Process
+        self._queues = {} # pid -> the worker's job queue
+        # Results come over a pipe per worker: a worker dying halfway through a
+        # write to a shared queue would leave the queue's lock held for good
+        self._results = {} # the result pipe's reading end -> pid
+        self._workers = {} # pid -> startup and job statistics
+        self._backlog = deque() # (job id, payload, enqueued) not handed to a worker yet
+        self._idle = deque() # pids of ready workers without a job
+        self._running = {} # pid -> (job id, started): the job each busy worker holds
+        self._pending = {} # job id -> client connection
+        self._closed = threading.Event()
+
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address) # Left behind by a daemon that did not shut down cleanly
+        self._listener = Listener(self.address, authkey=authkey)
+        for _ in range(processes):
+            self._spawn()
+
+    def _spawn(self):
+        jobs = self._context.Queue()
+        results, worker_end = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker_main, args=(jobs, worker_end, self.languages),
+                                        name='pdf-worker', daemon=True)
+        process.start()
+        worker_end.close() # The worker's copy is the only one, so its exit shows as EOF
+        with self._lock:
+            self._processes[process.pid] = process
+            self._queues[process.pid] = jobs
+            self._results[results] = process.pid
+            self._workers[process.pid] = {
+                'pid': process.pid, 'spawned': time.time(), 'ready': False, 'jobs': 0,
+                'first_job_wait_seconds': None, 'first_job_seconds': None,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'address': self.address,
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'pending': len(self._pending),
+                'queued': len(self._backlog),
+                'running': len(self._running),
+                'workers': [dict(worker) for worker in self._workers.values()],
+            }
+
+    def _reply(self, connection, data):
+        try:
+            connection.send_bytes(data)
+        except OSError:
+            pass # The client went away
+        finally:
+            connection.close()
+
+    def _dispatch(self):
+        # Hands backlog jobs to idle workers; the caller holds self._lock
+        while self._backlog and self._idle:
+            pid = self._idle.popleft()
+            if pid not in self._processes:
+                continue # Reaped
+            job = self._backlog.popleft()
+            self._running[pid] = (job[0], time.perf_counter())
+            self._queues[pid].put(job)
+
+    def _reap(self):
+        # Replaces dead workers and fails the job each of them was running
+        failed = []
+        with self._lock:
+            for pid, process in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+                del self._processes[pid]
+                self._queues.pop(pid).close()
+                self._workers.pop(pid, None)
+                if pid in self._idle:
+                    self._idle.remove(pid)
+                job_id, _ = self._running.pop(pid, (None, None))
+                connection = self._pending.pop(job_id, None)
+                logger.error("PDF worker %s exited with code %s%s", pid, process.exitcode,
+                             f" while running job {job_id}" if job_id else "")
+                if connection is not None:
+                    failed.append(connection)
+        error = pickle.dumps(('error', BrokenProcessPool("The PDF worker running this call died.")))
+        for connection in failed:
+            self._reply(connection, error)
+        if not self._closed.is_set():
+            for _ in range(self.processes - len(self._processes)):
+                self._spawn()
+
+    def _collect(self):
+        reaped = time.monotonic()
+        while not self._closed.is_set():
+            if time.monotonic() - reaped >= 1.0:
+                self._reap()
+                reaped = time.monotonic()
+            with self._lock:
+                readers = list(self._results)
+            for reader in wait(readers, timeout=1.0):
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    # The worker exited; _reap() fails the job it held
+                    with self._lock:
+                        self._results.pop(reader, None)
+                    reader.close()
+                    continue
+                self._route(*message)
+
+    def _route(self, kind, pid, job_id, data):
+        connection = None
+        with self._lock:
+            worker = self._workers.get(pid)
+            if kind == 'ready' and worker is not None:
+                worker.update(ready=True, **data)
+                self._idle.append(pid)
+                self._dispatch()
+                logger.info("PDF worker %s ready in %.2fs (imports %.2fs, MuPDF %.2fs, languages %s)", pid,
+                            data['startup_seconds'], data['import_seconds'], data['mupdf_seconds'], data['languages'])
+            elif kind == 'started':
+                if pid in self._running:
+                    self._running[pid] = (job_id, time.perf_counter()) # From dispatch to the job itself
+                if worker is not None and worker['first_job_wait_seconds'] is None:
+                    worker['first_job_wait_seconds'] = round(data, 4)
+            elif kind == 'done':
+                _, began = self._running.pop(pid, (None, None))
+                connection = self._pending.pop(job_id, None)
+                if pid in self._processes:
+                    self._idle.append(pid)
+                    self._dispatch()
+                if worker is not None:
+                    worker['jobs'] += 1
+                    if worker['first_job_seconds'] is None and began is not None:
+                        worker['first_job_seconds'] = round(time.perf_counter() - began, 4)
+                        logger.info("PDF worker %s ran its first job in %.3fs after waiting %.3fs in the queue",
+                                    pid, worker['first_job_seconds'], worker['first_job_wait_seconds'] or 0.0)
+        if connection is not None:
+            self._reply(connection, data)
+
+    def _handle(self, connection):
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            connection.close()
+            return
+        if message[0] == 'stats':
+            connection.send(self.stats())
+            connection.close()
+            return
+        job_id = next(self._ids)
+        with self._lock:
+            self._pending[job_id] = connection
+            self._backlog.append((job_id, message[1], time.time()))
+            self._dispatch()
+
+    def serve_forever(self):
+        """Accepts calls until close()."""
+        threading.Thread(target=self._collect, name='pdf-worker-results', daemon=True).start()
+        while not self._closed.is_set():
+            try:
+                connection = self._listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                if not self._closed.is_set():
+                    logger.warning("Rejected a PDF worker daemon connection: %s", e)
+                continue
+            if self._closed.is_set():
+                connection.close()
+                break
+            threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            # Wakes accept(); a bare connection, so close() never waits on the handshake
+            family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+            with socket.socket(family) as wake:
+                wake.connect(self.address)
+        except OSError:
+            pass
+        self._listener.close()
+        with self._lock:
+            processes = list(self._processes.values())
+            for jobs in self._queues.values():
+                jobs.put(None)
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+
+def _connect(address):
+    try:
+        return Client(parse_address(address or settings.PDF_WORKER_DAEMON_ADDRESS), authkey=daemon_authkey())
+    except (OSError, EOFError) as e:
+        logger.error("PDF worker daemon at %s is unreachable: %s", address or settings.PDF_WORKER_DAEMON_ADDRESS, e)
+        raise WorkerPoolBusy() from e
+
+
+def submit(func, args, kwargs, address=None):
+    """
+    Runs func(*args, **kwargs) in the daemon and blocks until it is done.
+
+    Returns:
+        tuple: (result, phase timings), like workers._timed_call().
+
+    Raises:
+        WorkerPoolBusy: If the daemon is unreachable.
+        BrokenProcessPool: If the worker died running the call, or no answer came
+                           within settings.PDF_WORKER_DAEMON_TIMEOUT seconds.
+    """
+    payload = pickle.dumps((func, args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+    with _connect(address) as connection:
+        connection.send(('call', payload))
+        try:
+            if not connection.poll(settings.PDF_WORKER_DAEMON_TIMEOUT):
+                raise BrokenProcessPool(
+                    f"The PDF worker daemon did not answer within {settings.PDF_WORKER_DAEMON_TIMEOUT} seconds.")
+            status, value = pickle.loads(connection.recv_bytes())
+        except EOFError:
+            raise BrokenProcessPool("The PDF worker daemon closed the connection.")
+    if status == 'error':
+        raise value
+    return value
+
+
+def daemon_stats(address=None):
+    with _connect(address) as connection:
+        connection.send(('stats',))
+        return connection.recv()
@@ -0,0 +1,157 @@
+"""
+Lightweight timing instrumentation for the PDF processing code.
+
+utils.py wraps each expensive phase (opening the document, applying
+redactions, inserting text, saving, OCR, ...) in `timed("<phase>")`. The
+durations are collected per request through a context variable, which
+ServerTimingMiddleware turns into a Server-Timing header, and they are also
+aggregated into process-wide latency histograms that metrics_view exposes in
+the Prometheus text format, next to a few gauges and counters (e.g. the
+admission queue depth, see admission.py).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import threading
+import time
+
+
+# Upper bounds (seconds) of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_timings = ContextVar('pdf_processing_timings', default=None)
+
+
+class Histogram:
+    """A cumulative-bucket latency histogram, as defined by the Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide histograms, gauges and counters keyed by metric name and label values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._values = {} # (name, labels) -> (type, value) for gauges and counters
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def set_gauge(self, name, labels, value):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = ('gauge', value)
+
+    def increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = ('counter', self._values.get(key, ('counter', 0))[1] + amount)
+
+    def value(self, name, labels):
+        """Current value of a gauge or counter, or None."""
+        entry = self._values.get((name, tuple(sorted(labels.items()))))
+        return entry[1] if entry else None
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            seen_names = set()
+            for (name, labels), (kind, current) in sorted(self._values.items()):
+                if name not in seen_names:
+                    lines.append(f"# TYPE {name} {kind}")
+                    seen_names.add(name)
+                label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+                lines.append(f"{name}{{{label_text}}} {current}" if label_text else f"{name} {current}")
+            items = sorted(self._histograms.items())
+            for (name, labels), histogram in items:
+                if name not in seen_names:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen_names.add(name)
+                label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    sep = ',' if label_text else ''
+                    lines.append(f'{name}_bucket{{{label_text}{sep}le="{le}"}} {cumulative}')
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}_sum{suffix} {histogram.total}")
+                lines.append(f"{name}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class RequestTimings:
+    """Accumulated phase durations (seconds) for one request, in first-seen order."""
+
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+def start_request(endpoint=None):
+    """Starts collecting phase timings for the current request; returns (timings, reset token)."""
+    timings = RequestTimings(endpoint)
+    return timings, _current_timings.set(timings)
+
+
+def end_request(token):
+    _current_timings.reset(token)
+
+
+def current_timings():
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Times the enclosed block as `phase`. The duration is added to the current
+    request's timings (if any) and to the pdf_phase_duration_seconds histogram.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - started)
+
+
+def record_phase(phase, seconds):
+    """Adds a phase duration measured elsewhere (e.g. in a worker process) to the current request."""
+    timings = _current_timings.get()
+    endpoint = timings.endpoint if timings is not None else None
+    if timings is not None:
+        timings.add(phase, seconds)
+    registry.observe('pdf_phase_duration_seconds', {'phase': phase, 'endpoint': endpoint or 'none'}, seconds)
+
+
+def server_timing_header(timings, total_seconds):
+    """Formats request timings as a Server-Timing header value (durations in ms)."""
+    entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.phases.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,74 @@
+"""
+Document language detection for OCR.
+
+Tesseract reads a region best with the model of the language it is written
+in, and every extra language in a combined setting such as "ukr+ita+eng" is
+one more model to load and search. detect_language() decides the main
+language of a document once, from the text layer at extraction (see
+PdfDocument.store_extraction), so OCR of its scanned parts can use that one
+model.
+
+Only the languages the site serves are told apart (settings.PDF_OCR_LANGUAGES):
+Cyrillic text is Ukrainian, and Latin text is Italian or English by its
+accented letters and its share of common and catalog words. Text that is too
+short or gives no clear signal is '' (unknown), and OCR falls back to the
+user's profile.
+
+Like utils.py, this module does not depend on Django.
+"""
+import re
+
+
+MIN_LETTERS = 40 # Letters needed before a document's language is decided
+CYRILLIC_SHARE = 0.3 # Share of Cyrillic letters that makes a document Ukrainian
+MIN_WORD_HITS = 3 # Marker words needed to tell Italian from English
+WORD = re.compile(r"[^\W\d_]+")
+
+MARKER_WORDS = {
+    'ita': {
+        'il', 'lo', 'la', 'gli', 'le', 'di', 'del', 'della', 'dei', 'delle', 'che', 'per', 'con', 'una', 'uno',
+        'sono', 'nel', 'nella', 'al', 'alla', 'prezzo', 'prezzi', 'sconto', 'iva', 'cad', 'pezzo', 'pezzi',
+        'articolo', 'codice', 'colore', 'misure', 'listino', 'euro', 'legno', 'tavolo', 'sedia',
+    },
+    'eng': {
+        'the', 'and', 'of', 'for', 'with', 'to', 'in', 'is', 'on', 'by', 'from', 'this', 'that', 'are',
+        'price', 'prices', 'each', 'item', 'items', 'code', 'color', 'colour', 'size', 'sale', 'vat',
+        'total', 'order', 'list', 'wood', 'table', 'chair',
+    },
+}
+ITALIAN_LETTERS = set('àèéìíòóù')
+
+
+def detect_language(text, candidates=('ukr', 'ita', 'eng')):
+    """
+    Detects the main language of a document's text.
+
+    Args:
+        text (str): The document's text layer.
+        candidates (Iterable[str]): Tesseract codes that may be returned.
+
+    Returns:
+        str: A Tesseract language code from candidates, or '' if unsure.
+    """
+    candidates = set(candidates)
+    letters = [c for c in text.lower() if c.isalpha()]
+    if len(letters) < MIN_LETTERS:
+        return ''
+
+    cyrillic = sum(1 for c in letters if 'Ѐ' <= c <= 'ӿ')
+    if cyrillic / len(letters) >= CYRILLIC_SHARE:
+        return 'ukr' if 'ukr' in candidates else ''
+
+    words = WORD.findall(text.lower())
+    scores = {
+        language: sum(1 for word in words if word in markers)
+        for language, markers in MARKER_WORDS.items() if language in candidates
+    }
+    if 'ita' in scores:
+        scores['ita'] += sum(1 for c in letters if c in ITALIAN_LETTERS)
+    if not scores:
+        return ''
+    best = max(scores, key=scores.get)
+    if scores[best] < MIN_WORD_HITS or list(scores.values()).count(scores[best]) > 1:
+        return ''
+    return best
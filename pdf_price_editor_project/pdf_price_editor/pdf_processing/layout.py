@@ -0,0 +1,166 @@
+"""
+Table layout of catalog pages: rows, columns and which columns hold prices.
+
+Catalog prices nearly always sit in a table column, next to columns of names,
+SKUs, quantities or years that are numbers too. analyze_layout() works on the
+span index of a page (utils.page_spans()):
+
+* Rows: spans whose vertical centers are within half a line of each other.
+* Columns: only spans of rows with at least two cells take part, so titles
+  and paragraphs do not join columns. Their horizontal extents are merged
+  wherever they overlap (left-, right- and center-aligned cells alike), and
+  every band with cells in at least MIN_COLUMN_CELLS rows is a column.
+* Price columns: most of the cells are a single price (pricing.tokenize_price()).
+  In addition, the cells carry a currency symbol or decimals, or the column's
+  header names a price (PRICE_HEADER_WORDS). Columns of bare integers, such as
+  SKUs, years and quantities, are not price columns.
+
+Prices are then detected per span as before, but bare integers (no currency,
+no decimals) only count inside price columns (see utils.find_prices_in_spans()).
+Each price also records its price column, so a column can be repriced as one
+group with one shared style (column_styles(), repricing.RuleSet overrides).
+
+Like utils.py, this module does not depend on Django.
+"""
+from collections import Counter
+import re
+
+from .pricing import tokenize_price
+
+
+MIN_COLUMN_CELLS = 3 # Rows a column needs
+MAX_HEADER_CELLS = 2 # Cells at the top of a column that may form its header
+COLUMN_GAP = 2.0 # Points of white space that separate two columns
+PRICE_CELL_SHARE = 0.6 # Share of a column's cells (below its header) that must be prices
+TYPED_PRICE_SHARE = 0.5 # Share of those that must carry a currency symbol or decimals, without a price header
+PRICE_HEADER_WORDS = {
+    'price', 'prices', 'cost', 'amount', 'total', 'sale', 'rrp', 'msrp', 'eur', 'usd', 'uah', 'gbp',
+    'prezzo', 'prezzi', 'importo', 'costo', 'totale', 'offerta',
+    'ціна', 'ціни', 'вартість', 'сума', 'акція', 'грн', 'цена', 'стоимость',
+    '$', '€', '£', '₴',
+}
+STYLE_KEYS = ('font', 'size', 'color', 'bold', 'italic')
+HEADER_WORD = re.compile(r"[^\W\d_]+|[$€£₴]")
+DECIMALS = re.compile(r"[.,]\d{1,2}$")
+
+
+def span_bbox(span):
+    """The bounding box of a span's non-space characters, or None if it has none."""
+    boxes = [box for c, box in zip(span['text'], span['chars']) if not c.isspace()]
+    if not boxes:
+        return None
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+def _rows(cells):
+    # cells: (span index, bbox); sorted top to bottom into lists of cells
+    rows = []
+    for cell in sorted(cells, key=lambda cell: (cell[1][1] + cell[1][3]) / 2):
+        center = (cell[1][1] + cell[1][3]) / 2
+        height = cell[1][3] - cell[1][1]
+        if rows:
+            row = rows[-1]
+            row_center = sum((c[1][1] + c[1][3]) / 2 for c in row) / len(row)
+            if abs(center - row_center) <= max(height, row[0][1][3] - row[0][1][1]) / 2:
+                row.append(cell)
+                continue
+        rows.append([cell])
+    return rows
+
+
+def _is_price_header(text):
+    return any(word in PRICE_HEADER_WORDS for word in HEADER_WORD.findall(text.lower()))
+
+
+def _classify(column, texts):
+    # The cells above the first price-like cell are the header if there are at
+    # most MAX_HEADER_CELLS of them; otherwise the top cell is
+    tokens = [tokenize_price(texts[index]) for index in column['spans']]
+    first = next((i for i, token in enumerate(tokens[:MAX_HEADER_CELLS + 1]) if token is not None), 1)
+    header = " ".join(texts[index].strip() for index in column['spans'][:first])
+    body = tokens[first:]
+    prices = [token for token in body if token is not None]
+    if len(prices) < MIN_COLUMN_CELLS or len(prices) < PRICE_CELL_SHARE * len(body):
+        return header, False
+    typed = sum(1 for token in prices if token['symbol'] or DECIMALS.search(token['number']))
+    return header, typed >= TYPED_PRICE_SHARE * len(prices) or _is_price_header(header)
+
+
+def analyze_layout(spans):
+    """
+    Finds the table rows and columns of a page and classifies its price columns.
+
+    Args:
+        spans (list[dict]): The page's span index (utils.page_spans()).
+
+    Returns:
+        dict: rows (lists of span indexes, top to bottom) and columns, left to
+              right, each with bbox, spans (top to bottom), header, price (bool)
+              and, for price columns, price_column (their index among the
+              page's price columns, left to right).
+    """
+    cells = [(index, bbox) for index, bbox in ((i, span_bbox(span)) for i, span in enumerate(spans)) if bbox]
+    rows = _rows(cells)
+    row_of = {index: row_number for row_number, row in enumerate(rows) for index, _ in row}
+
+    # Horizontal bands of the cells of table rows
+    bands = []
+    for index, bbox in sorted((cell for row in rows if len(row) > 1 for cell in row), key=lambda cell: cell[1][0]):
+        if bands and bbox[0] <= bands[-1]['x1'] + COLUMN_GAP:
+            band = bands[-1]
+            band['x1'] = max(band['x1'], bbox[2])
+        else:
+            band = {'x0': bbox[0], 'x1': bbox[2], 'cells': []}
+            bands.append(band)
+        band['cells'].append((index, bbox))
+
+    texts = [span['text'] for span in spans]
+    columns = []
+    for band in bands:
+        if len({row_of[index] for index, _ in band['cells']}) < MIN_COLUMN_CELLS:
+            continue
+        ordered = sorted(band['cells'], key=lambda cell: (cell[1][1], cell[1][0]))
+        column = {
+            'bbox': (band['x0'], min(bbox[1] for _, bbox in ordered),
+                     band['x1'], max(bbox[3] for _, bbox in ordered)),
+            'spans': [index for index, _ in ordered],
+        }
+        column['header'], column['price'] = _classify(column, texts)
+        columns.append(column)
+
+    price_columns = [column for column in columns if column['price']]
+    for number, column in enumerate(price_columns):
+        column['price_column'] = number
+    return {'rows': [[index for index, _ in row] for row in rows], 'columns': columns}
+
+
+def price_column_of_spans(layout):
+    """Span index -> price column number, for the spans in the layout's price columns."""
+    return {
+        index: column['price_column']
+        for column in layout['columns'] if column['price']
+        for index in column['spans']
+    }
+
+
+def column_styles(prices):
+    """
+    The shared style of each price column: the most common style among its prices.
+
+    Args:
+        prices (list[dict]): page_number, column and the STYLE_KEYS of each price.
+
+    Returns:
+        dict: (page_number, column) -> style dict, for prices with a column.
+    """
+    counts = {}
+    for price in prices:
+        if price.get('column') is None:
+            continue
+        style = tuple(price[key] for key in STYLE_KEYS)
+        counts.setdefault((price['page_number'], price['column']), Counter())[style] += 1
+    return {
+        key: dict(zip(STYLE_KEYS, counter.most_common(1)[0][0]))
+        for key, counter in counts.items()
+    }
@@ -0,0 +1,54 @@
+"""
+Lazily loaded modules.
+
+PyMuPDF, Pillow and pytesseract take over 100 ms to import, most of it in
+MuPDF's bindings. utils.py and preprocessing.py are imported by the views to
+reference the functions they hand to the worker pool, and by the pipeline,
+batches and benchmarks, but the libraries are only needed where a PDF is
+actually opened. That is usually a worker process, and never a management
+command or the users app.
+
+    fitz = lazy_import('fitz')
+
+binds a stand-in that imports the module on first attribute access, so
+`fitz.open(...)` works as usual and the import cost moves to the first call.
+workers.warm_up() pays it at boot instead.
+"""
+import importlib
+import importlib.util
+import threading
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access (thread-safe)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Returns a LazyModule for name.
+
+    Raises:
+        ImportError: If the module is not installed (checked without loading it).
+    """
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    return LazyModule(name)
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import os
+import tempfile
+
+from pdf_processing.benchmarks import (
+    BENCHMARK_CASES, compare_to_baseline, load_report, run_benchmarks, save_report,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the pdf_processing utilities on synthetic catalogs and compares "
+        "the results with a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                            help='Catalog sizes in pages (default: 10 100 1000).')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per case; the median is reported (default: 3).')
+        parser.add_argument('--cases', nargs='+', choices=BENCHMARK_CASES,
+                            help='Only run these cases.')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+                            help='Baseline JSON file to compare against or to save.')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store this run as the new baseline instead of comparing.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed slowdown/RSS growth before a case is flagged (default: 0.2 = 20%%).')
+        parser.add_argument('--output', help='Also write this run\'s report to this JSON file.')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if any case regressed.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='pdf_benchmark_') as workdir:
+            report = run_benchmarks(
+                options['sizes'], workdir, repeat=options['repeat'],
+                cases=options['cases'], log=self.stdout.write,
+            )
+
+        if options['output']:
+            save_report(report, options['output'])
+
+        if options['save_baseline']:
+            save_report(report, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING(
+                f"No baseline at {options['baseline']}; run with --save-baseline to create one."
+            ))
+            return
+
+        regressions = compare_to_baseline(report, load_report(options['baseline']), options['tolerance'])
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+            return
+
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(f"Regression: {regression}"))
+        if options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} benchmark regression(s) found.")
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pdf_processing.pipeline import default_cache
+from pdf_processing.storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes superseded revisions of modified PDFs beyond the newest N per document "
+        "and files under MEDIA_ROOT that no document references, and trims the pipeline's artifact "
+        "cache to PDF_PIPELINE_CACHE_MAX_BYTES. Meant to run from cron, "
+        "e.g. nightly: python manage.py collect_media_garbage"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=settings.PDF_KEEP_REVISIONS,
+                            help=f'Revisions to keep per document (default: {settings.PDF_KEEP_REVISIONS}).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Files checked against the database per query (default: 1000).')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Never delete files modified less than this many seconds ago (default: 3600).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        stats = collect_garbage(
+            keep=options['keep'], batch_size=options['batch_size'],
+            min_age=options['min_age'], dry_run=options['dry_run'],
+        )
+        verb = 'Would reclaim' if stats['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['bytes_reclaimed']} bytes: {stats['revisions_pruned']} superseded revision(s), "
+            f"{stats['orphans_deleted']} orphaned file(s) of {stats['files_scanned']} scanned."
+        ))
+        if not options['dry_run']:
+            default_cache().evict()
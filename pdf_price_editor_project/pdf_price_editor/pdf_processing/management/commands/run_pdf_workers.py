@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import signal
+
+from pdf_processing.daemon import WorkerDaemon, daemon_authkey, daemon_stats, warm_languages
+from pdf_processing.workers import WorkerPoolBusy, worker_count
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the long-running PDF worker daemon: worker processes that import PyMuPDF, Pillow and "
+        "pytesseract and warm the OCR languages at startup, then take jobs from a local queue. "
+        "Point the web processes at it with PDF_WORKER_DAEMON_ADDRESS, e.g. "
+        "PDF_WORKER_DAEMON_ADDRESS=/run/pdf_workers.sock python manage.py run_pdf_workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=settings.PDF_WORKER_DAEMON_ADDRESS,
+                            help='Unix socket path or host:port (default: PDF_WORKER_DAEMON_ADDRESS).')
+        parser.add_argument('--processes', type=int, default=0,
+                            help='Worker processes (default: PDF_WORKER_PROCESSES, or one per core).')
+        parser.add_argument('--languages', nargs='+', default=None,
+                            help='Tesseract languages to warm (default: those of PDF_OCR_LANGUAGES).')
+        parser.add_argument('--stats', action='store_true',
+                            help="Print the running daemon's worker startup and first-job timings and exit.")
+
+    def handle(self, *args, **options):
+        address = options['address']
+        if not address:
+            raise CommandError('Set PDF_WORKER_DAEMON_ADDRESS or pass --address.')
+
+        if options['stats']:
+            try:
+                self.stdout.write(json.dumps(daemon_stats(address), indent=2, default=str))
+            except WorkerPoolBusy:
+                raise CommandError(f'No PDF worker daemon is listening at {address}.')
+            return
+
+        processes = options['processes'] or worker_count()
+        languages = options['languages'] if options['languages'] is not None else warm_languages()
+        daemon = WorkerDaemon(address, daemon_authkey(), processes, languages)
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.close())
+        self.stdout.write(f"PDF worker daemon listening at {address} with {processes} process(es), "
+                          f"warming languages: {', '.join(languages) or 'none'}")
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.close()
+        self.stdout.write(self.style.SUCCESS('PDF worker daemon stopped.'))
@@ -0,0 +1,110 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.urls import resolve, Resolver404
+import time
+
+from .instrumentation import end_request, registry, server_timing_header, start_request
+from .profiling import request_profiling, reset_profiling
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the phase timings recorded by utils.py during a request, reports
+    them in a Server-Timing response header and feeds the per-endpoint latency
+    histogram (pdf_request_duration_seconds). Works in sync and async stacks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _endpoint(self, request):
+        try:
+            return resolve(request.path_info).url_name or 'unnamed'
+        except Resolver404:
+            return 'not_found'
+
+    def _finish(self, response, timings, endpoint, started):
+        elapsed = time.perf_counter() - started
+        response['Server-Timing'] = server_timing_header(timings, elapsed)
+        registry.observe('pdf_request_duration_seconds', {'endpoint': endpoint}, elapsed)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        endpoint = self._endpoint(request)
+        timings, token = start_request(endpoint)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self._finish(response, timings, endpoint, started)
+
+    async def __acall__(self, request):
+        endpoint = self._endpoint(request)
+        timings, token = start_request(endpoint)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self._finish(response, timings, endpoint, started)
+
+
+class ProfilingMiddleware:
+    """
+    Requests full cProfile capture of the PDF operations run by a request, when
+    a staff user sends the PDF_PROFILE_HEADER header with value 1, or when a
+    ProfilingSwitch is enabled for the user in the admin.
+    Must come after AuthenticationMiddleware. Profiled requests of the async
+    views run their PDF work in-process instead of in the worker pool, so that
+    it can be captured (see workers.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'PDF_PROFILE_HEADER', 'X-PDF-Profile')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _requested(self, request, user):
+        from .models import ProfilingSwitch
+
+        return (
+            user is not None and user.is_authenticated and
+            ((user.is_staff and request.headers.get(self.header) == '1') or ProfilingSwitch.is_enabled_for(user))
+        )
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._requested(request, getattr(request, 'user', None)):
+            return self.get_response(request)
+
+        token = request_profiling()
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_profiling(token)
+        response[self.header] = 'captured'
+        return response
+
+    async def __acall__(self, request):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        if not await sync_to_async(self._requested)(request, user):
+            return await self.get_response(request)
+
+        token = request_profiling()
+        try:
+            response = await self.get_response(request)
+        finally:
+            reset_profiling(token)
+        response[self.header] = 'captured'
+        return response
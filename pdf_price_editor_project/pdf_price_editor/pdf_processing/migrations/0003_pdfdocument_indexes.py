@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0002_pdfdocument_modified_file'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pdfdocument',
+            index=models.Index(fields=['id', 'user'], name='pdfdoc_id_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pdfdocument',
+            index=models.Index(fields=['user', 'status'], name='pdfdoc_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pdfdocument',
+            index=models.Index(fields=['user', '-upload_date'], name='pdfdoc_user_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0003_pdfdocument_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='prices_indexed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PriceOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('x0', models.FloatField()),
+                ('y0', models.FloatField()),
+                ('x1', models.FloatField()),
+                ('y1', models.FloatField()),
+                ('raw_text', models.CharField(max_length=64)),
+                ('value', models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True)),
+                ('currency', models.CharField(blank=True, max_length=3)),
+                ('font', models.CharField(blank=True, max_length=128)),
+                ('font_size', models.FloatField(default=0.0)),
+                ('color', models.CharField(default='#000000', max_length=7)),
+                ('bold', models.BooleanField(default=False)),
+                ('italic', models.BooleanField(default=False)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_occurrences', to='pdf_processing.pdfdocument')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['document', 'page_number'], name='priceocc_doc_page_idx'), models.Index(fields=['document', 'currency', 'value'], name='priceocc_doc_cur_value_idx'), models.Index(fields=['document', 'value'], name='priceocc_doc_value_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Full-text index over PdfPage.text. SQLite gets an external-content FTS5 table
+# kept in sync by triggers; PostgreSQL gets a GIN index on the tsvector that
+# search.py queries with the same expression. Other backends fall back to LIKE.
+SQLITE_FTS_SQL = [
+    """CREATE VIRTUAL TABLE pdf_processing_pdfpage_fts USING fts5(
+        text, content='pdf_processing_pdfpage', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER pdf_processing_pdfpage_fts_ai AFTER INSERT ON pdf_processing_pdfpage BEGIN
+        INSERT INTO pdf_processing_pdfpage_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER pdf_processing_pdfpage_fts_ad AFTER DELETE ON pdf_processing_pdfpage BEGIN
+        INSERT INTO pdf_processing_pdfpage_fts(pdf_processing_pdfpage_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER pdf_processing_pdfpage_fts_au AFTER UPDATE ON pdf_processing_pdfpage BEGIN
+        INSERT INTO pdf_processing_pdfpage_fts(pdf_processing_pdfpage_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO pdf_processing_pdfpage_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+SQLITE_FTS_REVERSE_SQL = [
+    'DROP TRIGGER IF EXISTS pdf_processing_pdfpage_fts_au',
+    'DROP TRIGGER IF EXISTS pdf_processing_pdfpage_fts_ad',
+    'DROP TRIGGER IF EXISTS pdf_processing_pdfpage_fts_ai',
+    'DROP TABLE IF EXISTS pdf_processing_pdfpage_fts',
+]
+POSTGRES_FTS_SQL = [
+    "CREATE INDEX pdfpage_text_fts_idx ON pdf_processing_pdfpage USING GIN (to_tsvector('simple', text))",
+]
+POSTGRES_FTS_REVERSE_SQL = [
+    'DROP INDEX IF EXISTS pdfpage_text_fts_idx',
+]
+
+
+def _run_for_vendor(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+create_fulltext_index = _run_for_vendor({'sqlite': SQLITE_FTS_SQL, 'postgresql': POSTGRES_FTS_SQL})
+drop_fulltext_index = _run_for_vendor({'sqlite': SQLITE_FTS_REVERSE_SQL, 'postgresql': POSTGRES_FTS_REVERSE_SQL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0004_priceoccurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='pdf_processing.pdfdocument')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('document', 'page_number'), name='pdfpage_doc_page_unique')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:28
+
+from django.db import migrations, models
+
+
+def reinstall_fulltext_index(apps, schema_editor):
+    # Adding the column rebuilds the table on SQLite, which drops the FTS triggers
+    from pdf_processing.search import install_sqlite_fulltext_index
+    install_sqlite_fulltext_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0005_pdfpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfpage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(reinstall_fulltext_index, migrations.RunPython.noop),
+    ]
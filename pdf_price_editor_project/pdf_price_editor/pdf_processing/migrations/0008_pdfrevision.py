@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0007_profilingswitch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('size_bytes', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('save_profile', models.CharField(blank=True, max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pdfdocument',
+            index=models.Index(fields=['uploaded_file'], name='pdfdoc_uploaded_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pdfdocument',
+            index=models.Index(fields=['modified_file'], name='pdfdoc_modified_file_idx'),
+        ),
+        migrations.AddField(
+            model_name='pdfrevision',
+            name='document',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='pdf_processing.pdfdocument'),
+        ),
+        migrations.AddIndex(
+            model_name='pdfrevision',
+            index=models.Index(fields=['document', '-created'], name='pdfrev_doc_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pdfrevision',
+            index=models.Index(fields=['file'], name='pdfrev_file_idx'),
+        ),
+    ]
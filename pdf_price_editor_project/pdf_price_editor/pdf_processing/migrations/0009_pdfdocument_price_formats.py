@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0008_pdfrevision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='price_formats',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0009_pdfdocument_price_formats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed')], default='queued', max_length=20)),
+                ('rules', models.JSONField(blank=True, null=True)),
+                ('optimize', models.BooleanField(default=False)),
+                ('save_profile', models.CharField(blank=True, max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PdfBatchItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(choices=[('queued', 'Queued'), ('extract', 'Extract'), ('identify', 'Identify'), ('reprice', 'Reprice'), ('optimize', 'Optimize'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('prices_found', models.PositiveIntegerField(blank=True, null=True)),
+                ('prices_changed', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='pdf_processing.pdfbatch')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_items', to='pdf_processing.pdfdocument')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pdfbatch',
+            index=models.Index(fields=['user', '-created'], name='pdfbatch_user_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pdfbatchitem',
+            constraint=models.UniqueConstraint(fields=('batch', 'document'), name='pdfbatchitem_batch_doc_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0010_pdfbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='language',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0011_pdfdocument_language'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='priceoccurrence',
+            name='column',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
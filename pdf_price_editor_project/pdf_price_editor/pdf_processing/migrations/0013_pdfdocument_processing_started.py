@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0012_priceoccurrence_column'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfdocument',
+            name='processing_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0013_pdfdocument_processing_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfbatch',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pdfbatch',
+            name='runner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
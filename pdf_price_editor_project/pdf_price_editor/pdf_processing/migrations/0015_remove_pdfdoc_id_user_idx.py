@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_processing', '0014_pdfbatch_runner_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pdfdocument',
+            name='pdfdoc_id_user_idx',
+        ),
+    ]
@@ -1,7 +1,20 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+import logging
 import os
 
+from .languages import detect_language
+from .layout import column_styles
+from .pricing import PriceFormat, learn_price_formats, parse_price, tokenize_price
+
+logger = logging.getLogger(__name__)
+
 def user_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/user_<id>/pdfs/<filename>
     # Ensure filename is just the base name to prevent path traversal issues
@@ -27,6 +40,21 @@ class PdfDocument(models.Model):
     )
     extracted_text = models.TextField(blank=True, null=True)
     modified_file = models.FileField(upload_to=user_directory_path, blank=True, null=True) # Field for modified PDF
+    prices_indexed_at = models.DateTimeField(blank=True, null=True) # When PriceOccurrence rows were last rebuilt
+    price_formats = models.JSONField(default=dict, blank=True) # Currency symbol -> PriceFormat.to_dict(), see pricing.py
+    language = models.CharField(max_length=16, blank=True) # Tesseract code detected at extraction, see languages.py
+    processing_started = models.DateTimeField(blank=True, null=True) # When the current 'processing' claim was taken
+
+    class Meta:
+        indexes = [
+            # Status filtering per user (dashboards, admin list_filter)
+            models.Index(fields=['user', 'status'], name='pdfdoc_user_status_idx'),
+            # list_user_documents_view: filter(user=...).order_by('-upload_date')
+            models.Index(fields=['user', '-upload_date'], name='pdfdoc_user_uploaded_idx'),
+            # Reference checks of the media garbage collector (storage.py)
+            models.Index(fields=['uploaded_file'], name='pdfdoc_uploaded_file_idx'),
+            models.Index(fields=['modified_file'], name='pdfdoc_modified_file_idx'),
+        ]
 
     def __str__(self):
         return f"{self.file_name or 'Unnamed PDF'} by {self.user.username}"
@@ -35,3 +63,423 @@ class PdfDocument(models.Model):
         if not self.file_name and self.uploaded_file:
             self.file_name = os.path.basename(self.uploaded_file.name)
         super().save(*args, **kwargs)
+
+    def transition(self, new_status, expected_status=None, **fields):
+        """
+        Moves the document to new_status with a single conditional UPDATE.
+
+        Only the status column and the columns passed in fields are written, so
+        large columns such as extracted_text are never re-serialized unless they
+        are part of the transition. When expected_status is given (a status or a
+        collection of statuses), the update only applies if the row is still in
+        that state, which prevents concurrent workers from clobbering each other.
+
+        Args:
+            new_status (str): One of the STATUS_CHOICES keys.
+            expected_status (str | Iterable[str] | None): Required current status.
+            **fields: Other model fields to write in the same statement.
+
+        Returns:
+            bool: True if the row was updated, False if the guard did not match.
+        """
+        queryset = PdfDocument.objects.filter(pk=self.pk)
+        if expected_status is not None:
+            if isinstance(expected_status, str):
+                queryset = queryset.filter(status=expected_status)
+            else:
+                queryset = queryset.filter(status__in=list(expected_status))
+
+        updated = queryset.update(status=new_status, **fields)
+        if updated:
+            # Keep the in-memory instance in sync with what was written
+            self.status = new_status
+            for field_name, value in fields.items():
+                setattr(self, field_name, value)
+        return bool(updated)
+
+    def start_processing(self):
+        """
+        Claims the document for processing. The guard is the status this instance
+        was loaded with, so if another worker moved the row in the meantime the
+        claim fails instead of overwriting that worker's state.
+
+        A document that is already being processed cannot be claimed, unless its
+        claim is older than settings.PDF_PROCESSING_LEASE_SECONDS: the request or
+        batch that took it was interrupted, and the claim is taken over.
+        """
+        now = timezone.now()
+        if self.status != 'processing':
+            return self.transition('processing', expected_status=self.status, processing_started=now)
+
+        cutoff = now - timedelta(seconds=settings.PDF_PROCESSING_LEASE_SECONDS)
+        updated = PdfDocument.objects.filter(pk=self.pk, status='processing').filter(
+            Q(processing_started__lt=cutoff) | Q(processing_started=None)
+        ).update(processing_started=now)
+        if updated:
+            logger.warning("Took over the stale processing claim of document %s (taken %s)", self.pk,
+                           self.processing_started)
+            self.processing_started = now
+        return bool(updated)
+
+    def mark_completed(self, expected_status=None, **fields):
+        return self.transition('completed', expected_status=expected_status, **fields)
+
+    def mark_failed(self, expected_status=None):
+        return self.transition('failed', expected_status=expected_status)
+
+    def record_revision(self, name, size_bytes=None, save_profile=''):
+        """
+        Records a newly stored modified file (its storage name) as a revision of
+        this document, so that superseded files stay tracked until
+        storage.collect_garbage() prunes them.
+        """
+        return PdfRevision.objects.create(document=self, file=name, size_bytes=size_bytes,
+                                          save_profile=save_profile)
+
+    def learned_price_formats(self):
+        """The document's price formats, learned at extraction: currency symbol -> pricing.PriceFormat."""
+        return {symbol: PriceFormat.from_dict(data) for symbol, data in (self.price_formats or {}).items()}
+
+    def evaluate_price_rules(self, rule_set):
+        """
+        Evaluates a repricing.RuleSet over all of the document's indexed prices.
+
+        Returns:
+            list[dict]: One row per price with a value: id, page_number, bbox,
+                        currency, column, style_info (the column's shared style
+                        if the rule set asks for it) and old/new text and value.
+        """
+        prices = list(self.price_occurrences.exclude(value=None).order_by('page_number', 'y0', 'x0').values(
+            'id', 'page_number', 'x0', 'y0', 'x1', 'y1', 'raw_text', 'value', 'currency', 'column',
+            'font', 'font_size', 'color', 'bold', 'italic',
+        ))
+        for price in prices:
+            price['style_info'] = {'font': price['font'], 'size': price['font_size'], 'color': price['color'],
+                                   'bold': price['bold'], 'italic': price['italic']}
+        if rule_set.column_style == 'shared':
+            shared = column_styles([dict(price['style_info'], page_number=price['page_number'], column=price['column'])
+                                    for price in prices])
+            for price in prices:
+                price['style_info'] = shared.get((price['page_number'], price['column']), price['style_info'])
+        results = rule_set.evaluate(prices, self.learned_price_formats())
+        return [
+            {
+                'id': price['id'],
+                'page_number': price['page_number'],
+                'bbox': [price['x0'], price['y0'], price['x1'], price['y1']],
+                'currency': price['currency'],
+                'column': price['column'],
+                'style_info': price['style_info'],
+                'old_text': price['raw_text'],
+                'new_text': new_text,
+                'old_value': price['value'],
+                'new_value': new_value,
+            }
+            for price, (new_value, new_text) in zip(prices, results)
+        ]
+
+    def known_page_hashes(self):
+        """Returns content_hash -> page_number for the stored pages, for incremental extraction."""
+        return {
+            content_hash: page_number
+            for content_hash, page_number in self.pages.exclude(content_hash='').values_list('content_hash', 'page_number')
+        }
+
+    @transaction.atomic
+    def store_extraction(self, pages):
+        """
+        Stores per-page text and PriceOccurrence rows from extraction results.
+
+        Pages that were reused at the same page number (see utils.extract_pages_from_pdf)
+        are left untouched; reused pages that moved are copied from their old rows,
+        and only the remaining pages are written from the fresh results. The text of
+        reused pages is filled into the given page dicts so callers can rebuild
+        the full document text.
+
+        Args:
+            pages (list[dict]): Output of utils.extract_pages_from_pdf().
+
+        Returns:
+            dict: Number of pages extracted and reused.
+        """
+        sources = {page['reuse_from'] for page in pages if 'reuse_from' in page}
+        old_text = dict(self.pages.filter(page_number__in=sources).values_list('page_number', 'text'))
+        old_prices = {}
+        for occurrence in self.price_occurrences.filter(page_number__in=sources):
+            old_prices.setdefault(occurrence.page_number, []).append(occurrence)
+
+        kept = {page['page_number'] for page in pages if page.get('reuse_from') == page['page_number']}
+        self.pages.exclude(page_number__in=kept).delete()
+        self.price_occurrences.exclude(page_number__in=kept).delete()
+
+        new_pages = []
+        new_prices = []
+        for page in pages:
+            if 'reuse_from' in page:
+                page['text'] = old_text.get(page['reuse_from'], '')
+                if page['page_number'] in kept:
+                    continue
+                for occurrence in old_prices.get(page['reuse_from'], []):
+                    occurrence.pk = None
+                    occurrence.page_number = page['page_number']
+                    new_prices.append(occurrence)
+            else:
+                new_prices.extend(PriceOccurrence.from_detection(self, price) for price in page['prices'])
+            new_pages.append(PdfPage(
+                document=self, page_number=page['page_number'],
+                text=page['text'], content_hash=page.get('content_hash', ''),
+            ))
+
+        # Learn the document's price formats from all of its prices, then settle
+        # strings that are ambiguous on their own (e.g. "1.234") with them
+        kept_texts = list(self.price_occurrences.values_list('raw_text', flat=True))
+        formats = learn_price_formats(kept_texts + [occurrence.raw_text for occurrence in new_prices])
+        for occurrence in new_prices:
+            token = tokenize_price(occurrence.raw_text)
+            if token is not None and token['symbol'] in formats:
+                occurrence.value = storable_value(parse_price(occurrence.raw_text, formats[token['symbol']]))
+
+        # Detected once per extraction, so OCR of the document's regions can use one model
+        language = detect_language("\n".join(page['text'] for page in pages),
+                                   candidates=settings.PDF_OCR_LANGUAGES.values())
+
+        PdfPage.objects.bulk_create(new_pages, batch_size=500)
+        PriceOccurrence.objects.bulk_create(new_prices, batch_size=1000)
+        now = timezone.now()
+        price_formats = {symbol: price_format.to_dict() for symbol, price_format in formats.items()}
+        PdfDocument.objects.filter(pk=self.pk).update(prices_indexed_at=now, price_formats=price_formats,
+                                                      language=language)
+        self.prices_indexed_at = now
+        self.price_formats = price_formats
+        self.language = language
+        return {
+            'pages_extracted': sum(1 for page in pages if 'reuse_from' not in page),
+            'pages_reused': sum(1 for page in pages if 'reuse_from' in page),
+        }
+
+
+class PdfBatch(models.Model):
+    """
+    A set of documents run through the extract -> identify -> reprice -> optimize
+    pipeline together (see batches.py).
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'), # Every item is done or failed
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pdf_batches')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    rules = models.JSONField(blank=True, null=True) # repricing.RuleSet; None skips the reprice stage
+    optimize = models.BooleanField(default=False)
+    save_profile = models.CharField(max_length=10, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    runner = models.CharField(max_length=255, blank=True) # host:pid of the process running the batch
+    heartbeat = models.DateTimeField(blank=True, null=True) # Touched by the runner while it is alive
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created'], name='pdfbatch_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Batch {self.pk} of {self.user_id} ({self.status})"
+
+
+class PdfBatchItem(models.Model):
+    """One document of a PdfBatch and how far the pipeline has got with it."""
+    STAGES = ['queued', 'extract', 'identify', 'reprice', 'optimize', 'done']
+    STAGE_CHOICES = [(stage, stage.capitalize()) for stage in STAGES] + [('failed', 'Failed')]
+
+    batch = models.ForeignKey(PdfBatch, on_delete=models.CASCADE, related_name='items')
+    document = models.ForeignKey(PdfDocument, on_delete=models.CASCADE, related_name='batch_items')
+    stage = models.CharField(max_length=10, choices=STAGE_CHOICES, default='queued')
+    prices_found = models.PositiveIntegerField(blank=True, null=True)
+    prices_changed = models.PositiveIntegerField(blank=True, null=True)
+    error = models.CharField(max_length=255, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'document'], name='pdfbatchitem_batch_doc_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.document_id} in batch {self.batch_id} ({self.stage})"
+
+    @property
+    def progress(self):
+        """Share of the pipeline done, from 0.0 to 1.0."""
+        if self.stage == 'failed':
+            return 1.0
+        return self.STAGES.index(self.stage) / (len(self.STAGES) - 1)
+
+
+class PdfRevision(models.Model):
+    """
+    A modified file written for a document. The newest one is also the
+    document's modified_file; older ones are kept until
+    `python manage.py collect_media_garbage` prunes them (see storage.py).
+    """
+    document = models.ForeignKey(PdfDocument, on_delete=models.CASCADE, related_name='revisions')
+    file = models.FileField(max_length=255) # Name in the default storage
+    size_bytes = models.PositiveBigIntegerField(blank=True, null=True)
+    save_profile = models.CharField(max_length=10, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document', '-created'], name='pdfrev_doc_created_idx'),
+            models.Index(fields=['file'], name='pdfrev_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.file.name} ({self.document_id})"
+
+
+class PdfPage(models.Model):
+    """
+    The text of a single page. Full-text search runs over this table through a
+    backend-specific index (SQLite FTS5 or a PostgreSQL GIN index), see
+    migration 0005 and search.py. On SQLite, migrations that alter this table
+    must call search.install_sqlite_fulltext_index() afterwards.
+    """
+    document = models.ForeignKey(PdfDocument, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField() # 0-indexed, like the API
+    text = models.TextField(blank=True)
+    content_hash = models.CharField(max_length=64, blank=True) # See utils.page_content_hash
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page_number'], name='pdfpage_doc_page_unique'),
+        ]
+
+    def __str__(self):
+        return f"Page {self.page_number} of {self.document_id}"
+
+
+# PriceOccurrence.value holds 14 digits, 4 of them decimals
+VALUE_QUANTUM = Decimal('0.0001')
+VALUE_LIMIT = Decimal(10) ** 10
+
+
+def storable_value(value):
+    """
+    Returns value rounded to PriceOccurrence.value's precision, or None if it
+    does not fit. Bare digit runs in price columns can be SKUs or barcodes, and
+    a value the column cannot hold would fail the whole extraction on PostgreSQL.
+    """
+    if value is None or not value.is_finite():
+        return None
+    try:
+        value = value.quantize(VALUE_QUANTUM)
+    except InvalidOperation: # More digits than the decimal context holds
+        return None
+    return value if abs(value) < VALUE_LIMIT else None
+
+
+class PriceOccurrence(models.Model):
+    """A price detected on a page of a PdfDocument, stored once at extraction time."""
+    document = models.ForeignKey(PdfDocument, on_delete=models.CASCADE, related_name='price_occurrences')
+    page_number = models.PositiveIntegerField() # 0-indexed, like the API
+    x0 = models.FloatField()
+    y0 = models.FloatField()
+    x1 = models.FloatField()
+    y1 = models.FloatField()
+    raw_text = models.CharField(max_length=64)
+    value = models.DecimalField(max_digits=14, decimal_places=4, blank=True, null=True)
+    currency = models.CharField(max_length=3, blank=True) # ISO code, '' when no symbol was printed
+    font = models.CharField(max_length=128, blank=True)
+    font_size = models.FloatField(default=0.0)
+    color = models.CharField(max_length=7, default='#000000')
+    bold = models.BooleanField(default=False)
+    italic = models.BooleanField(default=False)
+    column = models.PositiveSmallIntegerField(blank=True, null=True) # Price column on the page, see layout.py
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document', 'page_number'], name='priceocc_doc_page_idx'),
+            models.Index(fields=['document', 'currency', 'value'], name='priceocc_doc_cur_value_idx'),
+            models.Index(fields=['document', 'value'], name='priceocc_doc_value_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.raw_text} on page {self.page_number} of {self.document_id}"
+
+    @classmethod
+    def from_detection(cls, document, price):
+        try:
+            value = Decimal(str(price['value'])) if price.get('value') is not None else None
+        except InvalidOperation:
+            value = None
+        x0, y0, x1, y1 = price['bbox']
+        return cls(
+            document=document,
+            page_number=price['page_number'],
+            x0=x0, y0=y0, x1=x1, y1=y1,
+            raw_text=price['raw_text'][:64],
+            value=storable_value(value),
+            currency=price.get('currency', ''),
+            font=price.get('font', '')[:128],
+            font_size=price.get('size', 0.0),
+            color=price.get('color', '#000000'),
+            bold=price.get('bold', False),
+            italic=price.get('italic', False),
+            column=price.get('column'),
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'page_number': self.page_number,
+            'bbox': [self.x0, self.y0, self.x1, self.y1],
+            'raw_text': self.raw_text,
+            'value': str(self.value) if self.value is not None else None,
+            'currency': self.currency,
+            'column': self.column,
+            'style_info': {
+                'font': self.font,
+                'size': self.font_size,
+                'color': self.color,
+                'bold': self.bold,
+                'italic': self.italic,
+            },
+        }
+
+
+class ProfilingSwitch(models.Model):
+    """
+    Admin toggle that turns on full cProfile capture of PDF operations, for one
+    user's requests or (with no user) for every request. See profiling.py.
+    """
+    CACHE_KEY = 'pdf_processing_profiling_switches'
+    CACHE_SECONDS = 15
+
+    enabled = models.BooleanField(default=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True,
+                             help_text='Leave empty to profile every request.')
+    note = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        target = self.user.username if self.user_id else 'all users'
+        return f"Profiling for {target} ({'on' if self.enabled else 'off'})"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        cache.delete(self.CACHE_KEY)
+
+    def delete(self, *args, **kwargs):
+        cache.delete(self.CACHE_KEY)
+        return super().delete(*args, **kwargs)
+
+    @classmethod
+    def is_enabled_for(cls, user):
+        """Checks the enabled switches, cached for a few seconds to keep requests off the DB."""
+        user_ids = cache.get(cls.CACHE_KEY)
+        if user_ids is None:
+            user_ids = set(cls.objects.filter(enabled=True).values_list('user_id', flat=True))
+            cache.set(cls.CACHE_KEY, user_ids, cls.CACHE_SECONDS)
+        return None in user_ids or (user.is_authenticated and user.id in user_ids)
@@ -0,0 +1,470 @@
+"""
+Declarative PDF processing pipeline with cached intermediate artifacts.
+
+The functions in utils.py each open the document and recompute what they need
+(text layer, spans, prices) from scratch. A Pipeline is a list of Stages
+instead. Each stage declares the artifacts it reads (inputs) and the
+parameters it depends on (params). Every artifact is keyed by a hash of its
+stage, the stage's version, the keys of its inputs and its parameter values.
+The chain is rooted in the content hash of the document (its bytes) or, for
+per-page stages, of the page (utils.page_content_hash). Therefore:
+
+* artifacts are memoized in an ArtifactCache (in memory, and in a node-local
+  directory shared by the worker processes) and reused whenever the same
+  content is processed with the same parameters;
+* changing a parameter changes the keys of the stages that declare it and of
+  everything downstream of them, and only those stages are recomputed;
+* per-page stages are keyed by page content, so the pages that did not change
+  between two versions of a document are not processed again;
+* a run opens the document at most once, and not at all when every artifact
+  it needs is cached.
+
+PDF_PIPELINE defines the standard stages:
+
+    page_text, span_index (per page)  <- the page content
+    price_hits (per page)             <- span_index
+    price_formats                     <- price_hits
+    edit_plan                         <- price_hits, price_formats; params: rules
+    extraction (not cached)           <- page_text, price_hits; params: known_pages
+    output (not cached)               <- edit_plan; params: output_path, save_profile
+
+run_pdf_pipeline() runs it and can be handed to workers.run_in_worker().
+"""
+from collections import Counter, OrderedDict
+from django.conf import settings
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+
+from .instrumentation import timed
+
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+MEMORY_ENTRIES = 512 # Artifacts kept in memory per process
+EVICTION_SHARE = 16 # The disk is scanned for eviction after max_bytes / EVICTION_SHARE of new artifacts
+
+
+def _digest(parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    func is called as func(run, **inputs, **params), plus page_number for
+    per-page stages, which are computed (and cached) page by page. A per-page
+    input of a per-page stage is that page's artifact; in a whole-document
+    stage it is the list of all pages' artifacts. Bump version when func
+    changes what it returns, so that stale artifacts are not reused.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, per_page=False, cache=True, version=1):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = dict(params or {}) # Parameter name -> default
+        self.per_page = per_page
+        self.cache = cache
+        self.version = version
+
+
+class ArtifactCache:
+    """
+    Pickled artifacts by key: the most recent ones in memory and, with a
+    directory, all of them on disk, where the least recently used are evicted
+    once the directory outgrows max_bytes (see evict()).
+
+    Eviction scans every entry, so it stays off the request path: evict_if_due()
+    only runs it once this process has written max_bytes / EVICTION_SHARE since
+    its last scan, and `manage.py collect_media_garbage` runs it too. The
+    directory may therefore overshoot max_bytes by that much per process.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, max_entries=MEMORY_ENTRIES):
+        self.directory = str(directory) if directory else None
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._written = 0 # Bytes put on disk since the last eviction scan
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self.directory is None:
+            return MISSING
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path) # mtime doubles as the last-read time for eviction
+        except FileNotFoundError:
+            return MISSING
+        except Exception as e:
+            logger.warning("Discarding unreadable pipeline artifact %s: %s", path, e)
+            return MISSING
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.directory is None:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(temp_path, path) # Atomic, so concurrent readers never see partial entries
+        with self._lock:
+            self._written += size
+
+    def evict_if_due(self):
+        """Runs evict() if this process has written max_bytes / EVICTION_SHARE since the last scan."""
+        if self.directory is None or self.max_bytes is None:
+            return
+        with self._lock:
+            if self._written < self.max_bytes / EVICTION_SHARE:
+                return
+            self._written = 0
+        self.evict()
+
+    def evict(self):
+        if self.directory is None or self.max_bytes is None or not os.path.isdir(self.directory):
+            return
+        entries = []
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.pkl'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    """The process-wide cache, in settings.PDF_PIPELINE_CACHE_DIR."""
+    global _default_cache
+    with _default_cache_lock:
+        directory = settings.PDF_PIPELINE_CACHE_DIR
+        if _default_cache is None or _default_cache.directory != (str(directory) if directory else None):
+            _default_cache = ArtifactCache(directory, settings.PDF_PIPELINE_CACHE_MAX_BYTES)
+        return _default_cache
+
+
+_file_digests = {} # (path, size, mtime) -> content hash
+_file_digests_lock = threading.Lock()
+
+
+def content_hash(source):
+    """SHA-256 of a document's bytes (a path or the contents), memoized per path, size and mtime."""
+    if not isinstance(source, (str, os.PathLike)):
+        return hashlib.sha256(source).hexdigest()
+    stat = os.stat(source)
+    memo_key = (os.fspath(source), stat.st_size, stat.st_mtime_ns)
+    with _file_digests_lock:
+        if memo_key in _file_digests:
+            return _file_digests[memo_key]
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with _file_digests_lock:
+        if len(_file_digests) > 1024:
+            _file_digests.clear()
+        _file_digests[memo_key] = digest.hexdigest()
+    return _file_digests[memo_key]
+
+
+class Pipeline:
+    """An ordered set of Stages; the document itself is the input named 'document'."""
+
+    def __init__(self, stages):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages or stage.name == 'document':
+                raise ValueError(f"Duplicate stage '{stage.name}'.")
+            unknown = [name for name in stage.inputs if name != 'document' and name not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' reads undefined inputs: {', '.join(unknown)}.")
+            self.stages[stage.name] = stage
+
+    def run(self, source, params=None, targets=None, cache=None):
+        """
+        Computes the target artifacts (all stages by default) of a document.
+
+        Args:
+            source (str | bytes): The file path to the PDF, or its contents.
+            params (dict | None): Parameter values; stages fall back to their defaults.
+            targets (Iterable[str] | None): Names of the stages to compute.
+            cache (ArtifactCache | None): Where artifacts are looked up and stored.
+
+        Returns:
+            PipelineRun: With results (target -> artifact) and the computed and
+                         reused counts per stage.
+        """
+        run = PipelineRun(self, source, params or {}, cache if cache is not None else ArtifactCache())
+        try:
+            for name in targets or self.stages:
+                if name not in self.stages:
+                    raise ValueError(f"Unknown stage '{name}'.")
+                run.results[name] = run.value(name)
+        finally:
+            run.close()
+        return run
+
+
+class PipelineRun:
+    """The state of one Pipeline.run(): artifact keys and values, and the open document."""
+
+    def __init__(self, pipeline, source, params, cache):
+        self.pipeline = pipeline
+        self.source = source
+        self.params = params
+        self.cache = cache
+        self.results = {}
+        self.computed = Counter()
+        self.reused = Counter()
+        self._keys = {}
+        self._values = {}
+        self._doc = None
+        self._page_hashes = None
+
+    def document(self):
+        """The open fitz.Document, opened on first use."""
+        if self._doc is None:
+            from .utils import open_document # Keeps PyMuPDF out of the URLconf import
+            with timed("open"):
+                self._doc = open_document(self.source)
+        return self._doc
+
+    def page(self, page_number):
+        return self.document().load_page(page_number)
+
+    def close(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+    def page_hashes(self):
+        """Content hash of every page, itself cached under the document's hash."""
+        if self._page_hashes is None:
+            key = _digest(['page_hashes', self.key('document')])
+            hashes = self.cache.get(key)
+            if hashes is MISSING:
+                from .utils import page_content_hash # Local import
+                doc = self.document()
+                memo = {}
+                with timed("hash_pages"):
+                    hashes = [page_content_hash(doc, doc.load_page(i), memo) for i in range(len(doc))]
+                self.cache.put(key, hashes)
+                self.computed['page_hashes'] += 1
+            else:
+                self.reused['page_hashes'] += 1
+            self._page_hashes = hashes
+        return self._page_hashes
+
+    def page_count(self):
+        return len(self.page_hashes())
+
+    def stage_params(self, stage):
+        return {name: self.params.get(name, default) for name, default in stage.params.items()}
+
+    def key(self, name, page_number=None):
+        """The content key of an artifact (of one page, for per-page stages)."""
+        memo_key = (name, page_number)
+        if memo_key in self._keys:
+            return self._keys[memo_key]
+        if name == 'document':
+            key = content_hash(self.source)
+        else:
+            stage = self.pipeline.stages[name]
+            parts = [stage.name, stage.version, self.stage_params(stage)]
+            if stage.per_page:
+                parts.append(self.page_hashes()[page_number])
+            for input_name in stage.inputs:
+                parts.append(self._input_key(input_name, page_number if stage.per_page else None))
+            key = _digest(parts)
+        self._keys[memo_key] = key
+        return key
+
+    def _input_key(self, name, page_number):
+        stage = self.pipeline.stages.get(name)
+        if stage is not None and stage.per_page and page_number is None:
+            return [self.key(name, i) for i in range(self.page_count())]
+        return self.key(name, page_number if stage is not None and stage.per_page else None)
+
+    def value(self, name, page_number=None):
+        """
+        An artifact, from this run, the cache or computed (after its inputs).
+        Without page_number, a per-page stage's value is the list over all pages.
+        """
+        if name == 'document':
+            return self.source
+        stage = self.pipeline.stages[name]
+        if stage.per_page and page_number is None:
+            return [self.value(name, i) for i in range(self.page_count())]
+        memo_key = (name, page_number)
+        if memo_key in self._values:
+            return self._values[memo_key]
+
+        key = self.key(name, page_number) if stage.cache else None
+        value = self.cache.get(key) if stage.cache else MISSING
+        if value is MISSING:
+            inputs = {
+                input_name: self.value(input_name, page_number if stage.per_page else None)
+                for input_name in stage.inputs
+            }
+            if stage.per_page:
+                inputs['page_number'] = page_number
+            with timed(f"stage_{name}"):
+                value = stage.func(self, **inputs, **self.stage_params(stage))
+            if stage.cache:
+                self.cache.put(key, value)
+            self.computed[name] += 1
+        else:
+            self.reused[name] += 1
+        self._values[memo_key] = value
+        return value
+
+
+def _page_text(run, page_number):
+    return run.page(page_number).get_text("text")
+
+
+def _span_index(run, page_number):
+    from .utils import page_spans # Local import
+    return page_spans(run.page(page_number))
+
+
+def _price_hits(run, span_index, page_number):
+    from .utils import find_prices_in_spans # Local import
+    return find_prices_in_spans(span_index, page_number)
+
+
+def _price_formats(run, price_hits):
+    from .pricing import learn_price_formats # Local import
+    formats = learn_price_formats([hit['raw_text'] for hits in price_hits for hit in hits])
+    return {symbol: price_format.to_dict() for symbol, price_format in formats.items()}
+
+
+def _edit_plan(run, price_hits, price_formats, rules):
+    """The replacements a repricing.RuleSet (given as its JSON form) makes; [] without rules."""
+    if rules is None:
+        return []
+    from .pricing import PriceFormat, format_for, parse_price # Local import
+    from .layout import column_styles # Local import
+    from .repricing import RuleSet # Local import
+
+    rule_set = RuleSet.from_dict(rules)
+    formats = {symbol: PriceFormat.from_dict(data) for symbol, data in price_formats.items()}
+    # Settle strings that are ambiguous on their own (e.g. "1.234") with the learned formats
+    prices = [
+        dict(hit, value=parse_price(hit['raw_text'], format_for(hit['raw_text'], formats)))
+        for hits in price_hits for hit in hits
+    ]
+    shared = column_styles(prices) if rule_set.column_style == 'shared' else {}
+    plan = []
+    for price, (new_value, new_text) in zip(prices, rule_set.evaluate(prices, formats)):
+        if new_text is None or new_text == price['raw_text']:
+            continue
+        style_info = shared.get((price['page_number'], price.get('column')))
+        plan.append({
+            'page_number': price['page_number'],
+            'bbox': list(price['bbox']),
+            'old_text': price['raw_text'],
+            'new_text': new_text,
+            'new_value': new_value,
+            'style_info': style_info or {key: price[key] for key in ('font', 'size', 'color', 'bold', 'italic')},
+        })
+    return plan
+
+
+def _extraction(run, known_pages):
+    """
+    Pages in the form of utils.extract_pages_from_pdf(), for
+    PdfDocument.store_extraction(); pages found in known_pages are not loaded.
+    """
+    known_pages = known_pages or {}
+    pages = []
+    for page_number, page_hash in enumerate(run.page_hashes()):
+        if page_hash in known_pages:
+            pages.append({'page_number': page_number, 'content_hash': page_hash, 'reuse_from': known_pages[page_hash]})
+        else:
+            pages.append({
+                'page_number': page_number,
+                'content_hash': page_hash,
+                'text': run.value('page_text', page_number),
+                'prices': run.value('price_hits', page_number),
+            })
+    return pages
+
+
+def _output(run, document, edit_plan, output_path, save_profile):
+    """Writes the edit plan to output_path; returns utils.apply_replacements()'s result, None without a path."""
+    if output_path is None:
+        return None
+    from .utils import apply_replacements # Local import
+    return apply_replacements(document, edit_plan, output_path, save_profile)
+
+
+PDF_PIPELINE = Pipeline([
+    Stage('page_text', _page_text, per_page=True),
+    Stage('span_index', _span_index, per_page=True),
+    Stage('price_hits', _price_hits, inputs=['span_index'], per_page=True, version=2), # Layout-aware detection
+    Stage('price_formats', _price_formats, inputs=['price_hits']),
+    Stage('edit_plan', _edit_plan, inputs=['price_hits', 'price_formats'], params={'rules': None}),
+    Stage('extraction', _extraction, params={'known_pages': None}, cache=False),
+    Stage('output', _output, inputs=['document', 'edit_plan'],
+          params={'output_path': None, 'save_profile': 'balanced'}, cache=False), # utils.DEFAULT_SAVE_PROFILE
+])
+
+
+def run_pdf_pipeline(source, params=None, targets=('extraction',)):
+    """
+    Runs PDF_PIPELINE with the default cache. Module-level, so it can run in the
+    worker pool.
+
+    Returns:
+        tuple: (target -> artifact, {'computed': {stage: count}, 'reused': {stage: count}})
+    """
+    cache = default_cache()
+    try:
+        run = PDF_PIPELINE.run(source, params, targets, cache)
+    except Exception as e:
+        logger.exception("Pipeline run over %s failed: %s", source if isinstance(source, (str, os.PathLike)) else
+                         f"<{len(source)} bytes in memory>", e)
+        return None
+    cache.evict_if_due()
+    return run.results, {'computed': dict(run.computed), 'reused': dict(run.reused)}
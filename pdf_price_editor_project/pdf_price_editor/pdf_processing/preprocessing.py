@@ -0,0 +1,161 @@
+"""
+Image preprocessing for OCR of PDF regions.
+
+Tesseract is fastest and most accurate on clean black-on-white text of a
+known size with little margin around it. render_region() renders a region
+into that shape before utils.extract_text_from_region_ocr() hands it over:
+
+1. DPI normalization: the zoom is chosen from the region instead of a fixed
+   2x. Price regions (single lines) are rendered so that the line is about
+   PRICE_LINE_HEIGHT_PX tall. Other regions are rendered at TEXT_DPI, capped at
+   MAX_PIXELS so that large regions do not make huge images.
+2. Grayscale: MuPDF renders straight into a one-channel pixmap, and its buffer
+   becomes the PIL image without a PNG round trip.
+3. Adaptive binarization: a pixel is ink if it is darker than the mean of its
+   neighbourhood by ADAPTIVE_OFFSET, or darker than DARK_THRESHOLD. Tinted or
+   shaded backgrounds of catalog tables therefore become white.
+4. Deskew: rows of ink are sharpest at the right angle. The angle within
+   +/-MAX_SKEW_DEGREES whose row profile varies the most is found on a
+   downscaled copy, and the image is rotated by it.
+5. Cropping to the ink bounds, plus INK_MARGIN_PX of white.
+
+Every step is a whole-image Pillow operation (lookup tables, box filters and
+resampling run in C over the pixmap buffer), so no pixel is touched in Python
+and NumPy is not needed.
+
+For price regions, ocr_options() returns the Tesseract settings that go with
+the image: single-line page segmentation and a whitelist of the characters
+prices are written with.
+
+PyMuPDF and Pillow are loaded on first use (see lazy.py). Like utils.py,
+this module does not depend on Django.
+"""
+from .lazy import lazy_import
+from .pricing import CURRENCY_SYMBOLS
+
+fitz = lazy_import('fitz') # PyMuPDF
+Image = lazy_import('PIL.Image')
+ImageChops = lazy_import('PIL.ImageChops')
+ImageFilter = lazy_import('PIL.ImageFilter')
+
+
+TEXT_DPI = 300 # Rendering resolution for text regions
+PRICE_LINE_HEIGHT_PX = 48 # Rendered height of a single-line price region
+MIN_ZOOM, MAX_ZOOM = 1.0, 8.0
+MAX_PIXELS = 6_000_000 # Upper bound of a rendered region (about A4 at 300 DPI)
+ADAPTIVE_OFFSET = 12 # How much darker than its neighbourhood a pixel must be to count as ink
+DARK_THRESHOLD = 96 # Pixels darker than this are ink whatever their neighbourhood
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.5
+SKEW_SEARCH_WIDTH = 400 # Width of the downscaled copy the skew angle is searched on
+INK_MARGIN_PX = 8
+
+# Single text line (PSM 7) and the characters prices are made of
+PRICE_WHITELIST = "".join(sorted(set("0123456789.,-'" + "".join(CURRENCY_SYMBOLS))))
+OCR_MODES = ('text', 'price')
+
+
+def ocr_options(mode):
+    """
+    Tesseract settings for an OCR mode.
+
+    Returns:
+        dict: psm (page segmentation mode, None for Tesseract's default) and whitelist ('' for none).
+    """
+    if mode == 'price':
+        return {'psm': 7, 'whitelist': PRICE_WHITELIST}
+    return {'psm': None, 'whitelist': ''}
+
+
+def region_zoom(rect, mode):
+    """The rendering zoom for a region (see the module docstring)."""
+    if mode == 'price':
+        zoom = PRICE_LINE_HEIGHT_PX / rect.height
+    else:
+        zoom = TEXT_DPI / 72
+        area = rect.width * rect.height
+        if area * zoom * zoom > MAX_PIXELS:
+            zoom = (MAX_PIXELS / area) ** 0.5
+    return min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+
+
+def binarize(gray):
+    """Adaptive binarization of a grayscale image: black ink on white."""
+    radius = max(8, min(gray.size) // 4) # Wider than a glyph stroke, so strokes are not hollowed out
+    background = gray.filter(ImageFilter.BoxBlur(radius))
+    # How much darker each pixel is than its neighbourhood (clipped at 0)
+    contrast = ImageChops.subtract(background, gray)
+    adaptive = contrast.point(lambda value: 0 if value > ADAPTIVE_OFFSET else 255)
+    dark = gray.point(lambda value: 0 if value < DARK_THRESHOLD else 255)
+    return ImageChops.darker(adaptive, dark)
+
+
+def _row_profile_score(ink, angle):
+    rotated = ink.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=0)
+    profile = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+    mean = sum(profile) / len(profile)
+    return sum((value - mean) ** 2 for value in profile) / len(profile)
+
+
+def skew_angle(binary):
+    """
+    The angle (in degrees, counterclockwise) that makes the text lines of a
+    binarized image horizontal, or 0.0 if the image has no ink.
+    """
+    ink = ImageChops.invert(binary) # Ink is bright, so rotating in black adds none
+    if ink.getbbox() is None:
+        return 0.0
+    if ink.width > SKEW_SEARCH_WIDTH:
+        scale = SKEW_SEARCH_WIDTH / ink.width
+        ink = ink.resize((SKEW_SEARCH_WIDTH, max(1, round(ink.height * scale))), Image.BOX)
+
+    steps = int(MAX_SKEW_DEGREES / SKEW_STEP_DEGREES)
+    angles = [step * SKEW_STEP_DEGREES for step in range(-steps, steps + 1)]
+    scores = {angle: _row_profile_score(ink, angle) for angle in angles}
+    best = max(scores, key=scores.get)
+    # Prefer no rotation unless an angle is clearly better
+    return best if scores[best] > scores[0.0] * 1.05 else 0.0
+
+
+def crop_to_ink(binary, margin=INK_MARGIN_PX):
+    """Crops a binarized image to its ink plus margin; an image without ink is returned as is."""
+    bbox = ImageChops.invert(binary).getbbox()
+    if bbox is None:
+        return binary
+    left, top, right, bottom = bbox
+    cropped = binary.crop((left, top, right, bottom))
+    framed = Image.new('L', (cropped.width + 2 * margin, cropped.height + 2 * margin), 255)
+    framed.paste(cropped, (margin, margin))
+    return framed
+
+
+def preprocess(gray):
+    """Binarizes, deskews and crops a grayscale image for OCR."""
+    binary = binarize(gray)
+    angle = skew_angle(binary)
+    if angle:
+        binary = binary.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+        binary = binary.point(lambda value: 0 if value < 128 else 255) # Rotation blurred the edges
+    return crop_to_ink(binary)
+
+
+def render_region(page, clip_rect, mode='text', preprocessed=True):
+    """
+    Renders a region of a page for OCR.
+
+    Args:
+        page (fitz.Page): The page.
+        clip_rect (fitz.Rect): The region.
+        mode (str): 'text', or 'price' for single-line price regions.
+        preprocessed (bool): Whether to binarize, deskew and crop the rendering.
+
+    Returns:
+        PIL.Image.Image | None: A grayscale image, or None if the rendering is empty.
+    """
+    zoom = region_zoom(clip_rect, mode)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip_rect, colorspace=fitz.csGRAY, alpha=False)
+    if pix.width == 0 or pix.height == 0:
+        return None
+    gray = Image.frombuffer('L', (pix.width, pix.height), pix.samples_mv, 'raw', 'L', pix.stride, 1)
+    gray = gray.copy() # Detached from the pixmap's buffer
+    return preprocess(gray) if preprocessed else gray
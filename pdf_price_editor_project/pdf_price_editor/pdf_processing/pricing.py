@@ -0,0 +1,325 @@
+"""
+Exact price arithmetic and per-document price formats.
+
+Prices are parsed into Decimal, never float, and a price that cannot be parsed
+is None rather than 0. How a catalog writes its prices (thousands and decimal
+separators, decimal places, where the currency symbol goes and whether a space
+separates it, "charm" endings such as .99) is learned once per document and
+currency symbol from all of its detected prices, see learn_price_formats().
+The resulting PriceFormat is compiled into a quantum and a translation table,
+so reformatting thousands of repriced values is one format() and one
+str.translate() per value instead of guessing from every original string.
+
+Like utils.py, this module does not depend on Django.
+"""
+from collections import Counter
+from decimal import Decimal, InvalidOperation, ROUND_FLOOR, ROUND_HALF_UP
+import re
+
+
+# Longest first, so that "грн." wins over "грн"
+CURRENCY_SYMBOLS = ('грн.', 'грн', 'UAH', 'USD', 'EUR', 'GBP', '$', '€', '£', '₴')
+_SYMBOL = '|'.join(re.escape(symbol) for symbol in CURRENCY_SYMBOLS)
+PRICE_TOKEN = re.compile(
+    rf"^\s*(?P<lead_sign>-)?(?P<prefix>{_SYMBOL})?(?P<prefix_space>\s*)(?P<sign>-)?"
+    rf"(?P<number>\d(?:[\d \u00a0\u202f.,']*\d)?)"
+    rf"(?P<suffix_space>\s*)(?P<suffix>{_SYMBOL})?\s*$"
+)
+SPACE_SEPARATORS = (' ', '\u00a0', '\u202f', "'")
+MIN_ENDING_SAMPLES = 3 # Prices needed before an ending (e.g. .99) counts as a rule
+ENDING_SHARE = 0.6 # Share of prices that must have it
+
+
+def tokenize_price(text):
+    """
+    Splits a price string into its parts.
+
+    Returns:
+        dict | None: symbol, position ('prefix'/'suffix'/''), spacing, sign and
+                     number, or None if text is not a single price.
+    """
+    match = PRICE_TOKEN.match(text or '')
+    if not match or (match['prefix'] and match['suffix']) or (match['lead_sign'] and match['sign']):
+        return None
+    if match['prefix']:
+        symbol, position, spacing = match['prefix'], 'prefix', match['prefix_space']
+    elif match['suffix']:
+        symbol, position, spacing = match['suffix'], 'suffix', match['suffix_space']
+    else:
+        symbol, position, spacing = '', '', ''
+    return {
+        'symbol': symbol,
+        'position': position,
+        'spacing': spacing,
+        'sign': match['lead_sign'] or match['sign'] or '',
+        'number': match['number'],
+    }
+
+
+def split_number(number, decimal_separator=None):
+    """
+    Splits the digits of a number into integer and fraction parts.
+
+    Without a known decimal_separator the separators are inferred: with two
+    kinds the last one is decimal; a repeated one or a space is a thousands
+    separator; a single '.' or ',' followed by exactly three digits is
+    ambiguous and taken as a thousands separator.
+
+    Returns:
+        tuple | None: (integer digits, fraction digits, thousands separator,
+                       decimal separator, ambiguous), or None if the grouping
+                       is not a valid number.
+    """
+    separators = [(i, c) for i, c in enumerate(number) if not c.isdigit()]
+    kinds = list(dict.fromkeys(c for _, c in separators))
+    ambiguous = False
+
+    if decimal_separator is not None:
+        decimal = decimal_separator if decimal_separator in kinds and separators[-1][1] == decimal_separator else ''
+    elif not separators:
+        decimal = ''
+    elif len(kinds) >= 2:
+        decimal = separators[-1][1]
+    else:
+        kind = kinds[0]
+        digits_after = len(number) - separators[-1][0] - 1
+        if len(separators) > 1 or kind in SPACE_SEPARATORS:
+            decimal = ''
+        elif digits_after == 3:
+            decimal, ambiguous = '', True
+        else:
+            decimal = kind
+
+    if decimal:
+        integer_part, fraction = number[:separators[-1][0]], number[separators[-1][0] + 1:]
+    else:
+        integer_part, fraction = number, ''
+    thousands_kinds = {c for c in integer_part if not c.isdigit()}
+    if len(thousands_kinds) > 1 or decimal in thousands_kinds:
+        return None
+    thousands = thousands_kinds.pop() if thousands_kinds else ''
+    if thousands:
+        groups = integer_part.split(thousands)
+        if not (1 <= len(groups[0]) <= 3) or any(len(group) != 3 for group in groups[1:]):
+            return None
+    return integer_part.replace(thousands, '') if thousands else integer_part, fraction, thousands, decimal, ambiguous
+
+
+def parse_price(text, price_format=None):
+    """
+    Parses a price string (e.g. "$1,234.56", "1.234,56 €", "1 234,56 грн") into a Decimal.
+
+    Args:
+        text (str): The price as printed.
+        price_format (PriceFormat | None): The document's learned format, which
+            settles ambiguous strings such as "1.234".
+
+    Returns:
+        Decimal | None: The value, or None if text is not a price.
+    """
+    token = tokenize_price(text)
+    if token is None:
+        return None
+    decimal = price_format.decimal_separator if price_format is not None else None
+    parts = split_number(token['number'], decimal)
+    if parts is None:
+        return None
+    integer_digits, fraction, _, _, _ = parts
+    try:
+        value = Decimal(f"{integer_digits}.{fraction}" if fraction else integer_digits)
+    except InvalidOperation:
+        return None
+    return -value if token['sign'] else value
+
+
+class PriceFormat:
+    """
+    How one document writes prices with one currency symbol. Instances are
+    immutable and compiled: format() needs no per-value decisions.
+    """
+
+    def __init__(self, symbol='', position='', spacing='', thousands_separator='',
+                 decimal_separator='.', decimals=2, ending=''):
+        self.symbol = symbol
+        self.position = position if symbol else ''
+        self.spacing = spacing
+        self.thousands_separator = thousands_separator
+        self.decimal_separator = decimal_separator
+        self.decimals = decimals
+        self.ending = ending # Digits every price ends with, e.g. '99' for x.99, '9' for 1 299
+        self._quantum = Decimal(1).scaleb(-decimals)
+        self._grouping = ',' if thousands_separator else ''
+        self._table = str.maketrans({',': thousands_separator, '.': decimal_separator})
+        if ending:
+            self._ending_value = Decimal(int(ending)).scaleb(-decimals)
+            self._ending_step = Decimal(1).scaleb(len(ending) - decimals)
+
+    def __eq__(self, other):
+        return isinstance(other, PriceFormat) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"PriceFormat({self.to_dict()!r})"
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'position': self.position,
+            'spacing': self.spacing,
+            'thousands_separator': self.thousands_separator,
+            'decimal_separator': self.decimal_separator,
+            'decimals': self.decimals,
+            'ending': self.ending,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    @classmethod
+    def learn(cls, texts):
+        """
+        Learns the format from prices that share one currency symbol. Each
+        property is decided by a vote over the prices that show it, so a few
+        odd strings do not change the result. Returns None if no text parses.
+        """
+        tokens = [token for token in map(tokenize_price, texts) if token is not None]
+        if not tokens:
+            return None
+        symbol = Counter(token['symbol'] for token in tokens).most_common(1)[0][0]
+        tokens = [token for token in tokens if token['symbol'] == symbol]
+        layouts = Counter((token['position'], token['spacing']) for token in tokens)
+        position, spacing = layouts.most_common(1)[0][0]
+
+        splits = [parts for parts in (split_number(token['number']) for token in tokens) if parts is not None]
+        if not splits:
+            return None
+        decimal_votes = Counter(parts[3] for parts in splits if parts[3])
+        thousands_votes = Counter(parts[2] for parts in splits if parts[2] and not parts[4])
+        decimal = decimal_votes.most_common(1)[0][0] if decimal_votes else ''
+        thousands = thousands_votes.most_common(1)[0][0] if thousands_votes else ''
+        if decimal and not thousands and any(parts[4] and parts[2] != decimal for parts in splits):
+            # "1.234" next to "5,99": the ambiguous '.' groups thousands
+            thousands = next(parts[2] for parts in splits if parts[4] and parts[2] != decimal)
+        if not decimal:
+            # Whole prices only; a later decimal uses the other separator
+            decimal = ',' if thousands == '.' else '.'
+        if thousands == decimal:
+            thousands = ''
+
+        fractions = [parts[1] for parts in splits if parts[1]]
+        decimals = Counter(len(fraction) for fraction in fractions).most_common(1)[0][0] if fractions else 0
+
+        ending = ''
+        if decimals:
+            candidates = [fraction for fraction in fractions if len(fraction) == decimals]
+        else:
+            candidates = [parts[0][-1] for parts in splits]
+        if len(candidates) >= MIN_ENDING_SAMPLES:
+            common, count = Counter(candidates).most_common(1)[0]
+            if count >= ENDING_SHARE * len(candidates) and int(common) != 0:
+                ending = common
+        return cls(symbol, position, spacing, thousands, decimal or '.', decimals, ending)
+
+    def round(self, value):
+        """Rounds a Decimal to the format's decimals and, if any, its ending (to the nearest match)."""
+        value = value.quantize(self._quantum, rounding=ROUND_HALF_UP)
+        if not self.ending:
+            return value
+        step = self._ending_step
+        below = (value / step).to_integral_value(rounding=ROUND_FLOOR) * step + self._ending_value
+        if below > value:
+            below -= step
+        above = below + step
+        chosen = below if (value - below) <= (above - value) and below > 0 else above
+        return chosen.quantize(self._quantum)
+
+    def format(self, value):
+        """Formats a Decimal (or int/str) the way the document writes prices."""
+        value = self.round(Decimal(value))
+        number = format(value, f"{self._grouping}.{self.decimals}f").translate(self._table)
+        if self.position == 'prefix':
+            if number.startswith('-'):
+                return f"-{self.symbol}{self.spacing}{number[1:]}"
+            return f"{self.symbol}{self.spacing}{number}"
+        if self.position == 'suffix':
+            return f"{number}{self.spacing}{self.symbol}"
+        return number
+
+    def format_many(self, values):
+        """format() over a sequence of values."""
+        fmt = self.format
+        return [fmt(value) for value in values]
+
+    def parse(self, text):
+        return parse_price(text, self)
+
+    def parse_many(self, texts):
+        return [parse_price(text, self) for text in texts]
+
+
+def learn_price_formats(texts):
+    """
+    Learns one PriceFormat per currency symbol from the prices of a document.
+
+    Returns:
+        dict: symbol ('' for bare numbers) -> PriceFormat
+    """
+    groups = {}
+    for text in texts:
+        token = tokenize_price(text)
+        if token is not None:
+            groups.setdefault(token['symbol'], []).append(text)
+    formats = {}
+    for symbol, group in groups.items():
+        price_format = PriceFormat.learn(group)
+        if price_format is not None:
+            formats[symbol] = price_format
+    return formats
+
+
+def format_for(text, formats=None):
+    """
+    The format to write a replacement for the price text in: the document's
+    learned format for its symbol, adapted to where this text places the
+    symbol, or else one learned from the text alone.
+    """
+    token = tokenize_price(text)
+    if token is None:
+        return None
+    learned = (formats or {}).get(token['symbol'])
+    if learned is None:
+        return PriceFormat.learn([text])
+    if (learned.position, learned.spacing) == (token['position'], token['spacing']):
+        return learned
+    data = learned.to_dict()
+    data.update(position=token['position'], spacing=token['spacing'])
+    return PriceFormat.from_dict(data)
+
+
+def reprice(texts, factor, formats=None):
+    """
+    Multiplies each price text by factor (a Decimal) and formats the results,
+    grouping the texts by format so that each group is one format_many() call.
+
+    Returns:
+        list[tuple[Decimal | None, str | None]]: (new value, new text) per input,
+        (None, None) where the text is not a price.
+    """
+    results = [(None, None)] * len(texts)
+    groups = {}
+    for index, text in enumerate(texts):
+        price_format = format_for(text, formats)
+        if price_format is None:
+            continue
+        value = price_format.parse(text)
+        if value is None:
+            continue
+        key = tuple(price_format.to_dict().values())
+        groups.setdefault(key, (price_format, [], []))
+        groups[key][1].append(index)
+        groups[key][2].append(value * factor)
+    for price_format, indexes, values in groups.values():
+        rounded = [price_format.round(value) for value in values]
+        for index, value, text in zip(indexes, rounded, price_format.format_many(rounded)):
+            results[index] = (value, text)
+    return results
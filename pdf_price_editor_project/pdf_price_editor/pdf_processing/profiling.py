@@ -0,0 +1,208 @@
+"""
+Opt-in profiling of slow PDF operations.
+
+Functions in utils.py that take a PDF (path or bytes) as first argument are
+decorated with `@profiled("<operation>")`. Two capture modes exist:
+
+* Requested: when the current request asked for it (see ProfilingMiddleware),
+  the whole operation runs under cProfile and a .prof file is written.
+* Slow-operation watchdog: otherwise, a single background thread watches
+  running operations and, only once one has run longer than the configured
+  threshold, starts sampling that thread's stack. The samples are written as
+  folded stacks (one "frame;frame;frame count" line per stack), which
+  flamegraph.pl and speedscope can read.
+
+Every capture is saved together with a JSON sidecar holding the SHA-256 digest
+of the offending document, so it can be fetched and replayed offline. When no
+profile is requested and no operation is slow, the cost is a dictionary insert
+and delete per operation.
+"""
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import cProfile
+import functools
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_config = {
+    'output_dir': None,   # Captures are discarded when not configured
+    'slow_threshold': None, # Seconds; None disables the watchdog
+    'sample_interval': 0.005,
+}
+
+_profile_requested = ContextVar('pdf_processing_profile_requested', default=False)
+
+
+def configure(output_dir=None, slow_threshold=None, sample_interval=None):
+    """Sets where captures go and when the watchdog kicks in (called from AppConfig.ready)."""
+    _config['output_dir'] = str(output_dir) if output_dir else None
+    _config['slow_threshold'] = slow_threshold
+    if sample_interval:
+        _config['sample_interval'] = sample_interval
+
+
+def request_profiling(enabled=True):
+    """Marks the current context (request) for full cProfile capture; returns a reset token."""
+    return _profile_requested.set(enabled)
+
+
+def reset_profiling(token):
+    _profile_requested.reset(token)
+
+
+def profiling_requested():
+    return _profile_requested.get()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _WatchedOperation:
+    __slots__ = ('thread_id', 'deadline', 'samples')
+
+    def __init__(self, thread_id, deadline):
+        self.thread_id = thread_id
+        self.deadline = deadline
+        self.samples = Counter()
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SlowOperationWatchdog:
+    """Samples the stacks of operations that have been running longer than their deadline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._operations = {}
+        self._thread = None
+
+    def register(self, threshold):
+        operation = _WatchedOperation(threading.get_ident(), time.monotonic() + threshold)
+        with self._lock:
+            self._operations[id(operation)] = operation
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pdf-profiling-watchdog', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return operation
+
+    def unregister(self, operation):
+        """Stops watching the operation and returns the stack samples taken, if any."""
+        with self._lock:
+            self._operations.pop(id(operation), None)
+        return operation.samples
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                overdue = [op for op in self._operations.values() if op.deadline <= now]
+                if overdue:
+                    frames = sys._current_frames()
+                    for op in overdue:
+                        frame = frames.get(op.thread_id)
+                        if frame is not None:
+                            op.samples[_collapse(frame)] += 1
+                    timeout = _config['sample_interval']
+                elif self._operations:
+                    timeout = min(op.deadline for op in self._operations.values()) - now
+                else:
+                    timeout = None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+watchdog = SlowOperationWatchdog()
+
+
+def _save_capture(operation, pdf_path, elapsed, mode, write_capture, extension):
+    output_dir = _config['output_dir']
+    if not output_dir:
+        return None
+    try:
+        if isinstance(pdf_path, (str, os.PathLike)):
+            digest = file_digest(pdf_path) if os.path.exists(pdf_path) else None
+        else:
+            digest = hashlib.sha256(pdf_path).hexdigest() # Document passed as bytes
+            pdf_path = None
+        os.makedirs(output_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        base = os.path.join(output_dir, f"{stamp}_{operation}_{(digest or 'nofile')[:12]}")
+        write_capture(base + extension)
+        with open(base + '.json', 'w') as f:
+            json.dump({
+                'operation': operation,
+                'mode': mode,
+                'elapsed_seconds': round(elapsed, 3),
+                'document_path': pdf_path,
+                'document_sha256': digest,
+                'captured_at': stamp,
+            }, f, indent=2)
+        logger.warning("Profiled %s (%s, %.2fs) of document %s: %s%s", operation, mode, elapsed, digest, base, extension)
+        return base + extension
+    except Exception as e:
+        logger.exception("Could not save profile for %s: %s", operation, e)
+        return None
+
+
+def _write_folded(samples):
+    def write(path):
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+    return write
+
+
+def profiled(operation):
+    """Decorator for functions whose first argument is the PDF they work on (a path or bytes)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(pdf_path, *args, **kwargs):
+            if _profile_requested.get():
+                profiler = cProfile.Profile()
+                token = _profile_requested.set(False) # Nested operations are part of this profile
+                started = time.perf_counter()
+                try:
+                    return profiler.runcall(func, pdf_path, *args, **kwargs)
+                finally:
+                    _profile_requested.reset(token)
+                    _save_capture(operation, pdf_path, time.perf_counter() - started,
+                                  'requested', profiler.dump_stats, '.prof')
+
+            threshold = _config['slow_threshold']
+            if threshold is None:
+                return func(pdf_path, *args, **kwargs)
+
+            watched = watchdog.register(threshold)
+            started = time.perf_counter()
+            try:
+                return func(pdf_path, *args, **kwargs)
+            finally:
+                samples = watchdog.unregister(watched)
+                if samples:
+                    _save_capture(operation, pdf_path, time.perf_counter() - started,
+                                  'slow', _write_folded(samples), '.folded')
+        return wrapper
+    return decorator
@@ -0,0 +1,202 @@
+"""
+Bulk price transformation rules.
+
+A RuleSet is evaluated over all of a document's detected prices in one batch,
+before anything is written to a PDF. Each price becomes
+
+    clamp(value * multiplier + markup, min, max)
+
+rounded the way the document writes prices (see pricing.py), or with an
+explicit "psychological" ending. A rule set is given as JSON:
+
+    {
+        "multiplier": {"USD": 1.1, "UAH": 1.05, "*": 1},  # or a single number
+        "markup": {"UAH": 20},               # fixed amount added after the multiplier
+        "min": {"USD": 1}, "max": 10000,     # clamps
+        "rounding": "document",              # learned format, "none", or an ending: "99", "95", "9"
+        "overrides": [                       # later overrides win
+            {"pages": [0, 3], "multiplier": 1.2},
+            {"page_range": [10, 19], "rounding": "none"},
+            {"pages": [5], "columns": [1], "markup": 5}
+        ],
+        "column_style": "shared"             # or "own" (the default)
+    }
+
+Per-currency values are keyed by ISO code ('' for prices printed without a
+symbol), with "*" for all other currencies. Prices are grouped by their
+resolved parameters and format, and each group is computed as one Decimal
+vector.
+
+An override's "columns" selects price columns by their number on the page
+(see layout.py), so a whole column can be repriced together. With
+"column_style": "shared", every new price in a column is written in the
+column's most common style instead of its own.
+
+Like utils.py, this module does not depend on Django.
+"""
+from decimal import Decimal, InvalidOperation
+
+from .pricing import PriceFormat, format_for
+
+
+RULE_KEYS = ('multiplier', 'markup', 'min', 'max', 'rounding')
+ROUNDING_MODES = ('document', 'none')
+COLUMN_STYLES = ('own', 'shared')
+DEFAULTS = {'multiplier': Decimal(1), 'markup': Decimal(0), 'min': None, 'max': None, 'rounding': 'document'}
+
+
+def _decimal(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str, Decimal)):
+        raise ValueError(f"'{name}' must be a number.")
+    try:
+        result = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"'{name}' must be a number.")
+    if not result.is_finite():
+        raise ValueError(f"'{name}' must be a finite number.")
+    return result
+
+
+def _rounding(value, name):
+    if value in ROUNDING_MODES:
+        return value
+    if isinstance(value, str) and value.isdigit() and len(value) <= 4 and int(value) > 0:
+        return value
+    raise ValueError(f"'{name}' must be 'document', 'none' or the digits of an ending such as '99'.")
+
+
+def _parse_rule(data, where):
+    """Validates one level of rule parameters; returns {key: value or {currency: value}}."""
+    if not isinstance(data, dict):
+        raise ValueError(f"{where} must be an object.")
+    rule = {}
+    for key in RULE_KEYS:
+        if key not in data:
+            continue
+        convert = _rounding if key == 'rounding' else _decimal
+        value = data[key]
+        if isinstance(value, dict):
+            rule[key] = {str(currency): convert(item, f"{where}.{key}.{currency}") for currency, item in value.items()}
+        else:
+            rule[key] = convert(value, f"{where}.{key}")
+    return rule
+
+
+class RuleSet:
+    """A validated rule set; see the module docstring for its JSON form."""
+
+    def __init__(self, base, overrides=(), column_style='own'):
+        self.base = base
+        self.overrides = list(overrides) # (pages set or None, page range or None, columns set or None, rule)
+        self.column_style = column_style
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Raises:
+            ValueError: With a message suitable for a 400 response.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("'rules' must be an object.")
+        unknown = set(data) - set(RULE_KEYS) - {'overrides', 'column_style'}
+        if unknown:
+            raise ValueError(f"Unknown rule keys: {', '.join(sorted(unknown))}.")
+        overrides = []
+        for i, item in enumerate(data.get('overrides') or []):
+            where = f"overrides[{i}]"
+            if not isinstance(item, dict):
+                raise ValueError(f"{where} must be an object.")
+            pages = item.get('pages')
+            page_range = item.get('page_range')
+            columns = item.get('columns')
+            if pages is not None and (not isinstance(pages, list) or
+                                      not all(isinstance(p, int) and p >= 0 for p in pages)):
+                raise ValueError(f"{where}.pages must be a list of page numbers.")
+            if page_range is not None and (not isinstance(page_range, list) or len(page_range) != 2 or
+                                           not all(isinstance(p, int) and p >= 0 for p in page_range) or
+                                           page_range[0] > page_range[1]):
+                raise ValueError(f"{where}.page_range must be [first, last] page numbers.")
+            if columns is not None and (not isinstance(columns, list) or
+                                        not all(isinstance(c, int) and c >= 0 for c in columns)):
+                raise ValueError(f"{where}.columns must be a list of price column numbers.")
+            if pages is None and page_range is None and columns is None:
+                raise ValueError(f"{where} needs 'pages', 'page_range' or 'columns'.")
+            overrides.append((set(pages) if pages is not None else None,
+                              tuple(page_range) if page_range is not None else None,
+                              set(columns) if columns is not None else None,
+                              _parse_rule(item, where)))
+        column_style = data.get('column_style', 'own')
+        if column_style not in COLUMN_STYLES:
+            raise ValueError(f"'column_style' must be one of: {', '.join(COLUMN_STYLES)}.")
+        return cls(_parse_rule(data, 'rules'), overrides, column_style)
+
+    def parameters(self, page_number, currency, column=None):
+        """The resolved (multiplier, markup, min, max, rounding) for a price."""
+        resolved = dict(DEFAULTS)
+        rules = [self.base] + [
+            rule for pages, page_range, columns, rule in self.overrides
+            if (pages is None or page_number in pages) and
+               (page_range is None or page_range[0] <= page_number <= page_range[1]) and
+               (columns is None or column in columns)
+        ]
+        for rule in rules:
+            for key, value in rule.items():
+                if isinstance(value, dict):
+                    value = value.get(currency, value.get('*', resolved[key]))
+                resolved[key] = value
+        return tuple(resolved[key] for key in RULE_KEYS)
+
+    def evaluate(self, prices, formats=None):
+        """
+        Computes the new value and text of every price.
+
+        Args:
+            prices (list[dict]): raw_text, value (Decimal, str or None), currency,
+                                 page_number and (optional) price column of each price.
+            formats (dict | None): The document's learned formats (pricing.learn_price_formats()).
+
+        Returns:
+            list[tuple[Decimal | None, str | None]]: (new value, new text) per
+            price, (None, None) for prices without a value.
+        """
+        results = [(None, None)] * len(prices)
+        parameter_cache = {}
+        format_cache = {}
+        groups = {}
+        for index, price in enumerate(prices):
+            value = price.get('value')
+            if value is None:
+                continue
+            key = (price['page_number'], price.get('currency', ''), price.get('column'))
+            parameters = parameter_cache.get(key)
+            if parameters is None:
+                parameters = parameter_cache[key] = self.parameters(*key)
+            price_format = format_cache.get(price['raw_text'])
+            if price_format is None:
+                price_format = format_cache[price['raw_text']] = format_for(price['raw_text'], formats) or PriceFormat()
+            group_key = (parameters, tuple(price_format.to_dict().values()))
+            group = groups.get(group_key)
+            if group is None:
+                group = groups[group_key] = (_rounded_format(price_format, parameters[4]), [], [])
+            group[1].append(index)
+            group[2].append(Decimal(value) if not isinstance(value, Decimal) else value)
+
+        for (parameters, _), (price_format, indexes, values) in groups.items():
+            multiplier, markup, minimum, maximum, _ = parameters
+            new_values = [value * multiplier + markup for value in values]
+            if minimum is not None:
+                new_values = [max(value, minimum) for value in new_values]
+            if maximum is not None:
+                new_values = [min(value, maximum) for value in new_values]
+            new_values = [price_format.round(value) for value in new_values]
+            for index, value, text in zip(indexes, new_values, price_format.format_many(new_values)):
+                results[index] = (value, text)
+        return results
+
+
+def _rounded_format(price_format, rounding):
+    if rounding == 'document':
+        return price_format
+    data = price_format.to_dict()
+    data['ending'] = '' if rounding == 'none' else rounding
+    return PriceFormat.from_dict(data)
@@ -0,0 +1,143 @@
+from django.db import connection
+from .models import PdfPage, PriceOccurrence
+
+
+SQLITE_FTS_TABLE = 'pdf_processing_pdfpage_fts'
+SQLITE_FTS_TRIGGERS = {
+    'pdf_processing_pdfpage_fts_ai': """AFTER INSERT ON pdf_processing_pdfpage BEGIN
+        INSERT INTO pdf_processing_pdfpage_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    'pdf_processing_pdfpage_fts_ad': """AFTER DELETE ON pdf_processing_pdfpage BEGIN
+        INSERT INTO pdf_processing_pdfpage_fts(pdf_processing_pdfpage_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    'pdf_processing_pdfpage_fts_au': """AFTER UPDATE ON pdf_processing_pdfpage BEGIN
+        INSERT INTO pdf_processing_pdfpage_fts(pdf_processing_pdfpage_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO pdf_processing_pdfpage_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+}
+
+
+def install_sqlite_fulltext_index(schema_editor):
+    """
+    (Re)creates the FTS5 table and its sync triggers and rebuilds the index.
+
+    SQLite migrations that alter pdf_processing_pdfpage rebuild the table, which
+    drops its triggers, so such migrations must call this again afterwards.
+    Does nothing on other backends.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for trigger in SQLITE_FTS_TRIGGERS:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5("
+        "text, content='pdf_processing_pdfpage', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    for trigger, body in SQLITE_FTS_TRIGGERS.items():
+        schema_editor.execute(f'CREATE TRIGGER {trigger} {body}')
+    schema_editor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _fts5_query(text):
+    """Quotes every term so user input can't be interpreted as FTS5 query syntax."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"' for term in terms if term)
+
+
+def find_matching_pages(user, text, limit):
+    """
+    Returns (document_id, page_number) pairs of the user's pages matching the
+    full-text query, best matches first.
+
+    Uses the FTS5 table on SQLite and the GIN-indexed tsvector on PostgreSQL
+    (see migration 0005); other backends fall back to a LIKE scan.
+    """
+    if connection.vendor == 'sqlite':
+        sql = (
+            "SELECT p.document_id, p.page_number "
+            "FROM pdf_processing_pdfpage_fts f "
+            "JOIN pdf_processing_pdfpage p ON p.id = f.rowid "
+            "JOIN pdf_processing_pdfdocument d ON d.id = p.document_id "
+            "WHERE pdf_processing_pdfpage_fts MATCH %s AND d.user_id = %s "
+            "ORDER BY f.rank LIMIT %s"
+        )
+        params = [_fts5_query(text), user.id, limit]
+    elif connection.vendor == 'postgresql':
+        sql = (
+            "SELECT p.document_id, p.page_number "
+            "FROM pdf_processing_pdfpage p "
+            "JOIN pdf_processing_pdfdocument d ON d.id = p.document_id "
+            "WHERE to_tsvector('simple', p.text) @@ plainto_tsquery('simple', %s) AND d.user_id = %s "
+            "ORDER BY ts_rank(to_tsvector('simple', p.text), plainto_tsquery('simple', %s)) DESC "
+            "LIMIT %s"
+        )
+        params = [text, user.id, text, limit]
+    else:
+        pages = PdfPage.objects.filter(document__user=user)
+        for term in text.split():
+            pages = pages.filter(text__icontains=term)
+        return list(pages.values_list('document_id', 'page_number')[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+def search_user_catalogs(user, text=None, min_value=None, max_value=None, currency=None, limit=100):
+    """
+    Searches all of a user's documents by page text and/or detected price.
+
+    Text-only queries return one hit per matching page. As soon as a price
+    constraint is given, hits are the matching PriceOccurrence rows (restricted
+    to pages that match the text, if any), so each hit has a bbox.
+
+    Returns:
+        list[dict]: Hits with document_id, file_name, page_number and, for price
+                    hits, bbox/raw_text/value/currency.
+    """
+    has_price_filter = any(v is not None for v in (min_value, max_value, currency))
+    matched_pages = find_matching_pages(user, text, limit if not has_price_filter else 10000) if text else None
+
+    if not has_price_filter:
+        file_names = dict(
+            user.pdf_documents.filter(id__in={doc_id for doc_id, _ in matched_pages})
+            .values_list('id', 'file_name')
+        )
+        return [
+            {'document_id': doc_id, 'file_name': file_names.get(doc_id), 'page_number': page_number}
+            for doc_id, page_number in matched_pages
+        ]
+
+    occurrences = PriceOccurrence.objects.filter(document__user=user).select_related('document')
+    if min_value is not None:
+        occurrences = occurrences.filter(value__gte=min_value)
+    if max_value is not None:
+        occurrences = occurrences.filter(value__lte=max_value)
+    if currency is not None:
+        occurrences = occurrences.filter(currency=currency)
+    if matched_pages is not None:
+        if not matched_pages:
+            return []
+        pages_by_document = {}
+        for doc_id, page_number in matched_pages:
+            pages_by_document.setdefault(doc_id, set()).add(page_number)
+        occurrences = occurrences.filter(document_id__in=pages_by_document)
+        hits = (
+            o for o in occurrences.order_by('document_id', 'page_number', 'y0', 'x0').iterator()
+            if o.page_number in pages_by_document[o.document_id]
+        )
+    else:
+        hits = occurrences.order_by('document_id', 'page_number', 'y0', 'x0')[:limit]
+
+    results = []
+    for occurrence in hits:
+        results.append({
+            'document_id': occurrence.document_id,
+            'file_name': occurrence.document.file_name,
+            **occurrence.to_dict(),
+        })
+        if len(results) >= limit:
+            break
+    return results
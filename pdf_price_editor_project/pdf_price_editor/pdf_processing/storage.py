@@ -0,0 +1,274 @@
+"""
+File storage for PDF documents: loading and storing through Django's storage
+API, a node-local read-through cache, and revision garbage collection.
+
+Documents live in the default storage, which is either the local MEDIA_ROOT or
+an S3-compatible object store (settings.PDF_STORAGE), so views and utils.py
+never use FieldFile.path. load_document() returns a source for
+utils.open_document() without reading the file into memory; files of remote
+storages are first fetched into a node-local disk cache, which is safe because
+stored names are never overwritten (every modification is saved under a new name).
+
+Every modified file written for a document is recorded as a PdfRevision (see
+PdfDocument.record_revision). collect_garbage() then:
+
+1. deletes all but the newest `keep` revisions of each document (never the
+   document's current modified_file), and
+2. walks the user_<id>/ directories of the storage (with os.scandir on local
+   disk), checking the files it finds against the database one batch at a
+   time, and deletes the ones no document or revision references.
+
+Files younger than min_age seconds are never deleted, so files that are being
+written while the collector runs are safe. Run it from cron through
+`python manage.py collect_media_garbage`.
+"""
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import Count
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from .models import PdfDocument, PdfRevision
+
+
+logger = logging.getLogger(__name__)
+
+USER_DIRECTORY = re.compile(r'^user_\d+$') # Only directories this app writes to are scanned
+
+
+def is_local(storage):
+    """
+    True for storages backed by the local filesystem. Storage.path() can't tell:
+    some storages without local files (e.g. InMemoryStorage) still implement it.
+    """
+    return isinstance(storage, FileSystemStorage)
+
+
+class ReadThroughCache:
+    """
+    Node-local disk cache for documents of a remote storage. Entries are keyed by
+    storage name and never go stale, because stored names are never reused; the
+    least recently read entries are evicted once the cache outgrows max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+
+    def entry_path(self, name):
+        return os.path.join(self.directory, hashlib.sha256(name.encode()).hexdigest() + '.pdf')
+
+    def fetch(self, storage, name):
+        """Returns the path of the local copy of name, downloading it on a miss."""
+        path = self.entry_path(name)
+        try:
+            os.utime(path) # mtime doubles as the last-read time for eviction
+            return path
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with storage.open(name, 'rb') as source, open(temp_path, 'wb') as f:
+            shutil.copyfileobj(source, f, 1024 * 1024) # Streamed, never held in memory
+        os.replace(temp_path, path) # Atomic, so concurrent readers never see partial entries
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def document_cache():
+    return ReadThroughCache(settings.PDF_STORAGE_CACHE_DIR, settings.PDF_STORAGE_CACHE_MAX_BYTES)
+
+
+def document_path(field_file):
+    """
+    Returns a node-local path of a FieldFile (e.g. PdfDocument.uploaded_file),
+    fetching remote files into the read-through cache first, or None if there
+    is no such file. Paths, unlike buffers, can be handed to worker processes.
+    """
+    if not field_file:
+        return None
+    storage = field_file.storage
+    try:
+        if is_local(storage):
+            path = storage.path(field_file.name)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+            return path
+        return document_cache().fetch(storage, field_file.name)
+    except FileNotFoundError:
+        logger.error("Stored file %s not found", field_file.name)
+        return None
+
+
+def load_document(field_file):
+    """
+    Returns a source for utils.open_document() for a FieldFile, or None if there
+    is no such file. The file is never read into a bytes object: see
+    utils.map_document().
+    """
+    from .utils import map_document # Keeps PyMuPDF out of the URLconf import
+
+    path = document_path(field_file)
+    return map_document(path) if path is not None else None
+
+
+def scratch_path(suffix='.pdf'):
+    """Returns the path of a new empty node-local file for utils.py to write to."""
+    fd, path = tempfile.mkstemp(prefix='pdf_', suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def store_file(name, local_path, storage=None):
+    """Saves a local file to the storage under name (or a free variant of it); returns the stored name."""
+    storage = storage or default_storage
+    with open(local_path, 'rb') as f:
+        return storage.save(name, File(f, name=os.path.basename(name)))
+
+
+def _iter_local_files(root):
+    try:
+        top_level = [entry.path for entry in os.scandir(root) if entry.is_dir() and USER_DIRECTORY.match(entry.name)]
+    except FileNotFoundError:
+        return
+    pending = top_level
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        relative_name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        yield relative_name, stat.st_size, stat.st_mtime
+        except FileNotFoundError:
+            continue # Removed while scanning
+
+
+def _iter_remote_files(storage):
+    directories, _ = storage.listdir('')
+    pending = [d for d in directories if USER_DIRECTORY.match(d)]
+    while pending:
+        directory = pending.pop()
+        subdirectories, files = storage.listdir(directory)
+        pending.extend(f"{directory}/{d}" for d in subdirectories)
+        for file_name in files:
+            name = f"{directory}/{file_name}"
+            yield name, storage.size(name), storage.get_modified_time(name).timestamp()
+
+
+def iter_media_batches(storage, batch_size=1000):
+    """
+    Yields lists of up to batch_size (name, size_bytes, mtime) tuples for the
+    files under the storage's user_<id>/ directories. On local disk this uses
+    os.scandir, whose directory entries carry their type, so only files are stat()ed.
+    """
+    files = _iter_local_files(storage.path('')) if is_local(storage) else _iter_remote_files(storage)
+    batch = []
+    for item in files:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def referenced_names(names):
+    """Returns the subset of storage names that a document or revision refers to."""
+    names = list(names)
+    referenced = set(PdfDocument.objects.filter(uploaded_file__in=names).values_list('uploaded_file', flat=True))
+    referenced.update(PdfDocument.objects.filter(modified_file__in=names).values_list('modified_file', flat=True))
+    referenced.update(PdfRevision.objects.filter(file__in=names).values_list('file', flat=True))
+    return referenced
+
+
+def prune_revisions(keep, storage=None, dry_run=False):
+    """
+    Deletes all but the newest `keep` revisions (rows and files) of every document.
+    The document's current modified_file is always kept.
+
+    Returns:
+        tuple[int, int]: Revisions pruned and bytes reclaimed.
+    """
+    storage = storage or default_storage
+    pruned = reclaimed = 0
+    crowded = (
+        PdfDocument.objects.annotate(revision_count=Count('revisions'))
+        .filter(revision_count__gt=keep).values_list('id', 'modified_file')
+    )
+    for document_id, current_file in crowded.iterator():
+        superseded = (
+            PdfRevision.objects.filter(document_id=document_id).exclude(file=current_file)
+            .order_by('-created', '-id')[max(keep - 1, 0) if current_file else keep:]
+        )
+        for revision in list(superseded):
+            if not dry_run:
+                if revision.file.name:
+                    storage.delete(revision.file.name)
+                revision.delete()
+            reclaimed += revision.size_bytes or 0
+            pruned += 1
+    return pruned, reclaimed
+
+
+def collect_garbage(keep=None, batch_size=1000, min_age=3600, storage=None, dry_run=False):
+    """
+    Prunes superseded revisions, then deletes unreferenced files from the
+    storage (the default storage unless given). See the module docstring.
+
+    Returns:
+        dict: revisions_pruned, files_scanned, orphans_deleted and bytes_reclaimed.
+    """
+    storage = storage or default_storage
+    keep = settings.PDF_KEEP_REVISIONS if keep is None else keep
+    revisions_pruned, bytes_reclaimed = prune_revisions(keep, storage=storage, dry_run=dry_run)
+
+    cutoff = time.time() - min_age
+    files_scanned = orphans_deleted = 0
+    for batch in iter_media_batches(storage, batch_size):
+        files_scanned += len(batch)
+        referenced = referenced_names(name for name, _, _ in batch)
+        for name, size_bytes, mtime in batch:
+            if name in referenced or mtime > cutoff:
+                continue
+            if not dry_run:
+                storage.delete(name)
+            logger.info("%s orphaned media file %s (%s bytes)", 'Would delete' if dry_run else 'Deleted', name, size_bytes)
+            orphans_deleted += 1
+            bytes_reclaimed += size_bytes
+
+    return {
+        'revisions_pruned': revisions_pruned,
+        'files_scanned': files_scanned,
+        'orphans_deleted': orphans_deleted,
+        'bytes_reclaimed': bytes_reclaimed,
+        'dry_run': dry_run,
+    }
@@ -1,3 +1,1120 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+import fitz
+import os
+import shutil
+import tempfile
+import warnings
 
-# Create your tests here.
+from .models import PdfDocument
+
+
+TEST_MEDIA_ROOT = tempfile.mkdtemp()
+# The pipeline and document caches, kept out of the project's cache directory.
+# The pool's worker processes take their settings from the environment, so
+# the directories are set there too, before a test starts the pool.
+TEST_CACHE_ROOT = tempfile.mkdtemp()
+TEST_CACHE_SETTINGS = {
+    'PDF_PIPELINE_CACHE_DIR': os.path.join(TEST_CACHE_ROOT, 'pipeline'),
+    'PDF_STORAGE_CACHE_DIR': os.path.join(TEST_CACHE_ROOT, 'documents'),
+}
+os.environ.update(TEST_CACHE_SETTINGS)
+
+
+def make_catalog_pdf(pages):
+    """Builds an in-memory PDF; pages is a list of lists of text lines."""
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((50, 60 + i * 20), line, fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class PdfDocumentTransitionTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.doc = PdfDocument.objects.create(
+            user=self.user,
+            uploaded_file=SimpleUploadedFile('catalog.pdf', b'%PDF-1.4\n'),
+            extracted_text='x' * 1000,
+        )
+
+    def test_transition_writes_only_status_and_given_fields(self):
+        stale = PdfDocument.objects.get(pk=self.doc.pk)
+        stale.extracted_text = 'not saved'
+
+        self.assertTrue(stale.mark_completed(modified_file='user_1/pdfs/modified/a.pdf'))
+
+        fresh = PdfDocument.objects.get(pk=self.doc.pk)
+        self.assertEqual(fresh.status, 'completed')
+        self.assertEqual(fresh.modified_file.name, 'user_1/pdfs/modified/a.pdf')
+        self.assertEqual(fresh.extracted_text, 'x' * 1000)
+
+    def test_guarded_transition_does_not_clobber_concurrent_update(self):
+        worker_a = PdfDocument.objects.get(pk=self.doc.pk)
+        worker_b = PdfDocument.objects.get(pk=self.doc.pk)
+
+        self.assertTrue(worker_a.start_processing())
+        self.assertFalse(worker_b.start_processing())
+        self.assertFalse(worker_b.mark_failed(expected_status='uploaded'))
+
+        self.assertTrue(worker_a.mark_completed(expected_status='processing'))
+        self.assertEqual(PdfDocument.objects.get(pk=self.doc.pk).status, 'completed')
+
+    def test_document_already_processing_cannot_be_claimed(self):
+        self.assertTrue(self.doc.start_processing())
+        request_a = PdfDocument.objects.get(pk=self.doc.pk)
+        request_b = PdfDocument.objects.get(pk=self.doc.pk)
+
+        self.assertFalse(request_a.start_processing())
+        self.assertFalse(request_b.start_processing())
+
+        self.client.force_login(self.user)
+        for _ in range(2):
+            response = self.client.post(f'/api/pdf/{self.doc.pk}/extract-text')
+            self.assertEqual(response.status_code, 409)
+        self.assertEqual(PdfDocument.objects.get(pk=self.doc.pk).status, 'processing')
+
+    def test_stale_processing_claim_is_taken_over_once(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        self.assertTrue(self.doc.start_processing())
+        # The request holding the claim was interrupted two hours ago
+        PdfDocument.objects.filter(pk=self.doc.pk).update(processing_started=timezone.now() - timedelta(hours=2))
+        request_a = PdfDocument.objects.get(pk=self.doc.pk)
+        request_b = PdfDocument.objects.get(pk=self.doc.pk)
+
+        self.assertTrue(request_a.start_processing())
+        self.assertFalse(request_b.start_processing())
+        self.assertTrue(request_a.mark_completed(expected_status='processing'))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class PriceIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bob', password='secret')
+        self.client.force_login(self.user)
+        pdf_bytes = make_catalog_pdf([
+            ['Chair $12.50', 'Table $120.00'],
+            ['Lamp 45,90 EUR', 'Sofa $1,299.00'],
+        ])
+        self.doc = PdfDocument.objects.create(
+            user=self.user,
+            uploaded_file=SimpleUploadedFile('catalog.pdf', pdf_bytes),
+        )
+
+    def test_extraction_builds_index_and_identify_filters_it(self):
+        response = self.client.post(f'/api/pdf/{self.doc.id}/extract-text')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.doc.price_occurrences.count(), 4)
+
+        response = self.client.get(
+            f'/api/pdf/{self.doc.id}/identify-prices',
+            {'currency': 'usd', 'min_value': '100', 'sort': '-value'},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual([p['raw_text'] for p in data['identified_prices']], ['$1,299.00', '$120.00'])
+        self.assertEqual(data['identified_prices'][1]['page_number'], 0)
+
+    def test_identify_only_queries_the_index(self):
+        response = self.client.get(f'/api/pdf/{self.doc.id}/identify-prices')
+        self.assertEqual(response.status_code, 400)
+
+        # Extracted before the price index existed: extract-text has to index it
+        PdfDocument.objects.filter(pk=self.doc.pk).update(extracted_text='Chair $12.50')
+        response = self.client.get(f'/api/pdf/{self.doc.id}/identify-prices')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.doc.price_occurrences.count(), 0)
+        self.assertEqual(PdfDocument.objects.get(pk=self.doc.pk).status, 'uploaded')
+
+    def test_identify_rejects_invalid_filters(self):
+        self.client.post(f'/api/pdf/{self.doc.id}/extract-text')
+        response = self.client.get(f'/api/pdf/{self.doc.id}/identify-prices', {'sort': 'size'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='carol', password='secret')
+        self.client.force_login(self.user)
+        catalogs = [
+            [['Oak chair $49.00', 'Pine table $120.00'], ['Oak table $310.00']],
+            [['Steel chair $55.00']],
+        ]
+        for i, pages in enumerate(catalogs):
+            doc = PdfDocument.objects.create(
+                user=self.user,
+                uploaded_file=SimpleUploadedFile(f'catalog{i}.pdf', make_catalog_pdf(pages)),
+            )
+            self.client.post(f'/api/pdf/{doc.id}/extract-text')
+
+    def test_text_search_returns_pages_across_documents(self):
+        hits = self.client.get('/api/pdf/search', {'q': 'chair'}).json()['hits']
+        self.assertEqual(len(hits), 2)
+
+    def test_text_and_price_search_returns_price_boxes(self):
+        hits = self.client.get('/api/pdf/search', {'q': 'oak', 'min_value': '100'}).json()['hits']
+        self.assertEqual(sorted(h['raw_text'] for h in hits), ['$120.00', '$310.00'])
+        self.assertEqual(len(hits[0]['bbox']), 4)
+
+    def test_other_users_documents_are_not_searched(self):
+        other = User.objects.create_user(username='dave', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get('/api/pdf/search', {'q': 'chair'}).json()['hits'], [])
+
+
+class IncrementalExtractionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='erin', password='secret')
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+    def write_pdf(self, name, pages):
+        path = f'{self.tmpdir}/{name}'
+        with open(path, 'wb') as f:
+            f.write(make_catalog_pdf(pages))
+        return path
+
+    def test_only_changed_pages_are_reextracted(self):
+        from .utils import extract_pages_from_pdf
+
+        pages = [[f'Item {i} ${i}0.00'] for i in range(1, 6)]
+        original = self.write_pdf('original.pdf', pages)
+        pages[2] = ['Item 3 $99.00']
+        changed = self.write_pdf('changed.pdf', pages)
+
+        doc = PdfDocument.objects.create(user=self.user, uploaded_file='unused.pdf')
+        doc.store_extraction(extract_pages_from_pdf(original))
+
+        result = extract_pages_from_pdf(changed, known_pages=doc.known_page_hashes())
+        self.assertEqual([p['page_number'] for p in result if 'reuse_from' not in p], [2])
+
+        stats = doc.store_extraction(result)
+        self.assertEqual(stats, {'pages_extracted': 1, 'pages_reused': 4})
+        self.assertEqual(
+            list(doc.price_occurrences.order_by('page_number').values_list('raw_text', flat=True)),
+            ['$10.00', '$20.00', '$99.00', '$40.00', '$50.00'],
+        )
+        self.assertIn('Item 1', ''.join(p['text'] for p in result))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, PDF_METRICS_ENABLED=True)
+class InstrumentationTests(TestCase):
+    def test_phases_reported_in_server_timing_and_metrics(self):
+        user = User.objects.create_user(username='frank', password='secret')
+        self.client.force_login(user)
+        doc = PdfDocument.objects.create(
+            user=user, uploaded_file=SimpleUploadedFile('c.pdf', make_catalog_pdf([['Desk $80.00']])),
+        )
+        response = self.client.post(f'/api/pdf/{doc.id}/extract-text')
+        self.assertIn('open;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+        metrics = self.client.get('/api/pdf/metrics').content.decode()
+        self.assertIn('pdf_request_duration_seconds_count{endpoint="extract_pdf_text"}', metrics)
+        self.assertIn('phase="detect_prices"', metrics)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        from . import profiling
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        saved = dict(profiling._config)
+        self.addCleanup(profiling._config.update, saved)
+        profiling.configure(output_dir=self.profile_dir, slow_threshold=None)
+
+    def captures(self, extension):
+        import os
+        return [name for name in os.listdir(self.profile_dir) if name.endswith(extension)]
+
+    def test_staff_header_captures_cprofile_with_document_digest(self):
+        import json
+        import os
+        staff = User.objects.create_user(username='gina', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        doc = PdfDocument.objects.create(
+            user=staff, uploaded_file=SimpleUploadedFile('p.pdf', make_catalog_pdf([['Rug $15.00']])),
+        )
+        response = self.client.post(f'/api/pdf/{doc.id}/extract-text', HTTP_X_PDF_PROFILE='1')
+        self.assertEqual(response['X-PDF-Profile'], 'captured')
+        self.assertEqual(len(self.captures('.prof')), 1)
+        with open(os.path.join(self.profile_dir, self.captures('.json')[0])) as f:
+            self.assertEqual(len(json.load(f)['document_sha256']), 64)
+
+    def test_header_is_ignored_for_non_staff(self):
+        user = User.objects.create_user(username='hank', password='secret')
+        self.client.force_login(user)
+        doc = PdfDocument.objects.create(
+            user=user, uploaded_file=SimpleUploadedFile('p.pdf', make_catalog_pdf([['Rug $15.00']])),
+        )
+        self.client.post(f'/api/pdf/{doc.id}/extract-text', HTTP_X_PDF_PROFILE='1')
+        self.assertEqual(self.captures('.prof'), [])
+
+    def test_watchdog_samples_only_operations_over_threshold(self):
+        import time
+        from .profiling import configure, profiled
+
+        configure(output_dir=self.profile_dir, slow_threshold=0.05, sample_interval=0.005)
+
+        @profiled('sleepy')
+        def operation(pdf_path, seconds):
+            time.sleep(seconds)
+
+        operation('/nonexistent.pdf', 0)
+        self.assertEqual(self.captures('.folded'), [])
+        operation('/nonexistent.pdf', 0.2)
+        self.assertEqual(len(self.captures('.folded')), 1)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class SaveProfileTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ivan', password='secret')
+        self.client.force_login(self.user)
+        self.doc = PdfDocument.objects.create(
+            user=self.user, uploaded_file=SimpleUploadedFile('s.pdf', make_catalog_pdf([['Lamp $25.00']] * 3)),
+        )
+
+    def replace(self, **extra):
+        import json
+        payload = {
+            'page_number': 0, 'x1': 48, 'y1': 45, 'x2': 200, 'y2': 65,
+            'percentage_increase': 10, 'original_price_text': '$25.00', 'style_info': {'size': 10},
+            **extra,
+        }
+        return self.client.post(f'/api/pdf/{self.doc.id}/replace-text-region', json.dumps(payload),
+                                content_type='application/json')
+
+    def test_fast_profile_appends_an_incremental_update(self):
+        response = self.replace(save_profile='fast')
+        self.assertEqual(response.status_code, 200)
+        save = response.json()['save']
+        self.assertEqual((save['profile'], save['incremental']), ('fast', True))
+
+        self.doc.refresh_from_db()
+        with open(self.doc.uploaded_file.path, 'rb') as f:
+            original = f.read()
+        with open(self.doc.modified_file.path, 'rb') as f:
+            self.assertTrue(f.read().startswith(original))
+
+    def test_user_default_profile_and_unknown_profile(self):
+        self.user.profile.pdf_save_profile = 'compact'
+        self.user.profile.save()
+        save = self.replace().json()['save']
+        self.assertEqual((save['profile'], save['incremental']), ('compact', False))
+        self.assertGreater(save['output_bytes'], 0)
+
+        self.assertEqual(self.replace(save_profile='tiny').status_code, 400)
+        self.assertEqual(self.replace(save_profile={'name': 'fast'}).status_code, 400)
+
+    def test_profile_save_profile_is_validated(self):
+        import json
+
+        def update(value):
+            return self.client.put('/api/users/profile/update', json.dumps({'pdf_save_profile': value}),
+                                   content_type='application/json')
+
+        self.assertEqual(update('compact').status_code, 200)
+        self.assertEqual(update(['fast']).status_code, 400)
+        self.assertEqual(update('tiny').status_code, 400)
+        self.assertEqual(update(None).status_code, 200) # Back to the site default
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.pdf_save_profile, '')
+
+
+class OptimizePdfTests(TestCase):
+    def test_merges_duplicate_fonts_downsamples_images_and_linearizes(self):
+        import os
+        from .utils import optimize_pdf
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, 'heavy.pdf')
+        doc = fitz.open()
+        scan = doc.new_page().get_pixmap(dpi=300)
+        for _ in range(3):
+            # Separate sources, like separate edits, give each page its own font dict
+            source = fitz.open()
+            page = source.new_page()
+            page.insert_text((50, 60), 'Sofa $499.00', fontname='helv')
+            doc.insert_pdf(source)
+            doc[-1].insert_image(fitz.Rect(0, 100, 200, 300), pixmap=scan) # ~900 dpi
+        doc.save(path) # No compression
+        doc.close()
+
+        stats = optimize_pdf(path, target_dpi=100)
+        self.assertEqual(stats['duplicates_merged']['fonts'], 2)
+        self.assertEqual(stats['images_downsampled'], 1)
+        self.assertGreater(stats['bytes_saved'], 0)
+        self.assertEqual(stats['output_bytes'], os.path.getsize(path))
+        with fitz.open(path) as optimized:
+            self.assertTrue(optimized.is_fast_webaccess)
+            self.assertIn('Sofa $499.00', optimized[1].get_text())
+
+
+class MediaGarbageCollectionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='jane', password='secret')
+
+    def write(self, name, age=7200):
+        import os
+        import time
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + name.encode())
+        os.utime(path, (time.time() - age,) * 2)
+        return name
+
+    def test_keeps_newest_revisions_and_referenced_files_only(self):
+        import os
+        from .storage import collect_garbage
+
+        doc = PdfDocument.objects.create(user=self.user, uploaded_file=self.write('user_1/pdfs/c.pdf'))
+        for i in range(4):
+            name = self.write(f'user_1/pdfs/modified/c_mod_{i}.pdf')
+            doc.mark_completed(modified_file=name)
+            doc.record_revision(name)
+        self.write('user_1/pdfs/modified/orphan.pdf')
+        self.write('user_1/pdfs/modified/just_written.pdf', age=0)
+        self.write('other_app/keep.bin')
+
+        stats = collect_garbage(keep=2, batch_size=2, min_age=3600)
+        self.assertEqual((stats['revisions_pruned'], stats['orphans_deleted']), (2, 1))
+        self.assertEqual(
+            list(doc.revisions.order_by('created', 'id').values_list('file', flat=True)),
+            ['user_1/pdfs/modified/c_mod_2.pdf', 'user_1/pdfs/modified/c_mod_3.pdf'],
+        )
+        remaining = sorted(
+            os.path.relpath(os.path.join(d, f), self.media_root)
+            for d, _, files in os.walk(self.media_root) for f in files
+        )
+        self.assertEqual(remaining, [
+            'other_app/keep.bin', 'user_1/pdfs/c.pdf',
+            'user_1/pdfs/modified/c_mod_2.pdf', 'user_1/pdfs/modified/c_mod_3.pdf',
+            'user_1/pdfs/modified/just_written.pdf',
+        ])
+
+
+class RemoteStorageTests(TestCase):
+    """InMemoryStorage stands in for an S3-compatible store: it has no local paths."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        override = override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            PDF_STORAGE_CACHE_DIR=self.cache_dir,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='kyle', password='secret')
+        self.client.force_login(self.user)
+
+    def test_documents_are_processed_without_local_paths(self):
+        import json
+        import os
+        upload = SimpleUploadedFile('remote.pdf', make_catalog_pdf([['Bench $40.00'], ['Stool $12.00']]))
+        document_id = self.client.post('/api/pdf/upload', {'file': upload}).json()['document_id']
+
+        response = self.client.post(f'/api/pdf/{document_id}/extract-text')
+        self.assertEqual(response.json()['prices_found'], 2)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1) # Fetched once, then read from the cache
+
+        response = self.client.post(
+            f'/api/pdf/{document_id}/replace-text-region',
+            json.dumps({'page_number': 0, 'x1': 48, 'y1': 45, 'x2': 200, 'y2': 65, 'percentage_increase': 50,
+                        'original_price_text': '$40.00', 'style_info': {'size': 10}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        download = self.client.get(f'/api/pdf/{document_id}/download')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # The sync test client consumes the async stream
+            content = b''.join(download)
+        self.assertEqual(int(download['Content-Length']), len(content))
+        with fitz.open(stream=content, filetype='pdf') as doc:
+            self.assertIn('$60.00', doc[0].get_text())
+
+
+class DocumentMappingTests(TestCase):
+    def test_concurrent_opens_share_one_mapping(self):
+        import os
+        from .utils import SharedMappings, map_document, open_document, pymupdf_accepts_buffers
+
+        fd, path = tempfile.mkstemp(suffix='.pdf')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(make_catalog_pdf([['Mirror $70.00']]))
+
+        mappings = SharedMappings(max_open=1)
+        first, second = mappings.view(path), mappings.view(path)
+        self.assertIs(first.obj, second.obj)
+        self.assertEqual(bytes(first[:5]), b'%PDF-')
+
+        # Without buffer support in PyMuPDF the path is handed over instead of a copy
+        source = map_document(path)
+        self.assertIsInstance(source, memoryview if pymupdf_accepts_buffers() else str)
+        with open_document(source) as doc:
+            self.assertIn('Mirror $70.00', doc[0].get_text())
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class WorkerPoolTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lena', password='secret')
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile('pool.pdf', make_catalog_pdf([['Lamp $25.00']]))
+        self.document_id = self.client.post('/api/pdf/upload', {'file': upload}).json()['document_id']
+
+    def test_extraction_runs_in_worker_and_status_reports_it(self):
+        response = self.client.post(f'/api/pdf/{self.document_id}/extract-text')
+        self.assertEqual(response.json()['prices_found'], 1)
+        self.assertIn('open;dur=', response['Server-Timing']) # Timed in the worker process
+
+        status = self.client.get(f'/api/pdf/{self.document_id}/status').json()
+        self.assertEqual(status['status'], 'completed')
+        self.assertFalse(status['has_modified_file'])
+        self.assertIsNotNone(status['prices_indexed_at'])
+
+    def test_full_pool_answers_503_with_retry_after(self):
+        from unittest import mock
+        from . import workers
+
+        with mock.patch.object(workers, '_pending', workers.max_pending()):
+            response = self.client.post(f'/api/pdf/{self.document_id}/extract-text')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        # The claim on the document is released for the retry
+        self.assertEqual(PdfDocument.objects.get(id=self.document_id).status, 'uploaded')
+
+    def test_crashed_worker_and_failed_store_release_the_claim(self):
+        from concurrent.futures.process import BrokenProcessPool
+        from unittest import mock
+
+        with mock.patch('pdf_processing.views.run_in_worker', mock.AsyncMock(side_effect=BrokenProcessPool())):
+            response = self.client.post(f'/api/pdf/{self.document_id}/extract-text')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(PdfDocument.objects.get(id=self.document_id).status, 'uploaded')
+
+        with mock.patch.object(PdfDocument, 'store_extraction', side_effect=RuntimeError('disk full')):
+            response = self.client.post(f'/api/pdf/{self.document_id}/extract-text')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(PdfDocument.objects.get(id=self.document_id).status, 'failed')
+
+
+class AdmissionControlTests(TestCase):
+    def test_waiting_users_are_served_fairly(self):
+        import asyncio
+        from .admission import AdmissionController
+
+        controller = AdmissionController(global_slots=1, user_slots=1, max_wait=5, user_queue=10)
+        order = []
+
+        async def operation(user_key, name):
+            ticket = await controller.acquire(user_key, 'ocr')
+            order.append(name)
+            await asyncio.sleep(0.01)
+            controller.release(ticket)
+
+        async def scenario():
+            first = await controller.acquire('a', 'ocr') # Holds the only slot
+            tasks = [asyncio.create_task(operation('a', f'a{i}')) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(operation('b', 'b0')))
+            await asyncio.sleep(0)
+            controller.release(first)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(scenario())
+        # b arrived after a's backlog but does not wait behind all of it
+        self.assertLess(order.index('b0'), order.index('a2'))
+        self.assertEqual(controller.queue_depth(), 0)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, PDF_ADMISSION_USER_SLOTS=1, PDF_ADMISSION_USER_QUEUE=0)
+    def test_user_over_limit_gets_429_with_retry_after(self):
+        import asyncio
+        import json
+        from .admission import get_controller
+        from .instrumentation import registry
+
+        user = User.objects.create_user(username='mira', password='secret')
+        self.client.force_login(user)
+        upload = SimpleUploadedFile('busy.pdf', make_catalog_pdf([['Rug $80.00']]))
+        document_id = self.client.post('/api/pdf/upload', {'file': upload}).json()['document_id']
+
+        controller = get_controller()
+        ticket = asyncio.run(controller.acquire(user.pk, 'ocr')) # The user's only slot is taken
+        try:
+            response = self.client.post(
+                f'/api/pdf/{document_id}/analyze-style-region',
+                json.dumps({'page_number': 0, 'x1': 48, 'y1': 45, 'x2': 200, 'y2': 65}),
+                content_type='application/json',
+            )
+        finally:
+            controller.release(ticket)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(registry.value('pdf_admission_rejected_total',
+                                        {'operation': 'style', 'reason': 'user_queue_full'}), 1)
+        self.assertIn('pdf_admission_queue_depth 0', registry.render_prometheus())
+
+
+class PriceFormatTests(TestCase):
+    def test_parses_locales_exactly_and_rejects_garbage(self):
+        from decimal import Decimal
+        from .pricing import parse_price
+
+        self.assertEqual(parse_price('$1,234.56'), Decimal('1234.56'))
+        self.assertEqual(parse_price('1.234,56 €'), Decimal('1234.56'))
+        self.assertEqual(parse_price('1\u00a0234,56 грн'), Decimal('1234.56'))
+        self.assertIsNone(parse_price('SKU-12A'))
+        self.assertIsNone(parse_price('1,23,4'))
+
+    def test_learned_format_reprices_with_separators_and_ending(self):
+        from decimal import Decimal
+        from .pricing import learn_price_formats, reprice
+
+        texts = ['1 299,99 грн', '2 499,99 грн', '99,99 грн', '1.234 грн', '$5.00']
+        formats = learn_price_formats(texts)
+        self.assertEqual(formats['грн'].thousands_separator, ' ')
+        self.assertEqual(formats['грн'].decimal_separator, ',')
+        self.assertEqual(formats['грн'].ending, '99')
+        results = reprice(['1 299,99 грн', '$5.00', 'n/a'], Decimal('1.1'), formats)
+        self.assertEqual(results[0], (Decimal('1429.99'), '1 429,99 грн'))
+        self.assertEqual(results[1], (Decimal('5.50'), '$5.50'))
+        self.assertEqual(results[2], (None, None))
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_replace_uses_the_documents_format(self):
+        import json
+        user = User.objects.create_user(username='oksana', password='secret')
+        self.client.force_login(user)
+        pdf = make_catalog_pdf([['Chair 1.299,00 EUR', 'Desk 2.450,00 EUR', 'Lamp 1.234 EUR']])
+        document_id = self.client.post('/api/pdf/upload', {'file': SimpleUploadedFile('eu.pdf', pdf)}).json()['document_id']
+        self.client.post(f'/api/pdf/{document_id}/extract-text')
+        # "1.234" alone is ambiguous; the document's other prices show '.' groups thousands
+        values = set(PdfDocument.objects.get(id=document_id).price_occurrences.values_list('value', flat=True))
+        self.assertIn(1234, values)
+
+        response = self.client.post(
+            f'/api/pdf/{document_id}/replace-text-region',
+            json.dumps({'page_number': 0, 'x1': 48, 'y1': 45, 'x2': 200, 'y2': 65, 'percentage_increase': 10.1,
+                        'original_price_text': '1.299,00 EUR', 'style_info': {'size': 10}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['new_price_text'], '1.430,20 EUR')
+
+
+class RepricingRuleTests(TestCase):
+    def test_rules_apply_per_currency_with_clamps_rounding_and_overrides(self):
+        from decimal import Decimal
+        from .pricing import learn_price_formats
+        from .repricing import RuleSet
+
+        prices = [
+            {'page_number': 0, 'raw_text': '$10.00', 'value': Decimal('10'), 'currency': 'USD'},
+            {'page_number': 0, 'raw_text': '$1.00', 'value': Decimal('1'), 'currency': 'USD'},
+            {'page_number': 0, 'raw_text': '1 299,99 грн', 'value': Decimal('1299.99'), 'currency': 'UAH'},
+            {'page_number': 5, 'raw_text': '$10.00', 'value': Decimal('10'), 'currency': 'USD'},
+            {'page_number': 0, 'raw_text': 'SKU', 'value': None, 'currency': ''},
+        ]
+        rules = RuleSet.from_dict({
+            'multiplier': {'USD': 1.1, '*': 1},
+            'markup': {'UAH': 100},
+            'min': {'USD': 2},
+            'rounding': '99',
+            'overrides': [{'page_range': [5, 9], 'multiplier': 2, 'rounding': 'none'}],
+        })
+        results = rules.evaluate(prices, learn_price_formats([price['raw_text'] for price in prices]))
+        self.assertEqual([text for _, text in results],
+                         ['$10.99', '$1.99', '1 399,99 грн', '$20.00', None])
+
+    def test_invalid_rules_are_rejected(self):
+        from .repricing import RuleSet
+
+        for rules in ({'multiplier': 'x'}, {'bogus': 1}, {'overrides': [{'multiplier': 2}]}, {'rounding': 'up'}):
+            with self.assertRaises(ValueError):
+                RuleSet.from_dict(rules)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_preview_endpoint_lists_every_price_without_writing(self):
+        import json
+        user = User.objects.create_user(username='petro', password='secret')
+        self.client.force_login(user)
+        pdf = make_catalog_pdf([['Chair $40.00', 'Desk $125.50'], ['Lamp $9.99']])
+        document_id = self.client.post('/api/pdf/upload', {'file': SimpleUploadedFile('r.pdf', pdf)}).json()['document_id']
+        self.client.post(f'/api/pdf/{document_id}/extract-text')
+
+        response = self.client.post(
+            f'/api/pdf/{document_id}/reprice-preview',
+            json.dumps({'rules': {'multiplier': 1.1, 'overrides': [{'pages': [1], 'multiplier': 1}]}}),
+            content_type='application/json',
+        )
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['old_text'], row['new_text']) for row in data['prices']],
+                         [('$40.00', '$44.00'), ('$125.50', '$138.05'), ('$9.99', '$9.99')])
+        self.assertEqual(data['changed'], 2)
+        self.assertEqual(data['totals']['USD']['after'], '192.04')
+        self.assertFalse(PdfDocument.objects.get(id=document_id).modified_file)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class RepriceDiffTests(TestCase):
+    def test_diff_flags_overflow_and_renders_crops_without_saving(self):
+        import base64
+        import json
+        user = User.objects.create_user(username='taras', password='secret')
+        self.client.force_login(user)
+        pdf = make_catalog_pdf([['Chair $40.00', 'Desk $9.99'], ['Lamp $5.00']])
+        document_id = self.client.post('/api/pdf/upload', {'file': SimpleUploadedFile('d.pdf', pdf)}).json()['document_id']
+        self.client.post(f'/api/pdf/{document_id}/extract-text')
+
+        response = self.client.post(
+            f'/api/pdf/{document_id}/reprice-diff',
+            json.dumps({'rules': {'multiplier': 1, 'overrides': [
+                {'pages': [0], 'multiplier': 1000}, # $40.00 -> $40000.00 no longer fits its box
+            ]}, 'max_crops': 1}),
+            content_type='application/json',
+        )
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['total'], data['changed'], data['overflowing']), (3, 2, 2))
+        first, second = data['diff']
+        self.assertEqual((first['old_text'], first['new_text']), ('$40.00', '$40000.00'))
+        self.assertGreater(first['overflow'], 0)
+        png = base64.b64decode(first['before'].split(',', 1)[1])
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertNotEqual(first['before'], first['after'])
+        self.assertIsNone(second['before']) # Beyond max_crops
+        self.assertFalse(PdfDocument.objects.get(id=document_id).modified_file)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, **TEST_CACHE_SETTINGS)
+class BatchTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEST_CACHE_ROOT, ignore_errors=True)
+
+    def test_batch_reprices_documents_and_streams_zip(self):
+        from asgiref.sync import async_to_sync
+        from unittest import mock
+        import io
+        import json
+        import zipfile
+        from . import batches
+
+        user = User.objects.create_user(username='olena', password='secret')
+        self.client.force_login(user)
+        document_ids = [
+            self.client.post('/api/pdf/upload', {'file': SimpleUploadedFile(name, make_catalog_pdf(pages))}).json()['document_id']
+            for name, pages in (('a.pdf', [['Chair $40.00', 'Desk $10.00']]), ('b.pdf', [['Lamp $5.00']]))
+        ]
+
+        with mock.patch.object(batches, 'start_batch') as start_batch:
+            response = self.client.post('/api/pdf/batches', json.dumps({
+                'document_ids': document_ids, 'rules': {'multiplier': 2},
+            }), content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        batch_id = response.json()['batch_id']
+        response = self.client.post('/api/pdf/batches', json.dumps({
+            'document_ids': document_ids, 'save_profile': ['fast'],
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        start_batch.assert_called_once_with(batch_id)
+        self.assertEqual(self.client.get(f'/api/pdf/batches/{batch_id}/download').status_code, 409)
+
+        # Run the batch on this thread, where the test's data is visible
+        async_to_sync(batches.run_batch)(batch_id)
+
+        status = self.client.get(f'/api/pdf/batches/{batch_id}').json()
+        self.assertEqual((status['status'], status['progress'], status['stages']), ('completed', 1.0, {'done': 2}))
+        self.assertEqual([(d['prices_found'], d['prices_changed']) for d in status['documents']], [(2, 2), (1, 1)])
+
+        response = self.client.get(f'/api/pdf/batches/{batch_id}/download')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async) # Streamed under ASGI, never collected in memory first
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # The sync test client consumes the async stream
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response)))
+        names = archive.namelist()
+        self.assertEqual(names[0], 'batch.json')
+        self.assertEqual(len(names), 3)
+        with fitz.open(stream=archive.read(names[1]), filetype='pdf') as doc:
+            text = doc[0].get_text()
+        self.assertIn('$80.00', text)
+        self.assertNotIn('$40.00', text)
+
+        other = User.objects.create_user(username='ivan', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f'/api/pdf/batches/{batch_id}').status_code, 404)
+        response = self.client.post('/api/pdf/batches', json.dumps({'document_ids': document_ids}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_interrupted_batches_are_failed(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .batches import fail_stale_batches
+        from .models import PdfBatch, PdfBatchItem
+
+        user = User.objects.create_user(username='taras', password='secret')
+        documents = [
+            PdfDocument.objects.create(user=user, uploaded_file=SimpleUploadedFile(name, make_catalog_pdf([['Lamp $5.00']])))
+            for name in ('a.pdf', 'b.pdf', 'c.pdf')
+        ]
+        documents[1].start_processing()
+        long_ago = timezone.now() - timedelta(hours=2)
+        batch = PdfBatch.objects.create(user=user, status='running', runner='web-1:4242', heartbeat=timezone.now())
+        PdfBatch.objects.filter(pk=batch.pk).update(created=long_ago)
+        for document, stage in zip(documents, ('done', 'extract', 'queued')):
+            PdfBatchItem.objects.create(batch=batch, document=document, stage=stage)
+        batch.items.update(updated=long_ago) # A long stage or admission wait: the items do not move
+        self.assertEqual(fail_stale_batches(), []) # But its runner is alive
+
+        PdfBatch.objects.filter(pk=batch.pk).update(heartbeat=long_ago)
+        self.assertEqual(fail_stale_batches(), [batch.pk])
+        self.assertEqual(fail_stale_batches(), []) # Only once
+
+        self.assertEqual(PdfBatch.objects.get(pk=batch.pk).status, 'completed')
+        self.assertEqual(list(batch.items.order_by('id').values_list('stage', flat=True)), ['done', 'failed', 'failed'])
+        self.assertEqual([PdfDocument.objects.get(pk=d.pk).status for d in documents], ['uploaded', 'failed', 'uploaded'])
+
+
+class PipelineTests(TestCase):
+    def test_only_stages_downstream_of_a_change_are_recomputed(self):
+        from .pipeline import PDF_PIPELINE, ArtifactCache
+        cache = ArtifactCache()
+        pdf = make_catalog_pdf([['Chair $40.00', 'Desk $10.00'], ['Lamp $5.00']])
+        targets = ['extraction', 'edit_plan']
+
+        run = PDF_PIPELINE.run(pdf, {'rules': {'multiplier': 2}}, targets, cache)
+        self.assertEqual([(edit['old_text'], edit['new_text']) for edit in run.results['edit_plan']],
+                         [('$40.00', '$80.00'), ('$10.00', '$20.00'), ('$5.00', '$10.00')])
+        self.assertEqual(run.computed['span_index'], 2)
+
+        # Other rules: only the edit plan is computed again, and the document is not opened
+        run = PDF_PIPELINE.run(pdf, {'rules': {'multiplier': 3}}, targets, cache)
+        self.assertEqual(run.results['edit_plan'][2]['new_text'], '$15.00')
+        self.assertEqual(set(run.computed), {'edit_plan', 'extraction'})
+        self.assertEqual(run.reused['price_hits'], 2)
+
+        # A new version of the document with one page changed: only that page is processed
+        edited = make_catalog_pdf([['Chair $40.00', 'Desk $10.00'], ['Lamp $6.00']])
+        run = PDF_PIPELINE.run(edited, {'rules': {'multiplier': 3}}, targets, cache)
+        self.assertEqual((run.computed['price_hits'], run.reused['price_hits']), (1, 1))
+        self.assertEqual(run.computed['span_index'], 1)
+        self.assertEqual(run.results['edit_plan'][2]['new_text'], '$18.00')
+        self.assertEqual(run.results['extraction'][1]['text'].split(), ['Lamp', '$6.00'])
+
+    def test_disk_eviction_is_throttled_by_bytes_written(self):
+        from .pipeline import EVICTION_SHARE, MISSING, ArtifactCache
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        cache = ArtifactCache(directory, max_bytes=EVICTION_SHARE * 1000)
+
+        def entries():
+            return sum(len(files) for _, _, files in os.walk(directory))
+
+        for key in ('aa1', 'bb2'):
+            cache.put(key, b'x' * 400)
+        cache.evict_if_due()
+        self.assertEqual(entries(), 2) # Not due: under max_bytes / EVICTION_SHARE written
+
+        cache.max_bytes = 1000 # The directory now outgrows it, and the next scan is due
+        cache.put('cc3', b'x' * 400)
+        cache.evict_if_due()
+        self.assertEqual(entries(), 2)
+        self.assertIsNot(ArtifactCache(directory).get('cc3'), MISSING) # The oldest entry went
+
+
+class WorkerDaemonTests(TestCase):
+    def test_calls_run_in_warm_daemon_workers(self):
+        from asgiref.sync import async_to_sync
+        import operator
+        import threading
+        import time
+        from .daemon import WorkerDaemon, daemon_authkey, daemon_stats
+        from .workers import run_in_worker
+
+        address = os.path.join(tempfile.mkdtemp(), 'workers.sock')
+        daemon = WorkerDaemon(address, daemon_authkey(), processes=1, languages=[])
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        self.addCleanup(daemon.close)
+
+        with override_settings(PDF_WORKER_DAEMON_ADDRESS=address):
+            self.assertEqual(async_to_sync(run_in_worker)(operator.add, 2, 3), 5)
+            with self.assertRaises(ValueError): # Exceptions of the call are raised in the caller
+                async_to_sync(run_in_worker)(int, 'not a number')
+
+        stats = daemon_stats(address)
+        worker, = stats['workers']
+        self.assertTrue(worker['ready'])
+        self.assertEqual(worker['jobs'], 2)
+        self.assertGreater(worker['startup_seconds'], 0)
+        self.assertIsNotNone(worker['first_job_seconds'])
+
+    def test_calls_of_dead_workers_fail_and_slow_calls_time_out(self):
+        from asgiref.sync import async_to_sync
+        from concurrent.futures.process import BrokenProcessPool
+        import operator
+        import threading
+        import time
+        from .daemon import WorkerDaemon, daemon_authkey
+        from .workers import run_in_worker
+
+        address = os.path.join(tempfile.mkdtemp(), 'workers.sock')
+        daemon = WorkerDaemon(address, daemon_authkey(), processes=1, languages=[])
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        self.addCleanup(daemon.close)
+
+        with override_settings(PDF_WORKER_DAEMON_ADDRESS=address):
+            with self.assertRaises(BrokenProcessPool): # Reaped, not timed out
+                async_to_sync(run_in_worker)(os._exit, 1)
+            self.assertEqual(async_to_sync(run_in_worker)(operator.add, 2, 3), 5) # The replacement worker
+        with override_settings(PDF_WORKER_DAEMON_ADDRESS=address, PDF_WORKER_DAEMON_TIMEOUT=1):
+            with self.assertRaises(BrokenProcessPool):
+                async_to_sync(run_in_worker)(time.sleep, 3)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class OcrLanguageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='giulia', password='secret')
+        self.client.force_login(self.user)
+        pdf_bytes = make_catalog_pdf([[
+            'Listino prezzi della collezione di sedie',
+            'Sedia in legno di quercia, prezzo 125,00 EUR',
+            'Tavolo da pranzo con sconto per i rivenditori 480,00 EUR',
+        ]])
+        self.doc = PdfDocument.objects.create(user=self.user, uploaded_file=SimpleUploadedFile('listino.pdf', pdf_bytes))
+
+    def _ocr(self, **data):
+        import json
+        from unittest import mock
+
+        with mock.patch('pdf_processing.views._run_admitted', mock.AsyncMock(return_value='125,00')) as run:
+            response = self.client.post(
+                f'/api/pdf/{self.doc.id}/ocr-region',
+                json.dumps({'page_number': 0, 'x1': 48, 'y1': 65, 'x2': 300, 'y2': 85, **data}),
+                content_type='application/json',
+            )
+        return response, run
+
+    def test_detect_language(self):
+        from .languages import detect_language
+
+        self.assertEqual(detect_language("Стілець дубовий, ціна 1 250,00 грн. Знижка на всі товари цього тижня."), 'ukr')
+        self.assertEqual(detect_language("Sconto del venti per cento più IVA su tutti gli articoli del listino."), 'ita')
+        self.assertEqual(detect_language("Twenty percent off all items of the price list this week."), 'eng')
+        self.assertEqual(detect_language("SKU 12345 $12.00"), '') # Too little text to tell
+        self.assertEqual(detect_language("Стілець дубовий, ціна 1 250,00 грн. Знижка на всі товари цього тижня.",
+                                         candidates=['ita', 'eng']), '')
+
+    def test_language_comes_from_request_document_then_profile(self):
+        # Before extraction the document's language is unknown: the profile's applies (default 'uk')
+        response, run = self._ocr()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['language_used'], response.json()['language_source']), ('ukr', 'profile'))
+        self.assertEqual(run.call_args.kwargs['language'], 'ukr')
+
+        self.client.post(f'/api/pdf/{self.doc.id}/extract-text')
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.language, 'ita')
+        response, run = self._ocr()
+        self.assertEqual((response.json()['language_used'], response.json()['language_source']), ('ita', 'document'))
+
+        response, run = self._ocr(language='en') # Profile language codes are accepted too
+        self.assertEqual((response.json()['language_used'], response.json()['language_source']), ('eng', 'request'))
+        response, run = self._ocr(language='ukr+ita')
+        self.assertEqual(run.call_args.kwargs['language'], 'ukr+ita')
+
+        response, run = self._ocr(language='../eng')
+        self.assertEqual(response.status_code, 400)
+        run.assert_not_called()
+
+        response, run = self._ocr(mode='price')
+        self.assertEqual(run.call_args.kwargs['mode'], 'price')
+        response, run = self._ocr(mode='table')
+        self.assertEqual(response.status_code, 400)
+
+
+class OcrPreprocessingTests(TestCase):
+    def test_price_region_is_binarized_deskewed_and_cropped(self):
+        from PIL import ImageChops
+        from .preprocessing import PRICE_LINE_HEIGHT_PX, render_region, skew_angle
+
+        doc = fitz.open()
+        page = doc.new_page()
+        page.draw_rect(fitz.Rect(40, 40, 300, 70), color=None, fill=(0.85, 0.9, 1.0)) # Shaded table cell
+        page.insert_text((50, 60), "$1,299.00", fontsize=11)
+        page.insert_text((50, 160), "Oak wood chair, price $125.00 each", fontsize=11,
+                         morph=(fitz.Point(50, 160), fitz.Matrix(3))) # Scanned 3 degrees askew
+
+        image = render_region(page, fitz.Rect(40, 40, 300, 70), mode='price')
+        self.assertEqual(image.mode, 'L')
+        self.assertEqual(set(image.getdata()), {0, 255}) # The shading is gone
+        self.assertLess(image.width, 260 * PRICE_LINE_HEIGHT_PX / 30 / 2) # Cropped to the ink
+        self.assertLessEqual(image.height, PRICE_LINE_HEIGHT_PX)
+
+        askew = render_region(page, fitz.Rect(40, 120, 330, 200), preprocessed=False)
+        self.assertNotEqual(skew_angle(askew.point(lambda value: 0 if value < 128 else 255)), 0.0)
+        straightened = render_region(page, fitz.Rect(40, 120, 330, 200))
+        self.assertEqual(skew_angle(straightened), 0.0)
+        self.assertIsNotNone(ImageChops.invert(straightened).getbbox())
+
+    def test_price_mode_reads_a_single_whitelisted_line(self):
+        from unittest import mock
+        from . import utils
+
+        pdf_bytes = make_catalog_pdf([['Chair $12.50']])
+        with mock.patch.object(utils, 'tesserocr', None), \
+             mock.patch.object(utils.pytesseract, 'image_to_string', return_value='$12.50\n') as ocr:
+            text = utils.extract_text_from_region_ocr(pdf_bytes, 0, 75, 48, 140, 64, mode='price')
+        self.assertEqual(text, '$12.50')
+        config = ocr.call_args.kwargs['config']
+        self.assertIn('--psm 7', config)
+        self.assertIn('tessedit_char_whitelist=', config)
+        self.assertIn('₴', config)
+
+
+def make_table_pdf(rows, columns=(50, 200, 290, 420, 500), bold_cells=()):
+    """Builds an in-memory one-page PDF with a table; rows is a list of lists of cell texts."""
+    doc = fitz.open()
+    page = doc.new_page()
+    for row_number, row in enumerate(rows):
+        for column_number, (x, text) in enumerate(zip(columns, row)):
+            bold = (row_number, column_number) in bold_cells
+            page.insert_text((x, 60 + row_number * 20), text, fontname='hebo' if bold else 'helv', fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class PriceColumnTests(TestCase):
+    rows = [
+        ['Item', 'SKU', 'Year', 'Price', 'Sale'],
+        ['Chair', '104577', '2021', '120', '99'],
+        ['Table', '104578', '2022', '480', '450'],
+        ['Lamp', '104590', '2023', '45', '39'],
+        ['Sofa', '104601', '2024', '1299', '1199'],
+    ]
+
+    def test_bare_integers_only_count_in_price_columns(self):
+        from .layout import analyze_layout
+        from .utils import find_prices_on_page, page_spans
+
+        doc = fitz.open(stream=make_table_pdf(self.rows + [['Catalog 2024, page 12']]), filetype='pdf')
+        columns = analyze_layout(page_spans(doc[0]))['columns']
+        self.assertEqual([(column['header'], column['price']) for column in columns],
+                         [('Item', False), ('SKU', False), ('Year', False), ('Price', True), ('Sale', True)])
+
+        prices = find_prices_on_page(doc[0])
+        self.assertEqual([price['raw_text'] for price in prices if price['column'] == 0], ['120', '480', '45', '1299'])
+        self.assertEqual([price['raw_text'] for price in prices if price['column'] == 1], ['99', '450', '39', '1199'])
+        self.assertEqual(len(prices), 8) # No SKUs, years or page numbers
+        doc.close()
+
+    def test_digit_runs_too_long_for_a_price_are_stored_without_value(self):
+        from decimal import Decimal
+
+        user = User.objects.create_user(username='taras', password='secret')
+        rows = [row[:] for row in self.rows]
+        rows[2][3] = '4006381333931' # A barcode in the price column
+        document = PdfDocument.objects.create(user=user,
+                                              uploaded_file=SimpleUploadedFile('table.pdf', make_table_pdf(rows)))
+        self.client.force_login(user)
+        response = self.client.post(f'/api/pdf/{document.id}/extract-text')
+        self.assertEqual(response.status_code, 200)
+        barcode = document.price_occurrences.get(raw_text='4006381333931')
+        self.assertIsNone(barcode.value)
+        self.assertEqual(document.price_occurrences.get(raw_text='1299').value, Decimal('1299'))
+
+    def test_column_override_reprices_a_column_in_its_shared_style(self):
+        from .repricing import RuleSet
+
+        user = User.objects.create_user(username='olena', password='secret')
+        pdf_bytes = make_table_pdf(self.rows, bold_cells={(2, 4)})
+        document = PdfDocument.objects.create(user=user, uploaded_file=SimpleUploadedFile('table.pdf', pdf_bytes))
+        self.client.force_login(user)
+        self.client.post(f'/api/pdf/{document.id}/extract-text')
+        response = self.client.get(f'/api/pdf/{document.id}/identify-prices', {'column': 1})
+        self.assertEqual(response.json()['total'], 4)
+
+        rule_set = RuleSet.from_dict({'overrides': [{'columns': [1], 'multiplier': 0.5}], 'column_style': 'shared'})
+        plan = {row['old_text']: row for row in document.evaluate_price_rules(rule_set)}
+        self.assertEqual(plan['120']['new_text'], '120') # Column 0 is left alone
+        self.assertEqual(plan['450']['new_text'], '225')
+        self.assertFalse(plan['450']['style_info']['bold']) # The bold cell takes the column's style
+        with self.assertRaises(ValueError):
+            RuleSet.from_dict({'overrides': [{'columns': 'sale'}]})
+
+
+class StartupTests(TestCase):
+    def test_pdf_modules_load_their_libraries_on_first_use(self):
+        import subprocess
+        import sys
+        from django.conf import settings
+
+        script = ("import sys; from pdf_processing import utils; "
+                  "loaded = [name for name in ('fitz', 'PIL.Image', 'pytesseract') if name in sys.modules]; "
+                  "utils.fitz.Rect(0, 0, 1, 1); "
+                  "print(loaded, 'fitz' in sys.modules)")
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.stdout.strip(), '[] True', result.stderr)
+
+    def test_lazy_import(self):
+        from .lazy import lazy_import
+
+        json = lazy_import('json')
+        self.assertEqual(json.dumps([1]), '[1]')
+        with self.assertRaises(ImportError):
+            lazy_import('no_such_module_anywhere')
+
+    def test_warm_up_runs_only_in_serving_processes(self):
+        from unittest import mock
+        from .apps import _serves_requests
+
+        cases = [
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['manage.py', 'runserver'], {}, False), # The autoreloader
+            (['manage.py', 'migrate'], {}, False),
+            (['uvicorn', 'pdf_price_editor.asgi:application'], {}, True),
+        ]
+        for argv, environ, expected in cases:
+            with mock.patch('sys.argv', argv), mock.patch.dict(os.environ, environ), self.subTest(argv=argv):
+                if 'RUN_MAIN' not in environ:
+                    os.environ.pop('RUN_MAIN', None)
+                self.assertEqual(_serves_requests(), expected)
+        with mock.patch('pdf_processing.workers._worker_process', True), mock.patch('sys.argv', ['uvicorn']):
+            self.assertFalse(_serves_requests())
@@ -8,7 +8,16 @@ urlpatterns = [
     path('<int:document_id>/ocr-region', views.ocr_text_from_region_view, name='ocr_text_from_region'),
     path('<int:document_id>/analyze-style-region', views.analyze_text_style_view, name='analyze_text_style'),
     path('<int:document_id>/replace-text-region', views.replace_text_region_view, name='replace_text_region'),
+    path('<int:document_id>/reprice-preview', views.reprice_preview_view, name='reprice_preview'),
+    path('<int:document_id>/reprice-diff', views.reprice_diff_view, name='reprice_diff'),
+    path('<int:document_id>/optimize', views.optimize_pdf_view, name='optimize_pdf'),
+    path('<int:document_id>/status', views.document_status_view, name='document_status'),
     path('<int:document_id>/download', views.download_modified_pdf_view, name='download_modified_pdf'),
     path('documents', views.list_user_documents_view, name='list_user_documents'),
     path('<int:document_id>/delete', views.delete_document_view, name='delete_document'),
+    path('batches', views.create_batch_view, name='create_batch'),
+    path('batches/<int:batch_id>', views.batch_status_view, name='batch_status'),
+    path('batches/<int:batch_id>/download', views.batch_download_view, name='batch_download'),
+    path('search', views.search_documents_view, name='search_documents'),
+    path('metrics', views.metrics_view, name='pdf_metrics'),
 ]
@@ -1,37 +1,145 @@
-import fitz # PyMuPDF
+from collections import OrderedDict
+import functools
+import hashlib
+import inspect
+import logging
+import mmap
 import os
+import shlex
+import shutil
+import threading
+import time
 
+from .instrumentation import timed
+from .layout import analyze_layout, price_column_of_spans
+from .lazy import lazy_import
+from .profiling import profiled
+from .preprocessing import ocr_options, render_region
+from .pricing import PriceFormat, format_for, parse_price
+
+fitz = lazy_import('fitz') # PyMuPDF, loaded on first use (see lazy.py)
+
+logger = logging.getLogger(__name__)
+
+def open_document(source):
+    """
+    Opens a PDF from a file path or from its contents (bytes, or a memoryview
+    from map_document()), so callers don't depend on the document being on local disk.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+_buffer_streams_supported = None
+
+def pymupdf_accepts_buffers():
+    """
+    Whether fitz.open(stream=...) takes buffer objects such as memoryviews without
+    copying them. PyMuPDF 1.23 only takes bytes, which would mean a full copy.
+    """
+    global _buffer_streams_supported
+    if _buffer_streams_supported is None:
+        probe = fitz.open()
+        probe.new_page()
+        data = probe.tobytes()
+        probe.close()
+        try:
+            fitz.open(stream=memoryview(data), filetype="pdf").close()
+            _buffer_streams_supported = True
+        except TypeError:
+            _buffer_streams_supported = False
+    return _buffer_streams_supported
+
+class SharedMappings:
+    """
+    Read-only memory maps of local PDF files, shared by every request in the
+    process. A mapping is keyed by the file's identity (device, inode, size,
+    mtime), so a replaced file gets a new one. The least recently used mappings
+    are closed beyond max_open; one still exported to a memoryview stays valid
+    until its last view is released.
+    """
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._mappings = OrderedDict()
+
+    def view(self, path):
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            mapping = self._mappings.get(key)
+            if mapping is None:
+                with open(path, 'rb') as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mappings[key] = mapping
+                while len(self._mappings) > self.max_open:
+                    _, oldest = self._mappings.popitem(last=False)
+                    try:
+                        oldest.close()
+                    except BufferError:
+                        pass # Still in use; unmapped once its views are gone
+            else:
+                self._mappings.move_to_end(key)
+            return memoryview(mapping)
+
+shared_mappings = SharedMappings()
+
+def map_document(path):
+    """
+    Returns the cheapest source for open_document() for a local file, without
+    reading it into a Python bytes object: a zero-copy memoryview of a shared
+    memory map when PyMuPDF accepts buffers, otherwise the path itself, which
+    MuPDF reads lazily through the OS page cache (shared between requests too).
+    """
+    if pymupdf_accepts_buffers() and os.path.getsize(path) > 0:
+        return shared_mappings.view(path)
+    return path
+
+def _is_missing(source):
+    return isinstance(source, (str, os.PathLike)) and not os.path.exists(source)
+
+def _source_size(source):
+    return os.path.getsize(source) if isinstance(source, (str, os.PathLike)) else len(source)
+
+def _describe(source):
+    """Source for log messages: the path, or the size of an in-memory document."""
+    return source if isinstance(source, (str, os.PathLike)) else f"<{len(source)}-byte stream>"
+
+@profiled("extract_text")
 def extract_text_from_pdf(pdf_path):
     """
     Extracts all text from a given PDF file.
 
     Args:
-        pdf_path (str): The file path to the PDF.
+        pdf_path (str | bytes): The file path to the PDF, or its contents.
 
     Returns:
         str: The concatenated text from all pages of the PDF.
              Returns None if an error occurs (e.g., file not found, corrupted PDF).
     """
-    if not os.path.exists(pdf_path):
+    if _is_missing(pdf_path):
         # Log error: File not found
-        print(f"Error: PDF file not found at {pdf_path}")
+        logger.error("PDF file not found at %s", _describe(pdf_path))
         return None
 
     full_text = []
     try:
-        doc = fitz.open(pdf_path)
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            full_text.append(page.get_text("text"))
+        with timed("open"):
+            doc = open_document(pdf_path)
+        with timed("extract_text"):
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                full_text.append(page.get_text("text"))
         doc.close()
         return "".join(full_text)
     except fitz.errors.FitzError as e: # Specific exception for fitz
         # Log error: FitzError (e.g. corrupted PDF, not a PDF)
-        print(f"FitzError while processing {pdf_path}: {e}")
+        logger.error("FitzError while processing %s: %s", _describe(pdf_path), e)
         return None
     except Exception as e:
         # Log error: General error during PDF processing
-        print(f"An unexpected error occurred while processing {pdf_path}: {e}")
+        logger.exception("An unexpected error occurred while processing %s: %s", _describe(pdf_path), e)
         return None
 
 import re
@@ -161,35 +269,391 @@ def identify_prices_in_text(text_content):
             
     return final_prices
 
-import pytesseract
-from PIL import Image
-import io
+# Positional variants of the patterns used by identify_prices_in_text, in the same
+# order of specificity. Used when we need to know *where* a price is, not just its text.
+BARE_NUMBER_PATTERN = re.compile(r'\b\d{2,}\b') # Also matches SKUs and years: only used in price columns
+_AMOUNT = r'(?:\d{1,3}(?:[ \u00a0.,]\d{3})+|\d+)(?:[.,]\d{1,2})?' # Grouped ("1,299.00") or not ("9326.97")
+PRICE_PATTERNS = [
+    re.compile(rf'[\$€£₴]\s*{_AMOUNT}'),
+    re.compile(rf'(?:грн|UAH|USD|EUR|GBP)\.?\s*{_AMOUNT}'),
+    re.compile(rf'{_AMOUNT}\s*(?:[\$€£₴]|грн|UAH|USD|EUR|GBP)'),
+    re.compile(r'\b\d+[.,]\d{2}\b'),
+    BARE_NUMBER_PATTERN,
+]
+# Part of every page's content hash, so that stored pages are detected again
+# when price detection changes (see page_content_hash())
+PRICE_DETECTION_VERSION = 2
+
+CURRENCY_CODES = [
+    ('$', 'USD'),
+    ('€', 'EUR'),
+    ('£', 'GBP'),
+    ('₴', 'UAH'),
+    ('грн', 'UAH'),
+    ('UAH', 'UAH'),
+    ('USD', 'USD'),
+    ('EUR', 'EUR'),
+    ('GBP', 'GBP'),
+]
+
+def detect_currency(price_text):
+    """Returns the ISO currency code for the symbol used in price_text, or '' if none."""
+    for symbol, code in CURRENCY_CODES:
+        if symbol in price_text:
+            return code
+    return ""
+
+def find_price_spans(text, bare_numbers=True):
+    """
+    Finds non-overlapping price matches in text, preferring the more specific patterns.
+
+    Args:
+        text (str): The text.
+        bare_numbers (bool): Whether integers without a currency symbol count as prices.
+
+    Returns:
+        list[tuple[int, int]]: (start, end) character offsets, sorted by start.
+    """
+    taken = []
+    for pattern in PRICE_PATTERNS:
+        if pattern is BARE_NUMBER_PATTERN and not bare_numbers:
+            continue
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if any(start < t_end and end > t_start for t_start, t_end in taken):
+                continue
+            taken.append((start, end))
+    return sorted(taken)
+
+def span_style_info(span):
+    """Converts a PyMuPDF text span dict into the style dict used by the API."""
+    font_name = span.get("font", "Unknown")
+    color_int = span.get("color", 0)
+    flags = span.get("flags", 0)
+    # flags & 2: italic, flags & 16: bold (font name is a more reliable hint for bold)
+    is_bold = bool(flags & 16) or "bold" in font_name.lower()
+    return {
+        "font": font_name,
+        "size": round(span.get("size", 0.0), 2),
+        "color": f"#{color_int:06x}" if isinstance(color_int, int) else "#000000",
+        "bold": is_bold,
+        "italic": bool(flags & 2),
+    }
+
+def page_spans(page):
+    """
+    The span index of a page: every text span with its characters' boxes and
+    its style, from a single get_text("rawdict") call.
+
+    Returns:
+        list[dict]: text, chars (one (x0, y0, x1, y1) per character) and style
+                    (the span_style_info() dict) per non-empty span.
+    """
+    spans = []
+    raw = page.get_text("rawdict")
+    for block in raw.get("blocks", []):
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                chars = span.get("chars", [])
+                if not chars:
+                    continue
+                spans.append({
+                    "text": "".join(char["c"] for char in chars),
+                    "chars": [tuple(char["bbox"]) for char in chars],
+                    "style": span_style_info(span),
+                })
+    return spans
+
+def find_prices_in_spans(spans, page_number):
+    """
+    Detects prices in the span index of a page (see page_spans()).
+
+    The page's table layout is analyzed first (layout.analyze_layout()): bare
+    integers only count as prices in the page's price columns, so SKU, year
+    and quantity columns are left out.
 
-def extract_text_from_region_ocr(pdf_path, page_number, x1, y1, x2, y2, language='eng'):
+    Returns:
+        list[dict]: One dict per price with keys page_number, bbox (x0, y0, x1, y1),
+                    raw_text, value, currency, column (the number of its price
+                    column on the page, or None) and the span_style_info() keys.
+    """
+    price_columns = price_column_of_spans(analyze_layout(spans))
+    found = []
+    for index, span in enumerate(spans):
+        text = span["text"]
+        column = price_columns.get(index)
+        for start, end in find_price_spans(text, bare_numbers=column is not None):
+            raw_text = text[start:end].strip()
+            match_boxes = [box for c, box in zip(text[start:end], span["chars"][start:end]) if not c.isspace()]
+            if not raw_text or not match_boxes:
+                continue
+            bbox = (
+                min(box[0] for box in match_boxes),
+                min(box[1] for box in match_boxes),
+                max(box[2] for box in match_boxes),
+                max(box[3] for box in match_boxes),
+            )
+            found.append({
+                "page_number": page_number,
+                "bbox": bbox,
+                "raw_text": raw_text,
+                "value": parse_price_string(raw_text),
+                "currency": detect_currency(raw_text),
+                "column": column,
+                **span["style"],
+            })
+    return found
+
+def find_prices_on_page(page):
+    """
+    Detects prices on a single PyMuPDF page together with their location and style.
+
+    Args:
+        page (fitz.Page): A loaded page.
+
+    Returns:
+        list[dict]: See find_prices_in_spans().
+    """
+    return find_prices_in_spans(page_spans(page), page.number)
+
+XREF_REFERENCE = re.compile(rb'(\d+) 0 R')
+
+def _xref_digest(doc, xref, memo, in_progress=None):
+    """
+    Digest of a PDF object: its dictionary, its raw (still compressed) stream if
+    it has one, and recursively the digests of the objects it references.
+    Results are memoized per xref so shared fonts/images are hashed once per document.
+    """
+    if xref in memo:
+        return memo[xref]
+    in_progress = in_progress if in_progress is not None else set()
+    if xref in in_progress: # Reference cycle
+        return str(xref).encode()
+    in_progress.add(xref)
+
+    digest = hashlib.sha256()
+    obj_source = doc.xref_object(xref, compressed=True).encode("latin-1", "replace")
+    digest.update(obj_source)
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    for ref in XREF_REFERENCE.findall(obj_source):
+        digest.update(_xref_digest(doc, int(ref), memo, in_progress))
+
+    in_progress.discard(xref)
+    memo[xref] = digest.digest()
+    return memo[xref]
+
+def page_content_hash(doc, page, memo=None):
+    """
+    Returns a hex digest identifying the rendered content of a page: its content
+    streams, its (possibly inherited) resources and geometry, and the price
+    detection version. Two pages with the same hash produce the same text and
+    prices, so extraction can be skipped.
+
+    Args:
+        doc (fitz.Document): The open document.
+        page (fitz.Page): A page of doc.
+        memo (dict | None): Per-document xref digest cache, shared across pages.
+    """
+    memo = memo if memo is not None else {}
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.mediabox), page.rotation, PRICE_DETECTION_VERSION)).encode())
+    for xref in page.get_contents():
+        digest.update(doc.xref_stream_raw(xref) or b"")
+
+    # Resources may be inherited from an ancestor in the page tree
+    node = page.xref
+    res_type, res_value = doc.xref_get_key(node, "Resources")
+    while res_type == "null":
+        parent_type, parent_value = doc.xref_get_key(node, "Parent")
+        if parent_type != "xref":
+            break
+        node = int(parent_value.split()[0])
+        res_type, res_value = doc.xref_get_key(node, "Resources")
+
+    if res_type == "xref":
+        digest.update(_xref_digest(doc, int(res_value.split()[0]), memo))
+    else:
+        resources = res_value.encode("latin-1", "replace")
+        digest.update(resources)
+        for ref in XREF_REFERENCE.findall(resources):
+            digest.update(_xref_digest(doc, int(ref), memo))
+    return digest.hexdigest()
+
+@profiled("extract_pages")
+def extract_pages_from_pdf(pdf_path, known_pages=None):
+    """
+    Extracts the text of every page and detects prices in the same pass, so the
+    document only has to be opened and parsed once.
+
+    Pages whose content hash is found in known_pages are not extracted again;
+    their entry carries a reuse_from key with the page number of the stored
+    page that has the same content.
+
+    Args:
+        pdf_path (str | bytes): The file path to the PDF, or its contents.
+        known_pages (dict | None): content_hash -> page_number of already stored pages.
+
+    Returns:
+        list[dict]: One dict per page with keys page_number and content_hash, plus
+                    either text and prices (the find_prices_on_page() results for
+                    that page) or reuse_from. Returns None if an error occurs.
+    """
+    if _is_missing(pdf_path):
+        logger.error("PDF file not found at %s", _describe(pdf_path))
+        return None
+
+    known_pages = known_pages or {}
+    pages = []
+    try:
+        with timed("open"):
+            doc = open_document(pdf_path)
+        memo = {}
+        for page_num in range(len(doc)):
+            page = doc.load_page(page_num)
+            with timed("hash_pages"):
+                content_hash = page_content_hash(doc, page, memo)
+            if content_hash in known_pages:
+                pages.append({
+                    "page_number": page_num,
+                    "content_hash": content_hash,
+                    "reuse_from": known_pages[content_hash],
+                })
+                continue
+            with timed("extract_text"):
+                text = page.get_text("text")
+            with timed("detect_prices"):
+                prices = find_prices_on_page(page)
+            pages.append({
+                "page_number": page_num,
+                "content_hash": content_hash,
+                "text": text,
+                "prices": prices,
+            })
+        doc.close()
+        return pages
+    except Exception as e:
+        logger.exception("An unexpected error occurred while processing %s: %s", _describe(pdf_path), e)
+        return None
+
+pytesseract = lazy_import('pytesseract')
+Image = lazy_import('PIL.Image')
+
+try:
+    tesserocr = lazy_import('tesserocr') # Optional: keeps Tesseract models loaded in the worker process
+except ImportError:
+    tesserocr = None
+
+OCR_MODEL_CACHE_SIZE = 8 # Loaded Tesseract models kept per process (one per language setting)
+_ocr_models = OrderedDict() # language -> (tesserocr.PyTessBaseAPI, lock), least recently used first
+_ocr_models_lock = threading.Lock()
+
+def _ocr_model(language):
+    """
+    Returns this process's loaded Tesseract model for the language setting
+    (e.g. 'ukr' or 'ukr+ita+eng') and its lock, loading it on first use.
+    Models stay loaded across calls, so only a worker's first OCR of a
+    language pays for reading its traineddata files.
+    """
+    with _ocr_models_lock:
+        entry = _ocr_models.get(language)
+        if entry is not None:
+            _ocr_models.move_to_end(language)
+            return entry
+        entry = (tesserocr.PyTessBaseAPI(lang=language), threading.Lock())
+        _ocr_models[language] = entry
+        while len(_ocr_models) > OCR_MODEL_CACHE_SIZE:
+            _, (api, lock) = _ocr_models.popitem(last=False)
+            with lock:
+                api.End()
+        return entry
+
+def ocr_image(image, language='eng', psm=None, whitelist=''):
+    """
+    Runs Tesseract on a PIL image.
+
+    With tesserocr installed, the model of each language setting is loaded once
+    per process and reused (see _ocr_model()); otherwise every call runs the
+    tesseract binary through pytesseract, which loads the model again.
+
+    Args:
+        image (PIL.Image.Image): The image.
+        language (str): Tesseract language setting.
+        psm (int | None): Page segmentation mode, e.g. 7 for a single line; None for Tesseract's default.
+        whitelist (str): The only characters to recognize; '' for all.
+
+    Raises:
+        pytesseract.TesseractNotFoundError: If tesserocr is not installed and the binary is missing.
+        RuntimeError: If the language's traineddata cannot be loaded.
+    """
+    if tesserocr is None:
+        config = []
+        if psm is not None:
+            config.append(f"--psm {psm}")
+        if whitelist:
+            config.append(f"-c tessedit_char_whitelist={shlex.quote(whitelist)}")
+        return pytesseract.image_to_string(image, lang=language, config=" ".join(config))
+    api, lock = _ocr_model(language)
+    with lock:
+        # The model is shared across calls, so every call sets (or resets) its options
+        api.SetPageSegMode(psm if psm is not None else tesserocr.PSM.SINGLE_BLOCK)
+        api.SetVariable("tessedit_char_whitelist", whitelist)
+        api.SetImage(image)
+        return api.GetUTF8Text()
+
+def warm_up_ocr(languages):
+    """
+    Runs Tesseract once per language on a blank image, so that its binary and
+    traineddata files are loaded (and in the page cache, or in the model cache
+    of ocr_image()) before the first real request, and missing languages show
+    up in the log at startup.
+
+    Returns:
+        dict: language -> seconds taken, or None if the language is not available.
+    """
+    image = Image.new("L", (64, 32), 255)
+    result = {}
+    for language in languages:
+        started = time.perf_counter()
+        try:
+            ocr_image(image, language)
+            result[language] = round(time.perf_counter() - started, 4)
+        except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError, RuntimeError) as e:
+            logger.warning("Tesseract language '%s' is not available: %s", language, e)
+            result[language] = None
+    return result
+
+@profiled("ocr_region")
+def extract_text_from_region_ocr(pdf_path, page_number, x1, y1, x2, y2, language='eng', mode='text',
+                                 preprocessed=True):
     """
     Extracts text from a specific region of a PDF page using OCR.
 
     Args:
-        pdf_path (str): Path to the PDF file.
+        pdf_path (str | bytes): Path to the PDF file, or its contents.
         page_number (int): 0-indexed page number.
         x1, y1, x2, y2 (float): Coordinates of the bounding box.
-        language (str): Language code for Tesseract (e.g., 'eng', 'ukr', 'ita').
+        language (str): Language code for Tesseract (e.g., 'eng', 'ukr', 'ita', or 'ukr+ita+eng').
+        mode (str): 'text', or 'price' for a single-line price region, which is read
+            as one line restricted to the characters of prices (see preprocessing.py).
+        preprocessed (bool): Whether to binarize, deskew and crop the region before OCR.
 
     Returns:
         str: Extracted text from the region, or None if an error occurs.
     """
-    if not os.path.exists(pdf_path):
-        print(f"Error: PDF file not found at {pdf_path}")
+    if _is_missing(pdf_path):
+        logger.error("PDF file not found at %s", _describe(pdf_path))
         return None
 
     try:
-        doc = fitz.open(pdf_path)
+        with timed("open"):
+            doc = open_document(pdf_path)
     except Exception as e:
-        print(f"Error opening PDF {pdf_path}: {e}")
+        logger.error("Error opening PDF %s: %s", _describe(pdf_path), e)
         return None
 
     if page_number < 0 or page_number >= len(doc):
-        print(f"Error: Page number {page_number} is out of range for PDF {pdf_path} (pages: {len(doc)}).")
+        logger.error("Page number %s is out of range for PDF %s (pages: %s).", page_number, _describe(pdf_path), len(doc))
         if doc: doc.close()
         return None
     
@@ -200,51 +664,48 @@ def extract_text_from_region_ocr(pdf_path, page_number, x1, y1, x2, y2, language
     clip_rect = fitz.Rect(float(x1), float(y1), float(x2), float(y2))
 
     if clip_rect.is_empty or clip_rect.width <= 0 or clip_rect.height <= 0:
-        print(f"Error: Invalid or zero-area rectangle defined by ({x1},{y1},{x2},{y2}).")
+        logger.error("Invalid or zero-area rectangle defined by (%s,%s,%s,%s).", x1, y1, x2, y2)
         doc.close()
         return None
 
     try:
-        # Get pixmap of the clipped region
-        # zoom factor can be increased to get higher resolution image for OCR
-        zoom = 2.0 # Increase zoom for better OCR; adjust as needed
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat, clip=clip_rect)
-        
-        if pix.width == 0 or pix.height == 0:
-            print(f"Error: Pixmap for region ({x1},{y1},{x2},{y2}) on page {page_number} is empty.")
+        # Rendered at a resolution that suits the region, grayscale, then
+        # binarized, deskewed and cropped to the ink
+        with timed("render"):
+            image = render_region(page, clip_rect, mode, preprocessed=preprocessed)
+
+        if image is None:
+            logger.error("Pixmap for region (%s,%s,%s,%s) on page %s is empty.", x1, y1, x2, y2, page_number)
             doc.close()
             return None
 
-        # Convert pixmap to PIL Image
-        img_data = pix.tobytes("png") # Get bytes in PNG format
-        image = Image.open(io.BytesIO(img_data))
-        
         # Perform OCR
-        ocr_text = pytesseract.image_to_string(image, lang=language)
+        with timed("ocr"):
+            ocr_text = ocr_image(image, language, **ocr_options(mode))
         
         doc.close()
         return ocr_text.strip()
         
     except pytesseract.TesseractNotFoundError:
-        print("Error: Tesseract is not installed or not found in your PATH.")
+        logger.error("Tesseract is not installed or not found in your PATH.")
         if doc: doc.close()
         return None
     except RuntimeError as e: # Catch Tesseract runtime errors (e.g. lang data not found)
-        print(f"Error during Tesseract OCR processing: {e}")
+        logger.error("Error during Tesseract OCR processing: %s", e)
         if doc: doc.close()
         return None
     except Exception as e:
-        print(f"An unexpected error occurred during OCR for region: {e}")
+        logger.exception("An unexpected error occurred during OCR for region: %s", e)
         if doc: doc.close()
         return None
 
+@profiled("analyze_style")
 def get_text_style_in_region(pdf_path, page_number, x1, y1, x2, y2):
     """
     Analyzes the text style (font, size, color, flags) in a specific region of a PDF page.
 
     Args:
-        pdf_path (str): Path to the PDF file.
+        pdf_path (str | bytes): Path to the PDF file, or its contents.
         page_number (int): 0-indexed page number.
         x1, y1, x2, y2 (float): Coordinates of the bounding box.
 
@@ -254,20 +715,21 @@ def get_text_style_in_region(pdf_path, page_number, x1, y1, x2, y2):
               Example: {"font": "Arial", "size": 12.0, "color": "#000000", 
                         "bold": False, "italic": False, "text": "sample text"}
     """
-    if not os.path.exists(pdf_path):
-        print(f"Error: PDF file not found at {pdf_path}")
+    if _is_missing(pdf_path):
+        logger.error("PDF file not found at %s", _describe(pdf_path))
         return None
 
     doc = None  # Initialize doc to None for broader scope in finally block
     try:
-        doc = fitz.open(pdf_path)
+        with timed("open"):
+            doc = open_document(pdf_path)
     except Exception as e:
-        print(f"Error opening PDF {pdf_path}: {e}")
+        logger.error("Error opening PDF %s: %s", _describe(pdf_path), e)
         return None
 
     try:
         if page_number < 0 or page_number >= len(doc):
-            print(f"Error: Page number {page_number} is out of range for PDF {pdf_path} (pages: {len(doc)}).")
+            logger.error("Page number %s is out of range for PDF %s (pages: %s).", page_number, _describe(pdf_path), len(doc))
             return None
         
         page = doc.load_page(page_number)
@@ -275,11 +737,12 @@ def get_text_style_in_region(pdf_path, page_number, x1, y1, x2, y2):
         clip_rect = fitz.Rect(float(x1), float(y1), float(x2), float(y2))
 
         if clip_rect.is_empty or clip_rect.width <= 0 or clip_rect.height <= 0:
-            print(f"Error: Invalid or zero-area rectangle defined by ({x1},{y1},{x2},{y2}).")
+            logger.error("Invalid or zero-area rectangle defined by (%s,%s,%s,%s).", x1, y1, x2, y2)
             return None
 
         # get_text("dict") or "rawdict" provides detailed information including spans
-        text_dict = page.get_text("dict", clip=clip_rect)
+        with timed("analyze_style"):
+            text_dict = page.get_text("dict", clip=clip_rect)
         
         extracted_text_in_region = ""
         
@@ -291,43 +754,11 @@ def get_text_style_in_region(pdf_path, page_number, x1, y1, x2, y2):
                     # A more precise check would involve comparing span bbox with clip_rect.
                     
                     # Extract style from the first relevant span
-                    font_name = span.get("font", "Unknown")
-                    font_size = round(span.get("size", 0.0), 2)
-                    
-                    # Color is an integer, convert to hex
-                    color_int = span.get("color", 0) # Default to black
-                    color_hex = f"#{color_int:06x}" if isinstance(color_int, int) else "#000000"
-
-                    flags = span.get("flags", 0)
-                    is_bold = bool(flags & (1 << 4)) # Bit 4 for bold (font-specific, but common)
-                                                 # PyMuPDF docs: 2 for italic, 16 for bold (supersedes 2^4)
-                                                 # Let's check common flags: is_bold = font_name.lower().contains("bold") or (flags & 16)
-                                                 # A common flag for bold is (flags & 2**4) or if the font name implies bold.
-                                                 # PyMuPDF's documentation should be consulted for the exact meaning of flags.
-                                                 # From common observations with PDF text:
-                                                 # flags & 1: superscript
-                                                 # flags & 2: italic
-                                                 # flags & 4: serifed (vs sans-serif)
-                                                 # flags & 16: bold (more reliable than (1<<4) for some fonts)
-                    
-                    is_italic = bool(flags & 2) 
-                    # More robust bold check:
-                    # Some fonts have "Bold" in their name. Or use flags & 16.
-                    # A simple check for boldness in font name:
-                    if not is_bold and "bold" in font_name.lower():
-                        is_bold = True
-                    elif flags & 16: # Flag 16 is often used for bold
-                        is_bold = True
-
                     extracted_text_in_region += span.get("text", "") + " "
 
                     # Return style of the first span found
                     return {
-                        "font": font_name,
-                        "size": font_size,
-                        "color": color_hex,
-                        "bold": is_bold,
-                        "italic": is_italic,
+                        **span_style_info(span),
                         "text": span.get("text", "").strip() # Return only the text of this specific span
                     }
         
@@ -342,7 +773,7 @@ def get_text_style_in_region(pdf_path, page_number, x1, y1, x2, y2):
                 "message": "Could not determine specific style for aggregated text, returning default."}
 
     except Exception as e:
-        print(f"An unexpected error occurred during style analysis for region: {e}")
+        logger.exception("An unexpected error occurred during style analysis for region: %s", e)
         return None
     finally:
         if doc:
@@ -399,15 +830,280 @@ def get_pymupdf_font_name(font_name, is_bold, is_italic):
     
     return "Helvetica" # Fallback
 
+# Named option sets for saving modified PDFs, from cheapest to smallest output.
+# "fast" appends only the changed objects to a copy of the original (incremental
+# update); if the incremental save fails it falls back to a full save with the
+# remaining options. Options unsupported by the installed PyMuPDF are ignored.
+SAVE_PROFILES = {
+    'fast': {'incremental': True, 'garbage': 0, 'clean': False, 'deflate': False},
+    'balanced': {'garbage': 1, 'clean': False, 'deflate': True},
+    'compact': {'garbage': 4, 'clean': True, 'deflate': True, 'deflate_images': True,
+                'deflate_fonts': True, 'use_objstms': 1},
+}
+DEFAULT_SAVE_PROFILE = 'balanced'
+
+@functools.lru_cache(maxsize=None)
+def _save_parameters():
+    # Keyword arguments this PyMuPDF version's Document.save() accepts
+    return set(inspect.signature(fitz.Document.save).parameters)
+
+def save_pdf_with_profile(doc, output_pdf_path, save_profile=DEFAULT_SAVE_PROFILE):
+    """
+    Saves doc to output_pdf_path with the options of the named save profile.
+
+    Returns:
+        dict: The profile used, whether the save was incremental, its duration and the output size.
+    """
+    options = dict(SAVE_PROFILES[save_profile])
+    incremental = options.pop('incremental', False)
+    options = {key: value for key, value in options.items() if key in _save_parameters()}
+
+    started = time.perf_counter()
+    with timed("save"):
+        same_file = os.path.abspath(doc.name or '') == os.path.abspath(output_pdf_path)
+        if incremental and same_file:
+            # can_save_incrementally() turns false as soon as a page is edited, so just try it
+            try:
+                doc.saveIncr()
+            except (RuntimeError, ValueError) as e:
+                logger.warning("Incremental save of %s failed (%s); doing a full save.", output_pdf_path, e)
+                incremental = False
+        if same_file and not incremental:
+            # A full save can't overwrite the file the document was opened from
+            temp_path = output_pdf_path + '.tmp'
+            doc.save(temp_path, **options)
+            os.replace(temp_path, output_pdf_path)
+        elif not same_file:
+            doc.save(output_pdf_path, **options)
+            incremental = False
+    return {
+        'profile': save_profile,
+        'incremental': incremental,
+        'seconds': round(time.perf_counter() - started, 4),
+        'output_bytes': os.path.getsize(output_pdf_path),
+    }
+
+def insert_replacement_text(page, rect, new_text, font_name, font_size, text_color_hex, is_bold, is_italic):
+    """
+    Inserts new_text into rect (whose old content has been redacted) with the
+    given style, mapped to a PyMuPDF base14 font.
+
+    Returns:
+        float: The insert_textbox() result; negative if the text did not fit.
+    """
+    # Convert hex color to RGB tuple (scaled 0-1)
+    text_color_rgb = hex_to_rgb(text_color_hex)
+    
+    # Attempt to map font name and style to a PyMuPDF base14 font
+    pymupdf_fontname = get_pymupdf_font_name(font_name, is_bold, is_italic)
+    if not pymupdf_fontname: # Fallback if mapping fails (shouldn't with current get_pymupdf_font_name)
+        pymupdf_fontname = "Helvetica" 
+        logger.warning("Could not map font '%s'. Defaulting to '%s'.", font_name, pymupdf_fontname)
+
+    # insert_textbox is used rather than insert_text: it positions the text inside
+    # the box without having to estimate a baseline. It wraps text that is too long
+    # for the box, and returns a negative value if it does not fit at all.
+    # For alignment: 0 (left), 1 (center), 2 (right), 3 (justify)
+    return page.insert_textbox(rect,
+                               new_text,
+                               fontname=pymupdf_fontname,
+                               fontsize=float(font_size),
+                               color=text_color_rgb,
+                               align=0)
+
+def text_overflow(new_text, font_name, font_size, is_bold, is_italic, rect):
+    """
+    How far (in points) new_text, set on one line in the given style, sticks
+    out of rect horizontally; 0.0 if it fits.
+    """
+    pymupdf_fontname = get_pymupdf_font_name(font_name, is_bold, is_italic) or "Helvetica"
+    try:
+        width = fitz.get_text_length(new_text, fontname=pymupdf_fontname, fontsize=float(font_size))
+    except Exception:
+        width = fitz.get_text_length(new_text, fontname="helv", fontsize=float(font_size))
+    return max(0.0, round(width - rect.width, 2))
+
+@functools.lru_cache(maxsize=None)
+def _base14_font(fontname):
+    return fitz.Font(fontname)
+
+def insert_price_text(page, bbox, new_text, style_info):
+    """
+    Writes new_text where a detected price was (its redacted bbox), on the
+    original baseline. Detected bboxes are tight around the glyphs, too short
+    for insert_textbox(), so the text is placed with insert_text() instead.
+
+    Args:
+        page (fitz.Page): The page, with the old price already redacted.
+        bbox (fitz.Rect): The old price's bbox.
+        new_text (str): The replacement.
+        style_info (dict): font, size, color, bold and italic (see span_style_info()).
+    """
+    fontname = get_pymupdf_font_name(style_info.get('font', 'Helvetica'), style_info.get('bold', False),
+                                     style_info.get('italic', False)) or "Helvetica"
+    font_size = float(style_info.get('size') or 10.0)
+    baseline = bbox.y1 + _base14_font(fontname).descender * font_size
+    page.insert_text((bbox.x0, baseline), new_text, fontname=fontname, fontsize=font_size,
+                     color=hex_to_rgb(style_info.get('color', '#000000')))
+
+def _redact_and_insert(page, items):
+    # One apply_redactions() per page, however many prices change on it
+    for item in items:
+        page.add_redact_annot(fitz.Rect(item['bbox']), fill=(1, 1, 1), text="")
+    page.apply_redactions()
+    for item in items:
+        insert_price_text(page, fitz.Rect(item['bbox']), item['new_text'], item.get('style_info', {}))
+
+@profiled("preview_replacements")
+def preview_replacements(pdf_path, replacements, dpi=72, padding=4.0, max_crops=200):
+    """
+    Dry run of a bulk replacement: checks every replacement for overflow and
+    renders low-resolution before/after crops of the changed regions, without
+    saving anything. The edits are made on the opened document only, and only
+    on pages that have crops to render.
+
+    Args:
+        pdf_path (str | bytes): Path to the PDF file, or its contents.
+        replacements (list[dict]): page_number, bbox (x0, y0, x1, y1), new_text
+                                   and style_info of each changed price.
+        dpi (int): Resolution of the crops.
+        padding (float): Points of context around each region.
+        max_crops (int): Crops are rendered for at most this many replacements,
+                         overflowing ones first.
+
+    Returns:
+        list[dict] | None: Per replacement, in order: overflow (points the new
+                           text sticks out of the old bbox, 0.0 if it fits) and
+                           before/after (PNG bytes, or None beyond max_crops).
+    """
+    if _is_missing(pdf_path):
+        logger.error("PDF file not found at %s", _describe(pdf_path))
+        return None
+
+    results = []
+    for item in replacements:
+        style = item.get('style_info', {})
+        overflow = text_overflow(item['new_text'], style.get('font', 'Helvetica'), style.get('size') or 10.0,
+                                 style.get('bold', False), style.get('italic', False), fitz.Rect(item['bbox']))
+        results.append({'overflow': overflow, 'before': None, 'after': None})
+
+    cropped = sorted(range(len(replacements)), key=lambda i: results[i]['overflow'] <= 0)[:max_crops]
+    by_page = {}
+    for index in cropped:
+        by_page.setdefault(replacements[index]['page_number'], []).append(index)
+    changes = {}
+    for item in replacements:
+        changes.setdefault(item['page_number'], []).append(item)
+
+    doc = None
+    try:
+        with timed("open"):
+            doc = open_document(pdf_path)
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        for page_number, indexes in sorted(by_page.items()):
+            if page_number < 0 or page_number >= len(doc):
+                logger.warning("Preview skips page %s, out of range for %s.", page_number, _describe(pdf_path))
+                continue
+            page = doc.load_page(page_number)
+            clips = {}
+            for index in indexes:
+                rect = fitz.Rect(replacements[index]['bbox'])
+                clip = fitz.Rect(rect.x0 - padding, rect.y0 - padding,
+                                 rect.x1 + padding + results[index]['overflow'], rect.y1 + padding)
+                clips[index] = clip & page.rect
+            with timed("render"):
+                before = page.get_displaylist()
+                for index in indexes:
+                    results[index]['before'] = before.get_pixmap(matrix=matrix, clip=clips[index], alpha=False).tobytes("png")
+            with timed("apply_redactions"):
+                # Every change on the page, so that neighbouring edits show in the crops too
+                _redact_and_insert(page, changes[page_number])
+            with timed("render"):
+                after = page.get_displaylist()
+                for index in indexes:
+                    results[index]['after'] = after.get_pixmap(matrix=matrix, clip=clips[index], alpha=False).tobytes("png")
+        return results
+    except Exception as e:
+        logger.exception("Error previewing replacements in %s: %s", _describe(pdf_path), e)
+        return None
+    finally:
+        if doc:
+            doc.close()
+
+@profiled("apply_replacements")
+def apply_replacements(pdf_path, replacements, output_pdf_path, save_profile=DEFAULT_SAVE_PROFILE):
+    """
+    Replaces many detected prices in one pass: one apply_redactions() per
+    changed page and a single save, instead of one open/save per price.
+
+    Args:
+        pdf_path (str | bytes): Path to the original PDF file, or its contents.
+        replacements (list[dict]): page_number, bbox, new_text and style_info of
+                                   each price (see preview_replacements()).
+        output_pdf_path (str): Path to save the modified PDF.
+        save_profile (str): One of SAVE_PROFILES.
+
+    Returns:
+        dict | bool: Save statistics plus input_bytes and replaced (the number
+                     of prices written) if successful, False otherwise.
+    """
+    if _is_missing(pdf_path):
+        logger.error("PDF file not found at %s", _describe(pdf_path))
+        return False
+    if save_profile not in SAVE_PROFILES:
+        logger.error("Unknown save profile '%s'.", save_profile)
+        return False
+
+    source_path = pdf_path
+    if SAVE_PROFILES[save_profile].get('incremental'):
+        # Incremental updates are appended to the opened file, so edit a copy of the original
+        with timed("copy"):
+            if isinstance(pdf_path, (str, os.PathLike)):
+                shutil.copyfile(pdf_path, output_pdf_path)
+            else:
+                with open(output_pdf_path, 'wb') as f:
+                    f.write(pdf_path)
+        source_path = output_pdf_path
+
+    changes = {}
+    for item in replacements:
+        changes.setdefault(item['page_number'], []).append(item)
+
+    doc = None
+    try:
+        with timed("open"):
+            doc = open_document(source_path)
+        replaced = 0
+        with timed("apply_redactions"):
+            for page_number, items in sorted(changes.items()):
+                if page_number < 0 or page_number >= len(doc):
+                    logger.warning("Skipping %s replacements on page %s, out of range for %s.",
+                                   len(items), page_number, _describe(pdf_path))
+                    continue
+                _redact_and_insert(doc.load_page(page_number), items)
+                replaced += len(items)
+
+        stats = save_pdf_with_profile(doc, output_pdf_path, save_profile)
+        stats['input_bytes'] = _source_size(pdf_path)
+        stats['replaced'] = replaced
+        return stats
+    except Exception as e:
+        logger.exception("Error applying replacements to %s: %s", _describe(pdf_path), e)
+        return False
+    finally:
+        if doc:
+            doc.close()
+
+@profiled("replace_text")
 def replace_text_in_pdf_region(pdf_path, page_number, x1, y1, x2, y2, new_text, 
                                font_name, font_size, text_color_hex, is_bold, is_italic, 
-                               output_pdf_path):
+                               output_pdf_path, save_profile=DEFAULT_SAVE_PROFILE):
     """
     Replaces text in a specific region of a PDF page by redacting the old content
     and inserting new text with specified style.
 
     Args:
-        pdf_path (str): Path to the original PDF file.
+        pdf_path (str | bytes): Path to the original PDF file, or its contents.
         page_number (int): 0-indexed page number.
         x1, y1, x2, y2 (float): Coordinates of the bounding box for redaction and text insertion.
         new_text (str): The new text to insert.
@@ -417,24 +1113,46 @@ def replace_text_in_pdf_region(pdf_path, page_number, x1, y1, x2, y2, new_text,
         is_bold (bool): Whether the text should be bold.
         is_italic (bool): Whether the text should be italic.
         output_pdf_path (str): Path to save the modified PDF.
+        save_profile (str): One of SAVE_PROFILES ("fast", "balanced", "compact").
 
     Returns:
-        bool: True if successful, False otherwise.
+        dict | bool: Save statistics from save_pdf_with_profile() plus input_bytes
+                     if successful (truthy), False otherwise.
     """
-    if not os.path.exists(pdf_path):
-        print(f"Error: PDF file not found at {pdf_path}")
+    if _is_missing(pdf_path):
+        logger.error("PDF file not found at %s", _describe(pdf_path))
+        return False
+    if save_profile not in SAVE_PROFILES:
+        logger.error("Unknown save profile '%s'.", save_profile)
         return False
 
+    # Ensure the output directory exists
+    output_dir = os.path.dirname(output_pdf_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    source_path = pdf_path
+    if SAVE_PROFILES[save_profile].get('incremental'):
+        # Incremental updates are appended to the opened file, so edit a copy of the original
+        with timed("copy"):
+            if isinstance(pdf_path, (str, os.PathLike)):
+                shutil.copyfile(pdf_path, output_pdf_path)
+            else:
+                with open(output_pdf_path, 'wb') as f:
+                    f.write(pdf_path)
+        source_path = output_pdf_path
+
     doc = None
     try:
-        doc = fitz.open(pdf_path)
+        with timed("open"):
+            doc = open_document(source_path)
     except Exception as e:
-        print(f"Error opening PDF {pdf_path}: {e}")
+        logger.error("Error opening PDF %s: %s", _describe(source_path), e)
         return False
 
     try:
         if page_number < 0 or page_number >= len(doc):
-            print(f"Error: Page number {page_number} is out of range for PDF (pages: {len(doc)}).")
+            logger.error("Page number %s is out of range for PDF %s (pages: %s).", page_number, _describe(pdf_path), len(doc))
             return False
         
         page = doc.load_page(page_number)
@@ -443,135 +1161,191 @@ def replace_text_in_pdf_region(pdf_path, page_number, x1, y1, x2, y2, new_text,
         # Define the redaction rectangle
         redact_rect = fitz.Rect(float(x1), float(y1), float(x2), float(y2))
         if redact_rect.is_empty or redact_rect.width <= 0 or redact_rect.height <= 0:
-            print(f"Error: Invalid or zero-area redaction rectangle defined by ({x1},{y1},{x2},{y2}).")
+            logger.error("Invalid or zero-area redaction rectangle defined by (%s,%s,%s,%s).", x1, y1, x2, y2)
             return False
         
         # Add redaction annotation with white fill (assuming white background)
         # Note: Redaction fill color might need to match actual page background if not white.
-        page.add_redact_annot(redact_rect, fill=(1, 1, 1), text="") 
-        page.apply_redactions()
+        with timed("apply_redactions"):
+            page.add_redact_annot(redact_rect, fill=(1, 1, 1), text="")
+            page.apply_redactions()
 
         # 2. Add New Text
-        # Convert hex color to RGB tuple (scaled 0-1)
-        text_color_rgb = hex_to_rgb(text_color_hex)
-        
-        # Attempt to map font name and style to a PyMuPDF base14 font
-        pymupdf_fontname = get_pymupdf_font_name(font_name, is_bold, is_italic)
-        if not pymupdf_fontname: # Fallback if mapping fails (shouldn't with current get_pymupdf_font_name)
-            pymupdf_fontname = "Helvetica" 
-            print(f"Warning: Could not map font '{font_name}'. Defaulting to '{pymupdf_fontname}'.")
-
-        # Positioning for insert_text:
-        # PyMuPDF's insert_text uses the bottom-left of the *first character*.
-        # We need to estimate a suitable baseline. A common heuristic is y1 + fontsize.
-        # This will likely require significant fine-tuning.
-        # For textbox, y1 is the top of the box.
-        # Let's try to place it slightly below y1.
-        insertion_point = fitz.Point(float(x1), float(y1) + float(font_size) * 0.9) # Adjust y for baseline
-
-        # Using insert_textbox for potentially better alignment within the defined box
-        # Define the rectangle for the new text. This should ideally be the same as redact_rect or derived.
-        text_insert_rect = fitz.Rect(float(x1), float(y1), float(x2), float(y2))
-
-        # insert_textbox arguments:
-        # rect, buffer, fontname, fontsize, color, align, ...
-        # For alignment: 0 (left), 1 (center), 2 (right), 3 (justify)
-        # We'll default to left alignment for now.
-        # Note: insert_textbox will wrap text. If new_text is too long for the box, it might not look good.
-        
-        # Simpler approach first: insert_text (might be harder to align perfectly in box)
-        # page.insert_text(insertion_point,
-        #                  new_text,
-        #                  fontname=pymupdf_fontname,
-        #                  fontsize=float(font_size),
-        #                  color=text_color_rgb,
-        #                  # rotate=0, morph=None, render_mode=0 (fill text)
-        #                 )
-
-        # Using insert_textbox - often better for fitting text into a region
-        res = page.insert_textbox(text_insert_rect,
-                                  new_text,
-                                  fontname=pymupdf_fontname,
-                                  fontsize=float(font_size),
-                                  color=text_color_rgb,
-                                  align=0) # 0 for left, 1 center, 2 right, 3 justify
+        with timed("insert_textbox"):
+            res = insert_replacement_text(page, redact_rect, new_text, font_name, font_size,
+                                          text_color_hex, is_bold, is_italic)
         
         if res < 0:
-            print(f"Warning: Textbox overflow for document {pdf_path}, page {page_number}. Text may not be fully visible. Overflow amount: {res}")
+            logger.warning("Textbox overflow for document %s, page %s. Text may not be fully visible. Overflow amount: %s", _describe(pdf_path), page_number, res)
 
 
         # 3. Save the modified document
-        # Ensure the output directory exists
-        output_dir = os.path.dirname(output_pdf_path)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-            
-        doc.save(output_pdf_path, garbage=3, deflate=True, clean=True) # Use clean for smaller files
-        return True
+        stats = save_pdf_with_profile(doc, output_pdf_path, save_profile)
+        stats['input_bytes'] = _source_size(pdf_path)
+        stats['size_ratio'] = round(stats['output_bytes'] / stats['input_bytes'], 4) if stats['input_bytes'] else None
+        return stats
 
     except Exception as e:
-        print(f"An unexpected error occurred during PDF text replacement: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("An unexpected error occurred during PDF text replacement: %s", e)
         return False
     finally:
         if doc:
             doc.close()
 
-# Helper function to parse price string
-def parse_price_string(price_text):
-    """Converts a price string (e.g., "$1,234.56", "€123,45") to a float."""
-    if not price_text:
-        return 0.0
-    
-    # Remove common currency symbols and whitespace
-    cleaned_text = re.sub(r'[\$€£грнUAH₴\s]', '', price_text)
-    
-    # Standardize decimal separator to '.'
-    if ',' in cleaned_text and '.' in cleaned_text: # e.g. 1.234,56
-        cleaned_text = cleaned_text.replace('.', '') # Remove thousands separator
-        cleaned_text = cleaned_text.replace(',', '.')
-    elif ',' in cleaned_text: # e.g. 123,45
-        cleaned_text = cleaned_text.replace(',', '.')
-        
+def _count_duplicate_resources(doc):
+    """
+    Counts font and image objects whose definition and stream are identical to
+    an earlier one (e.g. the base-14 font dict every edit adds to its page).
+    Saving with garbage=4 merges them into a single object.
+    """
+    seen = set()
+    duplicates = {'fonts': 0, 'images': 0}
+    for page_number in range(doc.page_count):
+        resources = [('fonts', font[0]) for font in doc.get_page_fonts(page_number, full=True)]
+        resources += [('images', image[0]) for image in doc.get_page_images(page_number, full=True)]
+        for kind, xref in resources:
+            if xref <= 0 or ('xref', xref) in seen:
+                continue
+            seen.add(('xref', xref))
+            digest = hashlib.sha256(doc.xref_object(xref, compressed=True).encode())
+            if doc.xref_is_stream(xref):
+                digest.update(doc.xref_stream_raw(xref))
+            if digest.digest() in seen:
+                duplicates[kind] += 1
+            seen.add(digest.digest())
+    return duplicates
+
+
+def _downsample_images(doc, target_dpi, jpeg_quality):
+    """
+    Re-encodes images displayed above target_dpi (at their largest placement) as
+    JPEGs at target_dpi. Images with transparency are left alone, and so is any
+    image whose re-encoding would not be smaller than its current stream.
+
+    Returns:
+        int: Number of images replaced.
+    """
+    done = set()
+    replaced = 0
+    for page in doc:
+        for image in page.get_images(full=True):
+            xref, smask, width, height = image[0], image[1], image[2], image[3]
+            if xref in done or smask:
+                continue
+            done.add(xref)
+            rects = [r for r in page.get_image_rects(xref) if r.width > 0 and r.height > 0]
+            if not rects:
+                continue
+            # Effective resolution at the largest placement (72 points per inch)
+            scale = max(max(r.width / width, r.height / height) for r in rects)
+            dpi = 72 / scale
+            if dpi <= target_dpi * 1.1:
+                continue
+
+            pix = fitz.Pixmap(doc, xref)
+            if pix.alpha:
+                continue
+            if pix.n not in (1, 3):
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+            factor = target_dpi / dpi
+            small = fitz.Pixmap(pix, max(1, round(width * factor)), max(1, round(height * factor)), None)
+            data = small.tobytes("jpg", jpg_quality=jpeg_quality)
+            if len(data) >= len(doc.xref_stream_raw(xref)):
+                continue
+            page.replace_image(xref, stream=data)
+            replaced += 1
+    return replaced
+
+
+@profiled("optimize")
+def optimize_pdf(pdf_path, output_pdf_path=None, target_dpi=150, jpeg_quality=80,
+                 subset_fonts=True, linearize=True):
+    """
+    Shrinks a PDF: deduplicates identical fonts/images, subsets embedded fonts,
+    downsamples images to target_dpi and saves with full compression, optionally
+    linearized ("fast web view").
+
+    Args:
+        pdf_path (str | bytes): Path to the PDF to optimize, or its contents.
+        output_pdf_path (str): Where to write the result; defaults to pdf_path (in place) when that is a path.
+        target_dpi (int): Images displayed at a higher resolution are downsampled; None keeps them.
+        jpeg_quality (int): JPEG quality for downsampled images.
+        subset_fonts (bool): Subset embedded fonts (needs the optional fontTools package).
+        linearize (bool): Linearize the output for incremental loading in browsers.
+
+    Returns:
+        dict | None: input_bytes, output_bytes, bytes_saved and what was done, or None on error.
+    """
+    output_pdf_path = output_pdf_path or pdf_path
+    started = time.perf_counter()
     try:
-        return float(cleaned_text)
-    except ValueError:
-        print(f"Warning: Could not parse price string '{price_text}' to float. Got '{cleaned_text}'.")
-        return 0.0 # Or raise an error
+        input_bytes = _source_size(pdf_path)
+        with timed("open"):
+            doc = open_document(pdf_path)
+    except Exception as e:
+        logger.error("Error opening PDF %s for optimization: %s", _describe(pdf_path), e)
+        return None
+
+    try:
+        stats = {'input_bytes': input_bytes, 'images_downsampled': 0, 'fonts_subset': False}
+        with timed("dedupe_scan"):
+            stats['duplicates_merged'] = _count_duplicate_resources(doc)
+
+        if target_dpi:
+            with timed("downsample_images"):
+                stats['images_downsampled'] = _downsample_images(doc, target_dpi, jpeg_quality)
+
+        if subset_fonts:
+            with timed("subset_fonts"):
+                try:
+                    doc.subset_fonts()
+                    stats['fonts_subset'] = True
+                except ImportError:
+                    logger.info("fontTools is not installed; skipping font subsetting of %s", _describe(pdf_path))
+
+        # Linearized output can't be written over the open input file
+        temp_path = output_pdf_path + '.tmp'
+        with timed("save"):
+            doc.save(temp_path, garbage=4, clean=True, deflate=True, deflate_images=True,
+                     deflate_fonts=True, linear=linearize)
+        doc.close()
+        doc = None
+        os.replace(temp_path, output_pdf_path)
 
-# Helper function to format new price (basic implementation)
-def format_new_price(original_price_text, new_value_float):
+        stats['output_bytes'] = os.path.getsize(output_pdf_path)
+        stats['bytes_saved'] = input_bytes - stats['output_bytes']
+        stats['linearized'] = bool(linearize)
+        stats['seconds'] = round(time.perf_counter() - started, 4)
+        logger.info("Optimized %s: %s -> %s bytes", _describe(pdf_path), input_bytes, stats['output_bytes'])
+        return stats
+    except Exception as e:
+        logger.exception("Error optimizing PDF %s: %s", _describe(pdf_path), e)
+        return None
+    finally:
+        if doc:
+            doc.close()
+
+# Helper function to parse price string
+def parse_price_string(price_text, price_format=None):
     """
-    Formats a new float price value based on the characteristics of the original price string.
-    (e.g., currency symbol, decimal places). This is a basic heuristic.
+    Converts a price string (e.g., "$1,234.56", "1.234,56 €", "1 234,56 грн") to
+    an exact Decimal, or None if it is not a price. See pricing.parse_price().
     """
-    # Identify currency symbol from original
-    currency_symbol_match = re.match(r'([\$€£грнUAH₴])', original_price_text)
-    currency_symbol = currency_symbol_match.group(1) if currency_symbol_match else ""
-    
-    # Identify decimal places from original (if any)
-    if ',' in original_price_text and '.' not in original_price_text: # european format e.g. 123,45
-        num_decimals = len(original_price_text.split(',')[-1]) if ',' in original_price_text else 0
-        decimal_separator = ','
-    elif '.' in original_price_text: # US/UK format e.g. 123.45
-        num_decimals = len(original_price_text.split('.')[-1]) if '.' in original_price_text else 0
-        decimal_separator = '.'
-    else: # Integer price
-        num_decimals = 0
-        decimal_separator = '.' # Default if no decimal found
-
-    # Ensure num_decimals is typically 0 or 2 for prices, but respect original if different
-    if num_decimals > 2 and original_price_text.replace(',','').replace('.','').isdigit(): # if it's just a number 1.234
-        if decimal_separator == '.': # 1.234 could be 1234
-             if len(original_price_text.split('.')[-1]) == 3 : num_decimals =0 # e.g. 1.234 is 1234 not 1.23
-        elif decimal_separator == ',': # 1,234 could be 1234
-             if len(original_price_text.split(',')[-1]) == 3 : num_decimals =0
-
-
-    formatted_new_value = f"{new_value_float:.{num_decimals}f}"
-    
-    if decimal_separator == ',':
-        formatted_new_value = formatted_new_value.replace('.', ',')
-        
-    return f"{currency_symbol}{formatted_new_value}"
+    value = parse_price(price_text, price_format)
+    if value is None and price_text:
+        logger.warning("Could not parse price string '%s'.", price_text)
+    return value
+
+# Helper function to format new price
+def format_new_price(original_price_text, new_value, price_formats=None):
+    """
+    Formats a new Decimal price value the way the original price string is
+    written: currency symbol and its position, separators, decimal places and
+    ending (e.g. .99). price_formats are the document's learned formats (see
+    pricing.learn_price_formats()); without them the format is learned from
+    the original string alone.
+    """
+    price_format = format_for(original_price_text, price_formats)
+    if price_format is None:
+        price_format = PriceFormat()
+    return price_format.format(new_value)
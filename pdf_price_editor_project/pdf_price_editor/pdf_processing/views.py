@@ -1,12 +1,66 @@
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from concurrent.futures.process import BrokenProcessPool
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from .models import PdfDocument
+from django.conf import settings
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from .models import PdfBatch, PdfBatchItem, PdfDocument
+from .instrumentation import registry, timed
+from .storage import document_path, scratch_path, store_file
+from .admission import AdmissionRejected, admitted
+from .workers import WorkerPoolBusy, run_in_worker
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import base64
+import json
+import logging
 import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# The views for upload, status, download and the PDF processing endpoints are
+# async: they await the database and storage in threads and run PyMuPDF and
+# Tesseract in the bounded worker pool (workers.py), so slow clients don't
+# hold a worker thread each.
+
+async def _aget_user_document(request, document_id):
+    """Async PdfDocument.objects.get(id=document_id, user=request.user); None if there is none."""
+    user = await request.auser()
+    try:
+        return await PdfDocument.objects.aget(id=document_id, user=user)
+    except PdfDocument.DoesNotExist:
+        return None
+
+def _worker_busy_response():
+    response = JsonResponse({'error': 'The server is busy processing other documents. Please retry shortly.'}, status=503)
+    response['Retry-After'] = str(settings.PDF_WORKER_RETRY_AFTER)
+    return response
+
+def _rejected_response(rejection):
+    response = JsonResponse({'error': 'Too many PDF operations in progress. Please retry later.',
+                             'reason': rejection.reason}, status=429)
+    response['Retry-After'] = str(rejection.retry_after)
+    return response
+
+async def _run_admitted(request, operation, func, *args, **kwargs):
+    """
+    run_in_worker() behind the user's admission slot (see admission.py), so
+    that no user can take over the worker pool.
+
+    Raises:
+        AdmissionRejected: The user should retry later (429).
+        WorkerPoolBusy: The pool itself is full (503).
+        BrokenProcessPool: The worker died or the worker daemon timed out (503 as well).
+    """
+    async with admitted(await request.auser(), operation):
+        return await run_in_worker(func, *args, **kwargs)
 
 @csrf_exempt
 @login_required
-def upload_pdf(request):
+async def upload_pdf(request):
     if request.method == 'POST':
         if not request.FILES.get('file'):
             return JsonResponse({'error': 'No file provided.'}, status=400)
@@ -25,11 +79,11 @@ def upload_pdf(request):
 
         try:
             pdf_doc = PdfDocument(
-                user=request.user,
+                user=await request.auser(),
                 uploaded_file=uploaded_file
                 # file_name is set in the model's save() method
             )
-            pdf_doc.save() # This will also set the file_name
+            await pdf_doc.asave() # This will also set the file_name
 
             return JsonResponse({
                 'status': 'success',
@@ -43,34 +97,63 @@ def upload_pdf(request):
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
 
+@login_required
+async def document_status_view(request, document_id):
+    """Cheap polling endpoint: the document's processing state, without its text."""
+    if request.method == 'GET':
+        user = await request.auser()
+        document = await PdfDocument.objects.filter(id=document_id, user=user).values(
+            'id', 'file_name', 'status', 'modified_file', 'prices_indexed_at',
+        ).afirst()
+        if document is None:
+            return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
+        return JsonResponse({
+            'document_id': document['id'],
+            'file_name': document['file_name'],
+            'status': document['status'],
+            'has_modified_file': bool(document['modified_file']),
+            'prices_indexed_at': document['prices_indexed_at'],
+        }, status=200)
+    else:
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+
+async def _stream_file(field_file, chunk_size=256 * 1024):
+    """Reads a stored file chunk by chunk in threads, for StreamingHttpResponse."""
+    f = await sync_to_async(field_file.storage.open, thread_sensitive=False)(field_file.name, 'rb')
+    try:
+        while chunk := await sync_to_async(f.read, thread_sensitive=False)(chunk_size):
+            yield chunk
+    finally:
+        await sync_to_async(f.close, thread_sensitive=False)()
+
 @login_required # No @csrf_exempt needed for GET usually
-def download_modified_pdf_view(request, document_id):
+async def download_modified_pdf_view(request, document_id):
     if request.method == 'GET':
-        try:
-            pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
-        except PdfDocument.DoesNotExist:
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
-        if pdf_doc.modified_file and pdf_doc.modified_file.path:
+        if pdf_doc.modified_file:
             try:
-                # Ensure the file physically exists
-                if not os.path.exists(pdf_doc.modified_file.path):
-                    # Log this critical error: file missing from filesystem
-                    print(f"Error: Modified file for document ID {document_id} not found at path {pdf_doc.modified_file.path}")
+                # Ensure the file exists in storage
+                storage = pdf_doc.modified_file.storage
+                if not await sync_to_async(storage.exists, thread_sensitive=False)(pdf_doc.modified_file.name):
+                    # Log this critical error: file missing from storage
+                    logger.error("Modified file for document ID %s not found in storage as %s", document_id, pdf_doc.modified_file.name)
                     return JsonResponse({'error': 'Modified file not found on server.'}, status=404)
 
                 # Determine a user-friendly filename for download
                 original_filename_base, original_filename_ext = os.path.splitext(pdf_doc.file_name or "document")
                 download_filename = f"{original_filename_base}_modified{original_filename_ext}"
                 
-                # FileResponse handles setting Content-Disposition and Content-Type
-                response = FileResponse(open(pdf_doc.modified_file.path, 'rb'), 
-                                        as_attachment=True, 
-                                        filename=download_filename)
+                # Streamed from storage without holding a thread for the whole transfer
+                response = StreamingHttpResponse(_stream_file(pdf_doc.modified_file), content_type='application/pdf')
+                response['Content-Length'] = await sync_to_async(storage.size, thread_sensitive=False)(pdf_doc.modified_file.name)
+                response['Content-Disposition'] = content_disposition_header(True, download_filename)
                 return response
             except Exception as e:
                 # Log the exception e
-                print(f"Error serving file for document ID {document_id}: {e}")
+                logger.exception("Error serving file for document ID %s: %s", document_id, e)
                 return JsonResponse({'error': 'Error serving the modified file.'}, status=500)
         else:
             return JsonResponse({'error': 'No modified PDF available for download for this document.'}, status=404)
@@ -87,19 +170,26 @@ def delete_document_view(request, document_id):
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
         try:
+            # FieldFile.delete() clears the name, so keep the current revision's
+            current_name = pdf_doc.modified_file.name or ''
+
             # Delete associated files first
             if pdf_doc.uploaded_file:
                 # Check if file exists before trying to delete
-                if os.path.exists(pdf_doc.uploaded_file.path):
+                if pdf_doc.uploaded_file.storage.exists(pdf_doc.uploaded_file.name):
                     pdf_doc.uploaded_file.delete(save=False) # save=False as we'll delete the model instance next
                 else:
-                    print(f"Warning: Original file not found at {pdf_doc.uploaded_file.path} for doc ID {pdf_doc.id} during delete.")
+                    logger.warning("Original file %s not found for doc ID %s during delete.", pdf_doc.uploaded_file.name, pdf_doc.id)
             
             if pdf_doc.modified_file:
-                if os.path.exists(pdf_doc.modified_file.path):
+                if pdf_doc.modified_file.storage.exists(pdf_doc.modified_file.name):
                     pdf_doc.modified_file.delete(save=False)
                 else:
-                    print(f"Warning: Modified file not found at {pdf_doc.modified_file.path} for doc ID {pdf_doc.id} during delete.")
+                    logger.warning("Modified file %s not found for doc ID %s during delete.", pdf_doc.modified_file.name, pdf_doc.id)
+
+            # Superseded revisions; the current one (modified_file) was deleted above
+            for revision in pdf_doc.revisions.exclude(file=current_name):
+                revision.file.delete(save=False)
 
             # Delete the PdfDocument record from the database
             pdf_doc.delete()
@@ -108,7 +198,7 @@ def delete_document_view(request, document_id):
 
         except Exception as e:
             # Log the exception e
-            print(f"Error deleting document or its files for doc ID {pdf_doc.id}: {e}")
+            logger.exception("Error deleting document or its files for doc ID %s: %s", pdf_doc.id, e)
             # Potentially return a 500 error if deletion of files or model fails partially
             return JsonResponse({'error': f'An error occurred while deleting the document: {str(e)}'}, status=500)
             
@@ -138,9 +228,44 @@ def list_user_documents_view(request):
     else:
         return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
 
+def _default_save_profile(user):
+    # The user's default, else the site default (the profile is a separate query)
+    profile = getattr(user, 'profile', None)
+    return (profile and profile.pdf_save_profile) or settings.PDF_DEFAULT_SAVE_PROFILE
+
+def _replace_in_worker(original_pdf, output_pdf_path, replace_args, save_profile, optimize, target_dpi, known_pages):
+    """
+    Runs in a worker process: replaces the text, optionally optimizes the result
+    and, when known_pages is given, re-extracts the pages whose content changed.
+
+    Returns:
+        tuple: (save stats or False, optimization stats or None, extracted pages or None)
+    """
+    from .utils import replace_text_in_pdf_region, optimize_pdf, extract_pages_from_pdf
+
+    success = replace_text_in_pdf_region(original_pdf, *replace_args, output_pdf_path, save_profile=save_profile)
+    if not success:
+        return success, None, None
+    optimization = optimize_pdf(output_pdf_path, target_dpi=target_dpi) if optimize else None
+    pages = None
+    if known_pages is not None:
+        # Only the edited page has a new content hash, so only that page is re-extracted
+        pages = extract_pages_from_pdf(output_pdf_path, known_pages=known_pages)
+    return success, optimization, pages
+
+def _store_replacement(pdf_doc, output_pdf_path, modified_filename, save_profile, pages):
+    with timed("store"):
+        stored_name = store_file(f'user_{pdf_doc.user_id}/pdfs/modified/{modified_filename}', output_pdf_path)
+    pdf_doc.mark_completed(modified_file=stored_name) # Or a more specific status like 'modified'
+    pdf_doc.record_revision(stored_name, size_bytes=os.path.getsize(output_pdf_path), save_profile=save_profile)
+    if pages is not None:
+        # Keep the text/price index in step with the modified file
+        pdf_doc.store_extraction(pages)
+        pdf_doc.transition('completed', extracted_text="".join(page['text'] for page in pages))
+
 @csrf_exempt
 @login_required
-def replace_text_region_view(request, document_id):
+async def replace_text_region_view(request, document_id):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
@@ -152,12 +277,14 @@ def replace_text_region_view(request, document_id):
             percentage_increase = data.get('percentage_increase')
             original_price_text = data.get('original_price_text')
             style_info = data.get('style_info')
+            save_profile = data.get('save_profile')
+            optimize = data.get('optimize', False)
 
             if not all(isinstance(coord, (int, float)) for coord in [x1, y1, x2, y2]) or \
                not isinstance(page_number, int) or page_number < 0 or \
                not isinstance(percentage_increase, (int, float)) or \
                not isinstance(original_price_text, str) or not original_price_text or \
-               not isinstance(style_info, dict):
+               not isinstance(style_info, dict) or not isinstance(optimize, bool):
                 return JsonResponse({'error': 'Invalid or missing required parameters in request body.'}, status=400)
 
         except json.JSONDecodeError:
@@ -165,28 +292,37 @@ def replace_text_region_view(request, document_id):
         except Exception as e:
             return JsonResponse({'error': f'Error processing request: {str(e)}'}, status=400)
 
-        try:
-            pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
-        except PdfDocument.DoesNotExist:
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
-        if not pdf_doc.uploaded_file or not pdf_doc.uploaded_file.path:
+        if not pdf_doc.uploaded_file:
             return JsonResponse({'error': 'Original file path not found for document.'}, status=500)
         
-        original_pdf_path = pdf_doc.uploaded_file.path
-        if not os.path.exists(original_pdf_path):
-            print(f"Error: Original file for document ID {document_id} not found at path {original_pdf_path}")
+        # Workers open the document from a node-local path (fetched into the cache if remote)
+        original_pdf = await sync_to_async(document_path, thread_sensitive=False)(pdf_doc.uploaded_file)
+        if original_pdf is None:
+            logger.error("Original file for document ID %s not found in storage as %s", document_id, pdf_doc.uploaded_file.name)
             return JsonResponse({'error': 'Original file not found on server.'}, status=500)
 
-        from .utils import replace_text_in_pdf_region, parse_price_string, format_new_price
+        from .utils import parse_price_string, format_new_price, SAVE_PROFILES
+        from .pricing import format_for
 
-        # Calculate new price
-        original_price_value = parse_price_string(original_price_text)
-        if original_price_value is None: # parse_price_string now returns 0.0 on error, so this check may change
+        # Per-request profile, else the user's default, else the site default
+        if not save_profile:
+            save_profile = await sync_to_async(_default_save_profile)(await request.auser())
+        if not isinstance(save_profile, str) or save_profile not in SAVE_PROFILES:
+            return JsonResponse({'error': f"Unknown save_profile '{save_profile}'. Use one of: {', '.join(SAVE_PROFILES)}."}, status=400)
+
+        # Calculate new price with exact Decimal arithmetic, formatted the way the document writes prices
+        price_formats = pdf_doc.learned_price_formats()
+        original_price_value = parse_price_string(original_price_text, format_for(original_price_text, price_formats))
+        if original_price_value is None:
              return JsonResponse({'error': f'Could not parse original price text: {original_price_text}'}, status=400)
         
-        new_price_value = original_price_value * (1 + (float(percentage_increase) / 100.0))
-        new_price_text = format_new_price(original_price_text, new_price_value)
+        # str() first: the JSON float 10.1 must become Decimal('10.1'), not its binary approximation
+        new_price_value = original_price_value * (1 + Decimal(str(percentage_increase)) / 100)
+        new_price_text = format_new_price(original_price_text, new_price_value, price_formats)
 
         # Prepare style arguments from style_info
         font_name = style_info.get('font', 'Helvetica')
@@ -197,51 +333,102 @@ def replace_text_region_view(request, document_id):
 
         # Define output path for the modified PDF
         # Example: MEDIA_ROOT/user_<id>/pdfs/modified/original_filename_modified_timestamp.pdf
-        base_filename = os.path.basename(original_pdf_path)
+        base_filename = os.path.basename(pdf_doc.uploaded_file.name)
         name, ext = os.path.splitext(base_filename)
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         modified_filename = f"{name}_mod_{timestamp}{ext}"
         
-        # Construct path within MEDIA_ROOT using the user_directory_path logic if possible, or manually
-        # Assuming user_directory_path places it in user_<id>/pdfs/originals/
-        # So, modified path should be user_<id>/pdfs/modified/
-        user_specific_modified_dir = os.path.join(settings.MEDIA_ROOT, f'user_{pdf_doc.user.id}', 'pdfs', 'modified')
-        if not os.path.exists(user_specific_modified_dir):
-            os.makedirs(user_specific_modified_dir, exist_ok=True)
-        output_pdf_path = os.path.join(user_specific_modified_dir, modified_filename)
-        
-        success = replace_text_in_pdf_region(
-            original_pdf_path, page_number, x1, y1, x2, y2, new_price_text,
-            font_name, font_size, text_color_hex, is_bold, is_italic,
-            output_pdf_path
-        )
+        # The result is written to a node-local scratch file and then stored as
+        # user_<id>/pdfs/modified/<name>_mod_<timestamp>.pdf (or a free variant of it)
+        known_pages = None
+        if pdf_doc.prices_indexed_at is not None:
+            known_pages = await sync_to_async(pdf_doc.known_page_hashes)()
+        output_pdf_path = scratch_path()
+        try:
+            success, optimization, pages = await _run_admitted(
+                request, 'replace', _replace_in_worker, original_pdf, output_pdf_path,
+                (page_number, x1, y1, x2, y2, new_price_text,
+                 font_name, font_size, text_color_hex, is_bold, is_italic),
+                save_profile, optimize, settings.PDF_OPTIMIZE_TARGET_DPI, known_pages,
+            )
+            if success:
+                await sync_to_async(_store_replacement)(pdf_doc, output_pdf_path, modified_filename, save_profile, pages)
+        except AdmissionRejected as rejection:
+            return _rejected_response(rejection)
+        except (WorkerPoolBusy, BrokenProcessPool): # Full, or a worker died: retry shortly
+            return _worker_busy_response()
+        finally:
+            if os.path.exists(output_pdf_path):
+                os.remove(output_pdf_path)
 
         if success:
-            # Save the path to the modified file in PdfDocument
-            # The path stored should be relative to MEDIA_ROOT for FileField
-            relative_output_path = os.path.join(f'user_{pdf_doc.user.id}', 'pdfs', 'modified', modified_filename)
-            pdf_doc.modified_file.name = relative_output_path # Assign to .name for FileField
-            pdf_doc.status = 'completed' # Or a more specific status like 'modified'
-            pdf_doc.save()
-            
             return JsonResponse({
                 'status': 'success',
                 'message': 'Text replaced successfully.',
                 'modified_document_id': pdf_doc.id,
                 'new_price_text': new_price_text,
+                'save': success, # Profile, incremental flag, seconds, input/output bytes
+                'optimization': optimization, # None unless requested
                 'modified_file_url': request.build_absolute_uri(pdf_doc.modified_file.url) if pdf_doc.modified_file else None
             }, status=200)
         else:
-            pdf_doc.status = 'failed'
-            pdf_doc.save()
+            await sync_to_async(pdf_doc.mark_failed)()
             return JsonResponse({'error': 'Failed to replace text in PDF.'}, status=500)
             
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
 
+def _store_optimized(pdf_doc, output_pdf_path, stats):
+    stored_name = store_file(pdf_doc.modified_file.name, output_pdf_path)
+    pdf_doc.transition(pdf_doc.status, modified_file=stored_name)
+    pdf_doc.record_revision(stored_name, size_bytes=stats['output_bytes'])
+
+@csrf_exempt
+@login_required
+async def optimize_pdf_view(request, document_id):
+    """Shrinks the document's modified file in place and reports the bytes saved."""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body) if request.body else {}
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+
+        target_dpi = data.get('target_dpi', settings.PDF_OPTIMIZE_TARGET_DPI)
+        linearize = data.get('linearize', True)
+        if (target_dpi is not None and (not isinstance(target_dpi, int) or target_dpi < 36)) or \
+           not isinstance(linearize, bool):
+            return JsonResponse({'error': 'target_dpi must be an integer >= 36 (or null) and linearize a boolean.'}, status=400)
+
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
+            return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
+
+        modified_pdf = await sync_to_async(document_path, thread_sensitive=False)(pdf_doc.modified_file)
+        if modified_pdf is None:
+            return JsonResponse({'error': 'Document has no modified file to optimize.'}, status=400)
+
+        from .utils import optimize_pdf
+        # Stored names are never overwritten, so the optimized file becomes a new revision
+        output_pdf_path = scratch_path()
+        try:
+            stats = await _run_admitted(request, 'optimize', optimize_pdf, modified_pdf, output_pdf_path,
+                                        target_dpi=target_dpi, linearize=linearize)
+            if stats is None:
+                return JsonResponse({'error': 'Failed to optimize PDF.'}, status=500)
+            await sync_to_async(_store_optimized)(pdf_doc, output_pdf_path, stats)
+        except AdmissionRejected as rejection:
+            return _rejected_response(rejection)
+        except (WorkerPoolBusy, BrokenProcessPool): # Full, or a worker died: retry shortly
+            return _worker_busy_response()
+        finally:
+            os.remove(output_pdf_path)
+        return JsonResponse({'status': 'success', 'document_id': pdf_doc.id, 'optimization': stats}, status=200)
+    else:
+        return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
+
 @csrf_exempt
 @login_required
-def analyze_text_style_view(request, document_id):
+async def analyze_text_style_view(request, document_id):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
@@ -260,22 +447,26 @@ def analyze_text_style_view(request, document_id):
         except Exception as e:
             return JsonResponse({'error': f'Error processing request: {str(e)}'}, status=400)
 
-        try:
-            pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
-        except PdfDocument.DoesNotExist:
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
-        if not pdf_doc.uploaded_file or not pdf_doc.uploaded_file.path:
+        if not pdf_doc.uploaded_file:
             return JsonResponse({'error': 'File path not found for document.'}, status=500)
         
-        pdf_path = pdf_doc.uploaded_file.path
-        if not os.path.exists(pdf_path):
-            print(f"Error: File for document ID {document_id} not found at path {pdf_path}")
+        pdf_path = await sync_to_async(document_path, thread_sensitive=False)(pdf_doc.uploaded_file)
+        if pdf_path is None:
+            logger.error("File for document ID %s not found in storage as %s", document_id, pdf_doc.uploaded_file.name)
             return JsonResponse({'error': 'File not found on server for style analysis.'}, status=500)
 
         from .utils import get_text_style_in_region # Local import
 
-        style_info = get_text_style_in_region(pdf_path, page_number, x1, y1, x2, y2)
+        try:
+            style_info = await _run_admitted(request, 'style', get_text_style_in_region, pdf_path, page_number, x1, y1, x2, y2)
+        except AdmissionRejected as rejection:
+            return _rejected_response(rejection)
+        except (WorkerPoolBusy, BrokenProcessPool): # Full, or a worker died: retry shortly
+            return _worker_busy_response()
 
         if style_info:
             # If the function returns a message (e.g. "No text found..."), it's not an error but an outcome.
@@ -299,9 +490,41 @@ def analyze_text_style_view(request, document_id):
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
 
+TESSERACT_LANGUAGE = re.compile(r'^[a-z_]{3,}(\+[a-z_]{3,})*$') # e.g. 'ukr' or 'ukr+ita+eng'
+
+def _ocr_language(requested, pdf_doc, user):
+    """
+    Picks the Tesseract language for OCR of a document's region.
+
+    Args:
+        requested (str | None): The request's 'language': a profile language code
+            (a key of PDF_OCR_LANGUAGES, e.g. 'uk') or Tesseract codes (e.g. 'ukr+eng').
+        pdf_doc (PdfDocument): The document; its language is detected at extraction.
+        user (User): The requesting user, whose profile language is the fallback.
+
+    Returns:
+        tuple: (Tesseract language, where it came from: 'request', 'document', 'profile' or 'default').
+
+    Raises:
+        ValueError: If the requested language is not a valid language code.
+    """
+    if requested:
+        if isinstance(requested, str) and requested in settings.PDF_OCR_LANGUAGES:
+            return settings.PDF_OCR_LANGUAGES[requested], 'request'
+        if not isinstance(requested, str) or not TESSERACT_LANGUAGE.match(requested):
+            raise ValueError(f"Invalid language '{requested}'. Use a Tesseract code such as 'eng' or 'ukr+ita'.")
+        return requested, 'request'
+    if pdf_doc.language:
+        return pdf_doc.language, 'document'
+    # The profile is a separate query
+    profile = getattr(user, 'profile', None)
+    if profile is not None and profile.preferred_language in settings.PDF_OCR_LANGUAGES:
+        return settings.PDF_OCR_LANGUAGES[profile.preferred_language], 'profile'
+    return 'eng', 'default'
+
 @csrf_exempt
 @login_required
-def ocr_text_from_region_view(request, document_id):
+async def ocr_text_from_region_view(request, document_id):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
@@ -310,34 +533,48 @@ def ocr_text_from_region_view(request, document_id):
             y1 = data.get('y1')
             x2 = data.get('x2')
             y2 = data.get('y2')
-            language = data.get('language', 'eng') # Default to English if not provided
+            language = data.get('language') # Else the document's, then the user's profile language
+            mode = data.get('mode', 'text') # 'price': a single-line price region, see preprocessing.py
 
             if not all(isinstance(coord, (int, float)) for coord in [x1, y1, x2, y2]) or \
                not isinstance(page_number, int) or page_number < 0:
                 return JsonResponse({'error': 'Invalid or missing coordinates or page number.'}, status=400)
+            from .preprocessing import OCR_MODES # Local import
+            if mode not in OCR_MODES:
+                return JsonResponse({'error': f"Invalid mode '{mode}'. Use one of: {', '.join(OCR_MODES)}."}, status=400)
 
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
         except Exception as e: # Catch any other error during request parsing
             return JsonResponse({'error': f'Error processing request: {str(e)}'}, status=400)
 
-        try:
-            pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
-        except PdfDocument.DoesNotExist:
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
-        if not pdf_doc.uploaded_file or not pdf_doc.uploaded_file.path:
+        if not pdf_doc.uploaded_file:
             return JsonResponse({'error': 'File path not found for document.'}, status=500)
         
-        pdf_path = pdf_doc.uploaded_file.path
-        if not os.path.exists(pdf_path):
-            # Log this critical error: file missing from filesystem
-            print(f"Error: File for document ID {document_id} not found at path {pdf_path}")
+        pdf_path = await sync_to_async(document_path, thread_sensitive=False)(pdf_doc.uploaded_file)
+        if pdf_path is None:
+            # Log this critical error: file missing from storage
+            logger.error("File for document ID %s not found in storage as %s", document_id, pdf_doc.uploaded_file.name)
             return JsonResponse({'error': 'File not found on server for OCR.'}, status=500)
 
+        try:
+            language, language_source = await sync_to_async(_ocr_language)(language, pdf_doc, await request.auser())
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
         from .utils import extract_text_from_region_ocr # Local import
 
-        ocr_text = extract_text_from_region_ocr(pdf_path, page_number, x1, y1, x2, y2, language=language)
+        try:
+            ocr_text = await _run_admitted(request, 'ocr', extract_text_from_region_ocr, pdf_path,
+                                           page_number, x1, y1, x2, y2, language=language, mode=mode)
+        except AdmissionRejected as rejection:
+            return _rejected_response(rejection)
+        except (WorkerPoolBusy, BrokenProcessPool): # Full, or a worker died: retry shortly
+            return _worker_busy_response()
 
         if ocr_text is not None:
             return JsonResponse({
@@ -345,99 +582,425 @@ def ocr_text_from_region_view(request, document_id):
                 'document_id': pdf_doc.id,
                 'region_coordinates': [x1, y1, x2, y2],
                 'ocr_text': ocr_text,
-                'language_used': language
+                'language_used': language,
+                'language_source': language_source,
+                'mode': mode,
             }, status=200)
         else:
-            # Check if Tesseract is installed if specific error occurs
-            if "Tesseract is not installed" in str(ocr_text_or_error_msg_if_any_from_util_func): # This part is pseudo-code
-                 return JsonResponse({'error': 'OCR processing failed: Tesseract might not be installed or configured correctly on the server.'}, status=500)
+            # The worker logged the cause (e.g. Tesseract or the language's traineddata missing)
             return JsonResponse({'error': 'OCR processing failed for the specified region.'}, status=500)
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
 
+PRICE_SORT_ORDERS = {
+    'position': ('page_number', 'y0', 'x0'),
+    'value': ('value', 'page_number', 'y0', 'x0'),
+    '-value': ('-value', 'page_number', 'y0', 'x0'),
+}
+DEFAULT_PRICE_PAGE_SIZE = 100
+MAX_PRICE_PAGE_SIZE = 1000
+
+def _optional_param(params, name, convert):
+    """Returns convert(params[name]), None if absent, or raises ValueError with a user-facing message."""
+    raw = params.get(name)
+    if raw is None or raw == '':
+        return None
+    try:
+        return convert(raw)
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValueError(f"Invalid value for '{name}': {raw}")
+
+def _parse_price_query(params):
+    """
+    Validates the filtering/pagination parameters of identify_prices_view.
+    Raises ValueError with a user-facing message on invalid input.
+    """
+    def optional(name, convert):
+        return _optional_param(params, name, convert)
+
+    query = {
+        'page_number': optional('page_number', int),
+        'column': optional('column', int), # Price column on the page, see layout.py
+        'currency': optional('currency', lambda v: str(v).upper()),
+        'min_value': optional('min_value', lambda v: Decimal(str(v))),
+        'max_value': optional('max_value', lambda v: Decimal(str(v))),
+        'limit': optional('limit', int) or DEFAULT_PRICE_PAGE_SIZE,
+        'offset': optional('offset', int) or 0,
+        'sort': params.get('sort') or 'position',
+    }
+    if query['sort'] not in PRICE_SORT_ORDERS:
+        raise ValueError(f"Invalid value for 'sort': {query['sort']}. Use one of {', '.join(PRICE_SORT_ORDERS)}.")
+    if query['limit'] < 1 or query['offset'] < 0:
+        raise ValueError("'limit' must be positive and 'offset' must not be negative.")
+    query['limit'] = min(query['limit'], MAX_PRICE_PAGE_SIZE)
+    return query
+
 @csrf_exempt
 @login_required
 def identify_prices_view(request, document_id):
-    if request.method == 'POST':
+    if request.method in ('GET', 'POST'):
         try:
             pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
         except PdfDocument.DoesNotExist:
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
         if not pdf_doc.extracted_text:
-            # Optionally, could trigger text extraction here if not done
-            # For now, require text to be extracted first.
-            pdf_doc.status = 'failed' # Or a more specific status like 'text_extraction_pending'
-            pdf_doc.save()
+            # Querying leaves the document's status alone; extract-text is what fails it
             return JsonResponse({'error': 'Text has not been extracted from this document yet.'}, status=400)
-        
-        from .utils import identify_prices_in_text # Local import
+        if pdf_doc.prices_indexed_at is None:
+            # Documents extracted before the price index existed are indexed by extract-text,
+            # which claims the document and runs in the worker pool; this view only queries
+            return JsonResponse({'error': 'Prices have not been indexed yet; extract the text first.'}, status=409)
+
+        # Filters come from the query string, or from the JSON body for POST requests
+        params = request.GET.dict()
+        if request.method == 'POST' and request.body:
+            try:
+                body = json.loads(request.body)
+            except json.JSONDecodeError:
+                return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+            if isinstance(body, dict):
+                params.update(body)
+        try:
+            query = _parse_price_query(params)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        occurrences = pdf_doc.price_occurrences.all()
+        if query['page_number'] is not None:
+            occurrences = occurrences.filter(page_number=query['page_number'])
+        if query['column'] is not None:
+            occurrences = occurrences.filter(column=query['column'])
+        if query['currency'] is not None:
+            occurrences = occurrences.filter(currency=query['currency'])
+        if query['min_value'] is not None:
+            occurrences = occurrences.filter(value__gte=query['min_value'])
+        if query['max_value'] is not None:
+            occurrences = occurrences.filter(value__lte=query['max_value'])
+
+        total = occurrences.count()
+        offset, limit = query['offset'], query['limit']
+        occurrences = occurrences.order_by(*PRICE_SORT_ORDERS[query['sort']])[offset:offset + limit]
+
+        return JsonResponse({
+            'status': 'success',
+            'document_id': pdf_doc.id,
+            'file_name': pdf_doc.file_name,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'identified_prices': [occurrence.to_dict() for occurrence in occurrences]
+        }, status=200)
+    else:
+        return JsonResponse({'error': 'Only GET or POST requests are allowed'}, status=405)
 
-        identified_prices = identify_prices_in_text(pdf_doc.extracted_text)
+@csrf_exempt
+@login_required
+def reprice_preview_view(request, document_id):
+    """Dry run of a bulk repricing rule set (see repricing.py): old -> new for every price, nothing is written."""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
 
-        # You might want a new status like 'prices_identified'
-        # For now, let's assume 'completed' covers this stage if successful.
-        # If price identification is a distinct step that can fail, add appropriate status.
-        if identified_prices is not None: # identify_prices_in_text returns [] for no prices, not None for error
-            # pdf_doc.status = 'prices_identified' # Example of a new status
-            # pdf_doc.save()
-            return JsonResponse({
-                'status': 'success',
-                'document_id': pdf_doc.id,
-                'file_name': pdf_doc.file_name,
-                'identified_prices': identified_prices
-            }, status=200)
-        else:
-            # This 'else' might not be reachable if identify_prices_in_text always returns a list.
-            # It depends on its error handling. Assuming it could return None for a major internal error.
-            pdf_doc.status = 'failed' # Or 'price_identification_failed'
-            pdf_doc.save()
-            return JsonResponse({'error': 'Failed to identify prices in the document.'}, status=500)
-            
+        from .repricing import RuleSet # Local import
+        try:
+            rule_set = RuleSet.from_dict(data.get('rules') if isinstance(data, dict) else None)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        try:
+            pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
+        except PdfDocument.DoesNotExist:
+            return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
+
+        if pdf_doc.prices_indexed_at is None:
+            return JsonResponse({'error': 'Prices have not been indexed yet; extract the text first.'}, status=400)
+
+        rows = pdf_doc.evaluate_price_rules(rule_set)
+        totals = {}
+        for row in rows:
+            total = totals.setdefault(row['currency'], {'before': Decimal(0), 'after': Decimal(0)})
+            total['before'] += row['old_value']
+            total['after'] += row['new_value']
+            row['changed'] = row['new_text'] != row['old_text']
+            row['old_value'], row['new_value'] = str(row['old_value']), str(row['new_value'])
+        return JsonResponse({
+            'status': 'success',
+            'document_id': pdf_doc.id,
+            'total': len(rows),
+            'changed': sum(1 for row in rows if row['changed']),
+            'totals': {currency: {key: str(value) for key, value in total.items()} for currency, total in totals.items()},
+            'prices': rows,
+        }, status=200)
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
 
+def _png_data_uri(png):
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii') if png else None
+
 @csrf_exempt
 @login_required
-def extract_pdf_text_view(request, document_id):
+async def reprice_diff_view(request, document_id):
+    """
+    Dry run of a bulk repricing that also checks every changed price for
+    overflow and renders low-resolution before/after crops of the changed
+    regions. No PDF is saved.
+    """
     if request.method == 'POST':
         try:
-            pdf_doc = PdfDocument.objects.get(id=document_id, user=request.user)
-        except PdfDocument.DoesNotExist:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+
+        from .repricing import RuleSet # Local import
+        try:
+            rule_set = RuleSet.from_dict(data.get('rules'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        dpi = data.get('dpi', 72)
+        max_crops = data.get('max_crops', settings.PDF_PREVIEW_MAX_CROPS)
+        if not isinstance(dpi, int) or not 36 <= dpi <= 150 or \
+           not isinstance(max_crops, int) or not 0 <= max_crops <= settings.PDF_PREVIEW_MAX_CROPS:
+            return JsonResponse({'error': f'dpi must be an integer from 36 to 150 and max_crops from 0 to {settings.PDF_PREVIEW_MAX_CROPS}.'}, status=400)
+
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
+            return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
+        if pdf_doc.prices_indexed_at is None:
+            return JsonResponse({'error': 'Prices have not been indexed yet; extract the text first.'}, status=400)
+
+        rows = await sync_to_async(pdf_doc.evaluate_price_rules)(rule_set)
+        changed = [row for row in rows if row['new_text'] != row['old_text']]
+
+        # The index describes the latest file: the modified one once prices were replaced
+        pdf_path = await sync_to_async(document_path, thread_sensitive=False)(pdf_doc.modified_file or pdf_doc.uploaded_file)
+        if pdf_path is None:
+            return JsonResponse({'error': 'File not found on server.'}, status=500)
+
+        from .utils import preview_replacements # Local import
+        try:
+            previews = await _run_admitted(request, 'preview', preview_replacements, pdf_path, [
+                {'page_number': row['page_number'], 'bbox': row['bbox'], 'new_text': row['new_text'],
+                 'style_info': row['style_info']} for row in changed
+            ], dpi=dpi, max_crops=max_crops)
+        except AdmissionRejected as rejection:
+            return _rejected_response(rejection)
+        except (WorkerPoolBusy, BrokenProcessPool): # Full, or a worker died: retry shortly
+            return _worker_busy_response()
+        if previews is None:
+            return JsonResponse({'error': 'Failed to render the preview.'}, status=500)
+
+        return JsonResponse({
+            'status': 'success',
+            'document_id': pdf_doc.id,
+            'total': len(rows),
+            'changed': len(changed),
+            'overflowing': sum(1 for preview in previews if preview['overflow'] > 0),
+            'diff': [
+                {
+                    'id': row['id'],
+                    'page_number': row['page_number'],
+                    'bbox': row['bbox'],
+                    'old_text': row['old_text'],
+                    'new_text': row['new_text'],
+                    'old_value': str(row['old_value']),
+                    'new_value': str(row['new_value']),
+                    'overflow': preview['overflow'], # Points past the old bbox, 0.0 if the new text fits
+                    'before': _png_data_uri(preview['before']),
+                    'after': _png_data_uri(preview['after']),
+                }
+                for row, preview in zip(changed, previews)
+            ],
+        }, status=200)
+    else:
+        return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
+
+@csrf_exempt
+@login_required
+async def extract_pdf_text_view(request, document_id):
+    if request.method == 'POST':
+        pdf_doc = await _aget_user_document(request, document_id)
+        if pdf_doc is None:
             return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
 
-        if not pdf_doc.uploaded_file or not pdf_doc.uploaded_file.path:
+        if not pdf_doc.uploaded_file:
             return JsonResponse({'error': 'File path not found for document.'}, status=500)
             
-        pdf_path = pdf_doc.uploaded_file.path
-        
-        # Ensure the file actually exists at the path stored
-        if not os.path.exists(pdf_path):
-            pdf_doc.status = 'failed'
-            pdf_doc.save()
-            # Log this critical error: file missing from filesystem
-            print(f"Error: File for document ID {document_id} not found at path {pdf_path}")
+        # Ensure the file actually exists in storage
+        pdf_path = await sync_to_async(document_path, thread_sensitive=False)(pdf_doc.uploaded_file)
+        if pdf_path is None:
+            await sync_to_async(pdf_doc.mark_failed)()
+            # Log this critical error: file missing from storage
+            logger.error("File for document ID %s not found in storage as %s", document_id, pdf_doc.uploaded_file.name)
             return JsonResponse({'error': 'File not found on server.'}, status=500)
 
-        pdf_doc.status = 'processing'
-        pdf_doc.save()
+        previous_status = pdf_doc.status
+        if not await sync_to_async(pdf_doc.start_processing)():
+            # Another request changed the document's state after we loaded it
+            return JsonResponse({'error': 'Document is being processed by another request.'}, status=409)
 
-        from .utils import extract_text_from_pdf # Local import to avoid circular dependency if utils grows
-        extracted_text = extract_text_from_pdf(pdf_path)
+        from .utils import extract_pages_from_pdf # Local import to avoid circular dependency if utils grows
+        try:
+            # Pages whose content hash is already stored are not extracted again
+            known_pages = await sync_to_async(pdf_doc.known_page_hashes)()
+            pages = await _run_admitted(request, 'extract', extract_pages_from_pdf, pdf_path, known_pages=known_pages)
+            if pages is None:
+                await sync_to_async(pdf_doc.mark_failed)(expected_status='processing')
+                return JsonResponse({'error': 'Failed to extract text from PDF.'}, status=500)
+
+            # Prices are detected once here; identify-prices and search only query the stored index
+            def store_index():
+                with timed("store_index"):
+                    return pdf_doc.store_extraction(pages)
+            stats = await sync_to_async(store_index)()
+            extracted_text = "".join(page['text'] for page in pages)
+            # Assuming 'completed' means text extracted successfully
+            await sync_to_async(pdf_doc.mark_completed)(expected_status='processing', extracted_text=extracted_text)
+        except AdmissionRejected as rejection:
+            return _rejected_response(rejection) # The claim is released below, for the retry to take
+        except (WorkerPoolBusy, BrokenProcessPool):
+            return _worker_busy_response()
+        except Exception:
+            logger.exception("Storing the extraction of document %s failed", document_id)
+            await sync_to_async(pdf_doc.mark_failed)(expected_status='processing')
+            return JsonResponse({'error': 'Failed to store the text extracted from the PDF.'}, status=500)
+        finally:
+            if pdf_doc.status == 'processing':
+                # Nothing was stored (rejected, or the request was cancelled): release the claim.
+                # A claim taken over from an interrupted run goes back to failed, not to 'processing'
+                release_to = previous_status if previous_status != 'processing' else 'failed'
+                await sync_to_async(pdf_doc.transition)(release_to, expected_status='processing')
+
+        return JsonResponse({
+            'status': 'success',
+            'document_id': pdf_doc.id,
+            'file_name': pdf_doc.file_name,
+            'extracted_text': extracted_text,
+            'prices_found': await pdf_doc.price_occurrences.acount(),
+            'pages_extracted': stats['pages_extracted'],
+            'pages_reused': stats['pages_reused']
+        }, status=200)
+    else:
+        return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
 
-        if extracted_text is not None:
-            pdf_doc.status = 'completed' # Assuming 'completed' means text extracted successfully
-            pdf_doc.extracted_text = extracted_text # Save extracted text
-            pdf_doc.save()
-            return JsonResponse({
-                'status': 'success',
-                'document_id': pdf_doc.id,
-                'file_name': pdf_doc.file_name,
-                'extracted_text': extracted_text
-            }, status=200)
-        else:
-            pdf_doc.status = 'failed'
-            pdf_doc.save()
-            return JsonResponse({'error': 'Failed to extract text from PDF.'}, status=500)
+@login_required
+def search_documents_view(request):
+    if request.method == 'GET':
+        text = request.GET.get('q', '').strip() or None
+        try:
+            min_value = _optional_param(request.GET, 'min_value', lambda v: Decimal(str(v)))
+            max_value = _optional_param(request.GET, 'max_value', lambda v: Decimal(str(v)))
+            currency = _optional_param(request.GET, 'currency', lambda v: str(v).upper())
+            limit = _optional_param(request.GET, 'limit', int) or DEFAULT_PRICE_PAGE_SIZE
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if text is None and min_value is None and max_value is None and currency is None:
+            return JsonResponse({'error': "Provide a search text 'q' and/or a price filter."}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': "'limit' must be positive."}, status=400)
+
+        from .search import search_user_catalogs # Local import
+        hits = search_user_catalogs(
+            request.user, text=text, min_value=min_value, max_value=max_value,
+            currency=currency, limit=min(limit, MAX_PRICE_PAGE_SIZE),
+        )
+        return JsonResponse({'status': 'success', 'query': text, 'hits': hits}, status=200)
+    else:
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+
+@csrf_exempt
+@login_required
+def create_batch_view(request):
+    """Starts the extract -> identify -> reprice -> optimize pipeline (see batches.py) over several documents."""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON payload.'}, status=400)
+
+        document_ids = data.get('document_ids')
+        if not isinstance(document_ids, list) or not document_ids or \
+           not all(isinstance(i, int) and not isinstance(i, bool) for i in document_ids):
+            return JsonResponse({'error': "'document_ids' must be a non-empty list of document IDs."}, status=400)
+        document_ids = list(dict.fromkeys(document_ids))
+        if len(document_ids) > settings.PDF_BATCH_MAX_DOCUMENTS:
+            return JsonResponse({'error': f"A batch takes at most {settings.PDF_BATCH_MAX_DOCUMENTS} documents."}, status=400)
+
+        rules = data.get('rules')
+        if rules is not None:
+            from .repricing import RuleSet # Local import
+            try:
+                RuleSet.from_dict(rules)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+        from .utils import SAVE_PROFILES # Local import
+        save_profile = data.get('save_profile') or _default_save_profile(request.user)
+        if not isinstance(save_profile, str) or save_profile not in SAVE_PROFILES:
+            return JsonResponse({'error': f"Unknown save_profile '{save_profile}'. Use one of: {', '.join(SAVE_PROFILES)}."}, status=400)
+
+        documents = list(PdfDocument.objects.filter(id__in=document_ids, user=request.user).only('id'))
+        if len(documents) != len(document_ids):
+            return JsonResponse({'error': 'Document not found or access denied.'}, status=404)
+
+        batch = PdfBatch.objects.create(user=request.user, rules=rules, optimize=bool(data.get('optimize')),
+                                        save_profile=save_profile)
+        PdfBatchItem.objects.bulk_create(PdfBatchItem(batch=batch, document_id=i) for i in document_ids)
+
+        from .batches import start_batch # Local import
+        start_batch(batch.id)
+        return JsonResponse({
+            'status': 'accepted',
+            'batch_id': batch.id,
+            'status_url': request.build_absolute_uri(reverse('batch_status', args=[batch.id])),
+        }, status=202)
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
+
+@login_required
+def batch_status_view(request, batch_id):
+    """Progress of a batch: its status, items per stage and every document's stage."""
+    if request.method == 'GET':
+        try:
+            batch = PdfBatch.objects.get(id=batch_id, user=request.user)
+        except PdfBatch.DoesNotExist:
+            return JsonResponse({'error': 'Batch not found or access denied.'}, status=404)
+
+        from .batches import batch_summary # Local import
+        return JsonResponse(batch_summary(batch), status=200)
+    else:
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+
+@login_required
+async def batch_download_view(request, batch_id):
+    """All outputs of a finished batch as one ZIP, streamed as it is built."""
+    if request.method == 'GET':
+        try:
+            batch = await PdfBatch.objects.aget(id=batch_id, user=await request.auser())
+        except PdfBatch.DoesNotExist:
+            return JsonResponse({'error': 'Batch not found or access denied.'}, status=404)
+        if batch.status != 'completed':
+            return JsonResponse({'error': 'The batch is still running.'}, status=409)
+
+        from .batches import aiter_zip # Local import
+        response = StreamingHttpResponse(aiter_zip(batch), content_type='application/zip')
+        response['Content-Disposition'] = content_disposition_header(True, f'batch_{batch.id}.zip')
+        return response
+    else:
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+
+def metrics_view(request):
+    """Prometheus text-format latency histograms, enabled with PDF_METRICS_ENABLED."""
+    if not getattr(settings, 'PDF_METRICS_ENABLED', False):
+        raise Http404('Metrics are disabled.')
+    if request.method == 'GET':
+        return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    else:
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
@@ -0,0 +1,175 @@
+"""
+Bounded process pool for the CPU-bound PDF work of the async views.
+
+PyMuPDF and Tesseract keep a core busy for the whole call, so the async views
+hand those calls to a pool of PDF_WORKER_PROCESSES processes (the core count
+by default) and keep the event loop free for I/O. At most
+PDF_WORKER_MAX_PENDING calls may be running or queued at once; beyond that
+run_in_worker() raises WorkerPoolBusy straight away, which the views turn
+into a 503 with Retry-After, instead of letting the queue and every client's
+latency grow without bound.
+
+Arguments cross a process boundary, so documents are passed by node-local path
+(storage.document_path()), never as buffers. The phase timings recorded in the
+worker are sent back and added to the request's timings. Requests that asked
+for a cProfile capture (see profiling.py) run their calls in a thread of this
+process instead, where the profiler can see them.
+
+With settings.PDF_WORKER_DAEMON_ADDRESS set, calls go to the long-running,
+pre-warmed worker daemon (daemon.py) instead of a pool of this process.
+
+With settings.PDF_WARM_UP set, warm_up() runs at boot (see apps.py): it
+imports the lazily loaded PDF libraries in this process and starts and warms
+every pool worker, so the first PDF request does not pay for them.
+"""
+from asgiref.sync import sync_to_async
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from .instrumentation import end_request, record_phase, start_request
+from .profiling import profiling_requested
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPoolBusy(Exception):
+    """Raised when PDF_WORKER_MAX_PENDING calls are already running or queued."""
+
+
+_lock = threading.Lock()
+_pool = None
+_pending = 0
+_worker_process = False # True in pool and daemon workers
+
+
+def worker_count():
+    return settings.PDF_WORKER_PROCESSES or os.cpu_count() or 1
+
+
+def max_pending():
+    return settings.PDF_WORKER_MAX_PENDING or 4 * worker_count()
+
+
+def pending_calls():
+    """Calls currently running or queued in the pool."""
+    return _pending
+
+
+def _init_worker(languages=None):
+    # Spawned workers start from scratch; the functions they run may live in
+    # modules (views.py) that need the app registry
+    global _worker_process
+    _worker_process = True
+    import django
+    django.setup()
+    if languages is not None:
+        # settings.PDF_WARM_UP: import PyMuPDF, Pillow and pytesseract and load
+        # the OCR models now rather than in the worker's first call
+        from .daemon import warm_up as warm_process # Local import
+        warm_process(languages)
+
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            languages = None
+            if settings.PDF_WARM_UP:
+                from .daemon import warm_languages # Local import
+                languages = warm_languages()
+            # spawn, not fork: forking a process that runs an event loop and threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=worker_count(), mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker, initargs=(languages,))
+        return _pool
+
+
+def warm_up():
+    """
+    Warms this process and the worker pool, so the first PDF request of a
+    freshly started process does not pay for imports and worker startup.
+
+    The pool only starts a worker when a call finds none idle, so one trivial
+    call per worker is submitted at once to start them all. With the worker
+    daemon, which warms its own workers, only this process is warmed.
+
+    Returns:
+        dict: process_seconds and pool_seconds (None with the worker daemon).
+    """
+    from .daemon import warm_up as warm_process # Local import
+    started = time.perf_counter()
+    warm_process([]) # The imports and MuPDF; OCR only runs in the workers
+    warmed = time.perf_counter()
+
+    pool_seconds = None
+    if not settings.PDF_WORKER_DAEMON_ADDRESS:
+        pool = get_pool()
+        for future in [pool.submit(os.getpid) for _ in range(worker_count())]:
+            future.result()
+        pool_seconds = round(time.perf_counter() - warmed, 4)
+
+    logger.info("Warmed up in %.2fs (this process %.2fs, %s)", time.perf_counter() - started, warmed - started,
+                f"{worker_count()} pool worker(s) {pool_seconds:.2f}s" if pool_seconds is not None
+                else "worker daemon")
+    return {'process_seconds': round(warmed - started, 4), 'pool_seconds': pool_seconds}
+
+
+def _timed_call(func, args, kwargs):
+    # Runs in the worker: collects the phases timed by utils.py for the parent
+    timings, token = start_request()
+    try:
+        return func(*args, **kwargs), timings.phases
+    finally:
+        end_request(token)
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_worker(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) in the process pool and returns its result.
+    func must be a module-level function (it is pickled by name).
+
+    Raises:
+        WorkerPoolBusy: If the pool is at its backpressure limit (or the
+                        worker daemon is unreachable).
+    """
+    global _pending
+    with _lock:
+        if _pending >= max_pending():
+            raise WorkerPoolBusy()
+        _pending += 1
+    try:
+        if profiling_requested():
+            return await sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        if settings.PDF_WORKER_DAEMON_ADDRESS:
+            from .daemon import submit # Local import
+            result, phases = await loop.run_in_executor(None, submit, func, args, kwargs)
+        else:
+            result, phases = await loop.run_in_executor(get_pool(), functools.partial(_timed_call, func, args, kwargs))
+        for phase, seconds in phases.items():
+            record_phase(phase, seconds)
+        return result
+    except BrokenProcessPool:
+        # A worker died (e.g. MuPDF crashed on a malformed file); start a fresh pool next time
+        logger.error("PDF worker pool broke while running %s; restarting it", getattr(func, '__name__', func))
+        shutdown()
+        raise
+    finally:
+        with _lock:
+            _pending -= 1
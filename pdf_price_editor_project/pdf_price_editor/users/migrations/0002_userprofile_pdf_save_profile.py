@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='pdf_save_profile',
+            field=models.CharField(blank=True, choices=[('fast', 'Fast (incremental save)'), ('balanced', 'Balanced'), ('compact', 'Compact (smallest file)')], default='', max_length=10),
+        ),
+    ]
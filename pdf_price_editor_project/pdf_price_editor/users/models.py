@@ -6,12 +6,24 @@ class UserProfile(models.Model):
         ('uk', 'Ukrainian'),
         ('it', 'Italian'),
     ]
+    # Mirrors pdf_processing.utils.SAVE_PROFILES; blank means settings.PDF_DEFAULT_SAVE_PROFILE
+    SAVE_PROFILE_CHOICES = [
+        ('fast', 'Fast (incremental save)'),
+        ('balanced', 'Balanced'),
+        ('compact', 'Compact (smallest file)'),
+    ]
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     preferred_language = models.CharField(
         max_length=10,
         choices=USER_LANGUAGE_CHOICES,
         default='uk'
     )
+    pdf_save_profile = models.CharField(
+        max_length=10,
+        choices=SAVE_PROFILE_CHOICES,
+        blank=True,
+        default=''
+    )
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
@@ -45,7 +45,8 @@ def get_user_profile(request):
                 'email': user.email,
                 'first_name': user.first_name,
                 'last_name': user.last_name,
-                'preferred_language': user.profile.preferred_language
+                'preferred_language': user.profile.preferred_language,
+                'pdf_save_profile': user.profile.pdf_save_profile
             }
             return JsonResponse(profile_data, status=200)
         except UserProfile.DoesNotExist:
@@ -60,6 +61,13 @@ def update_user_profile(request):
         user = request.user
         try:
             data = json.loads(request.body)
+
+            if 'pdf_save_profile' in data and data['pdf_save_profile'] is None:
+                data['pdf_save_profile'] = '' # null resets it to the site default
+            pdf_save_profile = data.get('pdf_save_profile', '')
+            if not isinstance(pdf_save_profile, str) or \
+                    (pdf_save_profile and pdf_save_profile not in dict(UserProfile.SAVE_PROFILE_CHOICES)):
+                return JsonResponse({'error': f"Unknown pdf_save_profile '{pdf_save_profile}'."}, status=400)
             
             # Update User model fields
             user.first_name = data.get('first_name', user.first_name)
@@ -82,10 +90,12 @@ def update_user_profile(request):
             try:
                 profile = user.profile
                 profile.preferred_language = data.get('preferred_language', profile.preferred_language)
+                profile.pdf_save_profile = data.get('pdf_save_profile', profile.pdf_save_profile)
                 profile.save()
             except UserProfile.DoesNotExist:
                 # This should ideally not happen if signals are working correctly
-                UserProfile.objects.create(user=user, preferred_language=data.get('preferred_language', 'uk'))
+                UserProfile.objects.create(user=user, preferred_language=data.get('preferred_language', 'uk'),
+                                           pdf_save_profile=data.get('pdf_save_profile', ''))
             
             return JsonResponse({'status': 'success', 'message': 'Profile updated successfully.'}, status=200)
         except json.JSONDecodeError: